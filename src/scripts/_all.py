@@ -1,7 +1,16 @@
+import os
 import subprocess
 import sys
+import json
 import logging
 import time
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fingerprints import Fingerprints
+import stage_metrics
+import profiling
 
 # Configure logging
 logging.basicConfig(
@@ -15,95 +24,310 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def run_scripts(script_paths):
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# Each stage declares the paths it reads and writes, relative to this
+# directory. A stage depends on every other stage that writes a path it
+# reads (or a path inside one it reads), so independent stages run side by
+# side and a failure only holds back the stages downstream of it. The same
+# declarations drive the fingerprints: a stage whose inputs and outputs are
+# unchanged since it last succeeded is not run again (see fingerprints.py).
+# 'exclude' lists paths inside a stage's outputs that belong to another
+# stage, so that writing them does not make the first stage look stale.
+# A stage that exits 0 but reports items_failed through stage_metrics (API
+# answers it could not get) lets its dependents run, but is not recorded as
+# up to date, so the next run tries those items again.
+STAGES = [
+    {
+        'script': 'flux-image-generation.py',
+        'inputs': ['../content/articles'],
+        'outputs': ['../../public/images/articles'],
+        'exclude': ['../../public/images/articles/small'],
+    },
+    {
+        'script': 'local-compress_images.py',
+        'inputs': ['../../public/images/articles'],
+        'outputs': ['../../public/images/articles/small'],
+    },
+    {
+        'script': 'llm-generality.py',
+        'inputs': ['../content/articles'],
+        'outputs': ['../data/generality.json'],
+    },
+    {
+        'script': 'llm-years.py',
+        'inputs': ['../content/articles'],
+        'outputs': ['../data/years.json'],
+    },
+    {
+        'script': 'local-flashcards.py',
+        'inputs': ['../content/articles', '../data/years.json'],
+        'outputs': ['../data/flashcards.json'],
+    },
+    {
+        'script': 'local-polyhierarchy.py',
+        'inputs': ['../content/articles', '../data/generality.json', '../data/years.json',
+                   '../components/articles/0'],
+        'outputs': ['../data/polyhierarchy.json', '../data/related.json'],
+    },
+]
+
+
+def _resolve(path):
+    return (SCRIPT_DIR / path).resolve()
+
+
+def _overlaps(written, read):
+    """Whether writing `written` can change what reading `read` sees."""
+    return written == read or read in written.parents or written in read.parents
+
+
+def dependencies(stages):
+    """{script: set of scripts it waits for}, from declared inputs and outputs."""
+    deps = {}
+    for stage in stages:
+        inputs = [_resolve(path) for path in stage['inputs']]
+        deps[stage['script']] = {
+            other['script'] for other in stages
+            if other is not stage and any(_overlaps(_resolve(written), read)
+                                          for written in other['outputs'] for read in inputs)
+        }
+    _check_acyclic(deps)
+    return deps
+
+
+def _check_acyclic(deps):
+    visiting, done = set(), set()
+
+    def visit(script, path):
+        if script in done:
+            return
+        if script in visiting:
+            raise ValueError(f"Stage dependency cycle: {' -> '.join(path + [script])}")
+        visiting.add(script)
+        for dep in deps[script]:
+            visit(dep, path + [script])
+        visiting.discard(script)
+        done.add(script)
+
+    for script in deps:
+        visit(script, [])
+
+
+def run_stage(script):
     """
-    Run multiple Python scripts in sequence.
+    Run one script to completion; returns (returncode, stdout, stderr, metrics).
 
-    Args:
-        script_paths (list): List of file paths to Python scripts to run
+    metrics holds wall time, user and system CPU and peak RSS measured from
+    outside, plus whatever the script reported through stage_metrics.
     """
+    with tempfile.TemporaryDirectory(prefix='stage-') as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        env = dict(os.environ, **{stage_metrics.ENV_VAR: str(tmp_dir / 'metrics.json')})
+        start_time = time.time()
+        with open(tmp_dir / 'stdout', 'w+') as stdout, open(tmp_dir / 'stderr', 'w+') as stderr:
+            process = subprocess.Popen([sys.executable, script], cwd=SCRIPT_DIR, env=env,
+                                       stdout=stdout, stderr=stderr, text=True)
+            # wait4 rather than wait() so the child's resource usage comes back with it
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            wall_time = time.time() - start_time
+            stdout.seek(0)
+            stderr.seek(0)
+            out, err = stdout.read(), stderr.read()
+        metrics = {
+            'wall_s': round(wall_time, 3),
+            'user_s': round(rusage.ru_utime, 3),
+            'sys_s': round(rusage.ru_stime, 3),
+            'peak_rss_mb': round(rusage.ru_maxrss / 1024, 1),
+        }
+        try:
+            metrics.update(json.loads((tmp_dir / 'metrics.json').read_text()))
+        except (FileNotFoundError, ValueError):
+            pass
+    return process.returncode, out, err, metrics
+
+
+def _log_result(script, returncode, stdout, stderr, execution_time):
+    if returncode == 0:
+        logger.info(f"✓ {script} completed successfully in {execution_time:.2f}s")
+        if stdout.strip():
+            logger.info(f"Output of {script}:")
+            for line in stdout.strip().split('\n'):
+                if line.strip():
+                    logger.info(f"  {line}")
+        else:
+            logger.info(f"No stdout output from {script}")
+    else:
+        logger.error(f"✗ {script} failed after {execution_time:.2f}s")
+        logger.error(f"Return code: {returncode}")
+        logger.error(f"stderr: {stderr.strip() if stderr else 'None'}")
+
+
+def run_pipeline(stages, jobs=None, force=False):
+    """
+    Run stages as soon as everything they depend on has succeeded.
+
+    A stage whose dependency failed (or was itself skipped) is not run, and
+    unless force is set neither is one that is already up to date. Returns
+    {script: {'status', 'start', 'end'}} with status one of 'ok', 'fresh',
+    'failed' or 'skipped'; times are seconds since the run began. Every
+    stage also gets a line in stage_metrics.RUNS_FILE under this run's id.
+    """
+    deps = dependencies(stages)
+    by_script = {stage['script']: stage for stage in stages}
+    fingerprints = Fingerprints()
+    input_digests = {}
+    pending = [stage['script'] for stage in stages]
+    results = {}
+    running = {}
+    run_start = time.time()
+    run_id = time.strftime('%Y%m%dT%H%M%S', time.localtime(run_start))
+
     logger.info("=" * 60)
-    logger.info("Starting batch script execution")
-    logger.info(f"Total scripts to run: {len(script_paths)}")
+    logger.info(f"Starting pipeline: {len(pending)} stages")
+    for script in pending:
+        logger.info(f"  {script} <- {', '.join(sorted(deps[script])) or '(nothing)'}")
     logger.info("=" * 60)
 
-    for i, script in enumerate(script_paths, 1):
-        logger.info(f"[{i}/{len(script_paths)}] Starting execution of: {script}")
+    with ThreadPoolExecutor(max_workers=jobs or len(pending)) as executor:
+        while pending or running:
+            for script in list(pending):
+                if any(results.get(dep, {}).get('status') in ('failed', 'skipped') for dep in deps[script]):
+                    pending.remove(script)
+                    blocked = [dep for dep in deps[script] if results[dep]['status'] in ('failed', 'skipped')]
+                    logger.warning(f"↷ Skipping {script}: {', '.join(blocked)} did not succeed")
+                    now = time.time() - run_start
+                    results[script] = {'status': 'skipped', 'start': now, 'end': now}
+                elif all(results.get(dep, {}).get('status') in ('ok', 'fresh') for dep in deps[script]):
+                    pending.remove(script)
+                    stage = by_script[script]
+                    inputs = [_resolve(path) for path in stage['inputs']]
+                    outputs = [_resolve(path) for path in stage['outputs']]
+                    exclude = [_resolve(path) for path in stage.get('exclude', [])]
+                    input_digests[script] = fingerprints.input_digest(script, inputs, outputs)
+                    if not force and fingerprints.is_fresh(script, input_digests[script], outputs, exclude):
+                        logger.info(f"✓ {script} is up to date")
+                        now = time.time() - run_start
+                        results[script] = {'status': 'fresh', 'start': now, 'end': now}
+                        continue
+                    logger.info(f"Starting execution of: {script}")
+                    running[executor.submit(run_stage, script)] = (script, time.time() - run_start)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                script, start = running.pop(future)
+                try:
+                    returncode, stdout, stderr, metrics = future.result()
+                except Exception as e:
+                    returncode, stdout, stderr = None, '', str(e)
+                    metrics = {'wall_s': round(time.time() - run_start - start, 3)}
+                _log_result(script, returncode, stdout, stderr, metrics['wall_s'])
+                results[script] = {'status': 'ok' if returncode == 0 else 'failed',
+                                   'start': start, 'end': start + metrics['wall_s'], 'metrics': metrics}
+                outputs = [_resolve(path) for path in by_script[script]['outputs']]
+                exclude = [_resolve(path) for path in by_script[script].get('exclude', [])]
+                if returncode == 0 and not metrics.get('items_failed'):
+                    fingerprints.record(script, input_digests[script], outputs, exclude)
+                else:
+                    if returncode == 0:
+                        logger.warning(f"{script}: {metrics['items_failed']} items failed; "
+                                       f"it will run again next time")
+                    fingerprints.forget(script)
+    fingerprints.save(prune=True)
+
+    for script, result in results.items():
+        stage_metrics.append_record({'run_id': run_id, 'stage': script, 'status': result['status'],
+                                     **result.get('metrics', {})})
+    return results
+
+
+def critical_path(stages, results):
+    """
+    The chain of stages that bounded the run's wall time.
+
+    Walks back from the stage that finished last, each time to the
+    dependency that finished last, i.e. the one that held the stage back.
+    """
+    deps = dependencies(stages)
+    ran = {script: result for script, result in results.items() if result['status'] in ('ok', 'failed')}
+    if not ran:
+        return []
+    path = [max(ran, key=lambda script: ran[script]['end'])]
+    while True:
+        waited_for = [dep for dep in deps[path[-1]] if dep in ran]
+        if not waited_for:
+            break
+        path.append(max(waited_for, key=lambda script: ran[script]['end']))
+    return list(reversed(path))
+
+
+def report(stages, results, total_time):
+    logger.info("=" * 60)
+    for status, label in (('ok', 'succeeded'), ('fresh', 'up to date'), ('failed', 'failed'),
+                          ('skipped', 'skipped')):
+        scripts = [script for script, result in results.items() if result['status'] == status]
+        if scripts:
+            logger.info(f"{label.capitalize()} ({len(scripts)}): {', '.join(scripts)}")
+
+    for script, result in results.items():
+        metrics = result.get('metrics')
+        if result['status'] != 'ok' or not metrics:
+            continue
+        logger.info(f"  {script}: {metrics['wall_s']:.2f}s wall, "
+                    f"{metrics.get('user_s', 0) + metrics.get('sys_s', 0):.2f}s CPU, "
+                    f"{metrics.get('peak_rss_mb', 0):.0f}MB peak RSS, "
+                    f"{metrics.get('items_processed', 0)} processed / {metrics.get('items_skipped', 0)} skipped / "
+                    f"{metrics.get('items_failed', 0)} failed, "
+                    f"{metrics.get('api_calls', 0)} API calls")
+    logger.info(f"Run records: {stage_metrics.RUNS_FILE}")
+
+    path = critical_path(stages, results)
+    if path:
+        steps = [f"{script} ({results[script]['end'] - results[script]['start']:.2f}s)" for script in path]
+        logger.info(f"Critical path: {' -> '.join(steps)}")
+        busy = sum(result['end'] - result['start'] for result in results.values())
+        logger.info(f"Critical path ends at {results[path[-1]]['end']:.2f}s; "
+                    f"stage time summed over all stages: {busy:.2f}s")
+    logger.info(f"Total execution time: {total_time:.2f} seconds")
+    logger.info("=" * 60)
 
-        try:
-            # Record start time
-            start_time = time.time()
-
-            # Run each script using subprocess
-            result = subprocess.run([sys.executable, script],
-                                    capture_output=True,
-                                    text=True,
-                                    check=True)
-
-            # Calculate execution time
-            execution_time = time.time() - start_time
-
-            # Log successful completion
-            logger.info(f"[{i}/{len(script_paths)}] ✓ {script} completed successfully in {execution_time:.2f}s")
-
-            # Print output of each script with better formatting
-            if result.stdout.strip():
-                logger.info(f"Output of {script}:")
-                # Clean up the output and log line by line
-                for line in result.stdout.strip().split('\n'):
-                    if line.strip():
-                        logger.info(f"  {line}")
-            else:
-                logger.info(f"No stdout output from {script}")
-
-        except subprocess.CalledProcessError as e:
-            # Calculate execution time even for failures
-            execution_time = time.time() - start_time if 'start_time' in locals() else 0
-
-            # Handle any errors that occur when running scripts
-            logger.error(f"[{i}/{len(script_paths)}] ✗ {script} failed after {execution_time:.2f}s")
-            logger.error(f"Return code: {e.returncode}")
-            logger.error(f"stderr: {e.stderr.strip() if e.stderr else 'None'}")
-
-            # Optionally, you can choose to stop further script execution
-            # break
-
-        except Exception as e:
-            # Handle unexpected errors
-            execution_time = time.time() - start_time if 'start_time' in locals() else 0
-            logger.error(f"[{i}/{len(script_paths)}] ✗ {script} encountered unexpected error after {execution_time:.2f}s")
-            logger.error(f"Error: {str(e)}")
-            # break
 
 def main():
+    parser = argparse.ArgumentParser(description='Run the content pipeline, independent stages in parallel.')
+    parser.add_argument('--jobs', type=int, help='Run at most this many stages at once (default: no limit)')
+    parser.add_argument('--force', action='store_true', help='Run every stage, even those that are up to date')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Profile every stage that runs (see profiling.py); output goes to {profiling.PROFILE_DIR}')
+    parser.add_argument('--list', action='store_true', help='Print the stages and their dependencies, then exit')
+    args = parser.parse_args()
+
+    if args.list:
+        deps = dependencies(STAGES)
+        for stage in STAGES:
+            print(f"{stage['script']} <- {', '.join(sorted(deps[stage['script']])) or '(nothing)'}")
+        return
+
+    if args.profile:
+        # Stages inherit the environment, so each one profiles itself
+        os.environ[profiling.ENV_VAR] = '1'
+
     # Record overall start time
     overall_start_time = time.time()
 
     logger.info("Script execution started by user")
 
-    # List of scripts to run in order
-    scripts_to_run = [
-        'flux-image-generation.py',
-        'local-compress_images.py',
-        'llm-generality.py',
-        'llm-years.py',
-        'local-flashcards.py',
-        'local-polyhierarchy.py'
-    ]
-
-    logger.info(f"Script execution order: {', '.join(scripts_to_run)}")
-
     try:
-        run_scripts(scripts_to_run)
-
-        # Calculate total execution time
+        results = run_pipeline(STAGES, args.jobs, args.force)
         total_time = time.time() - overall_start_time
+        report(STAGES, results, total_time)
 
-        logger.info("=" * 60)
+        if any(result['status'] in ('failed', 'skipped') for result in results.values()):
+            logger.error("✗ Pipeline finished with failures")
+            sys.exit(1)
         logger.info("✓ All scripts completed successfully!")
-        logger.info(f"Total execution time: {total_time:.2f} seconds")
-        logger.info(f"Average time per script: {total_time/len(scripts_to_run):.2f} seconds")
-        logger.info("=" * 60)
 
     except KeyboardInterrupt:
         total_time = time.time() - overall_start_time
@@ -112,11 +336,5 @@ def main():
         logger.warning("Some scripts may not have completed")
         sys.exit(1)
 
-    except Exception as e:
-        total_time = time.time() - overall_start_time
-        logger.error(f"✗ Unexpected error in main execution: {str(e)}")
-        logger.error(f"Execution time before error: {total_time:.2f} seconds")
-        sys.exit(1)
-
 if __name__ == '__main__':
     main()
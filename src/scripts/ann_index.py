@@ -0,0 +1,160 @@
+import logging
+import numpy as np
+import scipy.sparse as sp
+from similarity import TOP_K, peak_rss_mb, similarity_rows, symmetrize
+from profiling import span
+
+# Approximate nearest neighbors for very large vocabularies.
+#
+# A pure-NumPy IVF index: rows are clustered with spherical k-means into
+# inverted lists, and each row is only compared against the rows of its
+# n_probe closest lists. n_probe is the recall/speed knob; probing every list
+# gives the exact result.
+
+DEFAULT_PROBE = 8
+KMEANS_ITERATIONS = 10
+# Sparse centroids keep only their heaviest weights so they stay cheap
+CENTROID_NNZ = 2000
+RECALL_SAMPLE = 200
+
+
+def _normalize(M):
+    if sp.issparse(M):
+        norms = np.sqrt(np.asarray(M.multiply(M).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sp.csr_matrix(sp.diags(1 / norms) @ M)
+    norms = np.linalg.norm(M, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return M / norms
+
+
+def _prune(C, nnz):
+    """Keep the nnz largest weights of each sparse centroid row."""
+    C = sp.csr_matrix(C)
+    rows, cols, vals = [], [], []
+    for i in range(C.shape[0]):
+        start, end = C.indptr[i], C.indptr[i + 1]
+        data, indices = C.data[start:end], C.indices[start:end]
+        if len(data) > nnz:
+            top = np.argpartition(data, -nnz)[-nnz:]
+            data, indices = data[top], indices[top]
+        rows.append(np.full(len(data), i))
+        cols.append(indices)
+        vals.append(data)
+    return sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=C.shape)
+
+
+def _scores(X, C):
+    scores = X @ C.T
+    return scores.toarray() if sp.issparse(scores) else np.asarray(scores)
+
+
+def train_centroids(X, n_lists, seed=0):
+    """Spherical k-means on a sample of the rows of X."""
+    rng = np.random.default_rng(seed)
+    n_rows = X.shape[0]
+    sample = rng.choice(n_rows, size=min(n_rows, 40 * n_lists), replace=False)
+    X_sample = X[sample]
+    C = X_sample[rng.choice(len(sample), size=n_lists, replace=False)]
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = _scores(X_sample, C).argmax(axis=1)
+        members = sp.csr_matrix((np.ones(len(sample)), (assignment, np.arange(len(sample)))),
+                                shape=(n_lists, len(sample)))
+        C = _normalize(members @ X_sample)
+        if sp.issparse(C):
+            C = _prune(C, CENTROID_NNZ)
+    return C
+
+
+@span('similarity')
+def ivf_similarity(X, k=TOP_K, min_similarity=None, n_probe=DEFAULT_PROBE, n_lists=None, seed=0):
+    """
+    Approximate version of similarity.topk_similarity using an IVF index.
+
+    Returns the same symmetric sparse neighbor graph shape: each row's
+    approximate top-k plus any scanned neighbor >= min_similarity.
+    """
+    n_rows = X.shape[0]
+    n_lists = n_lists or max(1, int(np.sqrt(n_rows)))
+    n_probe = min(n_probe, n_lists)
+    k = min(k, n_rows - 1)
+
+    C = train_centroids(X, n_lists, seed)
+    centroid_scores = _scores(X, C)
+    assignment = centroid_scores.argmax(axis=1)
+    probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+    best_vals = np.full((n_rows, k), -np.inf, dtype=np.float32)
+    best_idx = np.zeros((n_rows, k), dtype=np.intp)
+    out_rows, out_cols, out_vals = [], [], []
+    scanned = 0
+
+    for inverted_list in range(n_lists):
+        docs = np.flatnonzero(assignment == inverted_list)
+        queries = np.flatnonzero((probes == inverted_list).any(axis=1))
+        if not len(docs) or not len(queries):
+            continue
+        block = _scores(X[queries], X[docs]).astype(np.float32)
+        block[queries[:, None] == docs[None, :]] = -np.inf
+        scanned += block.size
+
+        if min_similarity is not None:
+            r, c = np.nonzero(block >= min_similarity)
+            out_rows.append(queries[r])
+            out_cols.append(docs[c])
+            out_vals.append(block[r, c])
+
+        # Merge this list's candidates into each query's running top-k
+        candidate_vals = np.concatenate([best_vals[queries], block], axis=1)
+        candidate_idx = np.concatenate([best_idx[queries], np.broadcast_to(docs, block.shape)], axis=1)
+        top = np.argpartition(candidate_vals, -k, axis=1)[:, -k:]
+        best_vals[queries] = np.take_along_axis(candidate_vals, top, axis=1)
+        best_idx[queries] = np.take_along_axis(candidate_idx, top, axis=1)
+
+    found = best_vals > 0
+    rows = np.concatenate(out_rows + [np.nonzero(found)[0]])
+    cols = np.concatenate(out_cols + [best_idx[found]])
+    vals = np.concatenate(out_vals + [best_vals[found]])
+
+    # A pair can come from both the threshold scan and the top-k merge; keep
+    # one copy, since the sparse constructor would otherwise sum them
+    order = np.lexsort((cols, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    unique = np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])]
+    S = sp.csr_matrix((vals[unique], (rows[unique], cols[unique])), shape=(n_rows, n_rows))
+    S = symmetrize(S)
+
+    logging.info(f"ANN: {n_lists} lists, probing {n_probe}, scanned {scanned / max(n_rows * n_rows, 1):.1%} "
+                 f"of all pairs, kept {S.nnz} neighbors, peak RSS {peak_rss_mb():.0f} MB")
+    return S
+
+
+def recall_check(X, approximate, k=TOP_K, min_similarity=None, sample=RECALL_SAMPLE, seed=0):
+    """
+    Compare approximate neighbors with exact ones on a sample of rows.
+
+    Returns (top-k recall, recall of pairs >= min_similarity).
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(X.shape[0], size=min(sample, X.shape[0]), replace=False)
+    exact = similarity_rows(X, rows, k, min_similarity)
+    approximate = sp.csr_matrix(approximate)
+
+    topk_hits = topk_total = threshold_hits = threshold_total = 0
+    for r, row in enumerate(rows):
+        exact_row = exact.getrow(r)
+        found = set(approximate.indices[approximate.indptr[row]:approximate.indptr[row + 1]])
+        top = exact_row.indices[np.argsort(-exact_row.data)[:k]]
+        topk_hits += sum(1 for j in top if j in found)
+        topk_total += len(top)
+        if min_similarity is not None:
+            strong = exact_row.indices[exact_row.data >= min_similarity]
+            threshold_hits += sum(1 for j in strong if j in found)
+            threshold_total += len(strong)
+
+    topk_recall = topk_hits / topk_total if topk_total else 1.0
+    threshold_recall = threshold_hits / threshold_total if threshold_total else 1.0
+    logging.info(f"ANN recall on {len(rows)} sampled rows: top-{k} {topk_recall:.3f}, "
+                 f"above threshold {threshold_recall:.3f}")
+    return topk_recall, threshold_recall
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from http_client import APIError, base_url, get, post
+
+# Offline bulk requests through the OpenAI Batch API.
+#
+# A job is a set of chat completion bodies keyed by custom_id. It is written
+# to a JSONL file, uploaded, submitted as a batch, polled until it finishes
+# and its output downloaded. Every step is recorded in
+# .cache/batches/<name>.json, so an interrupted run picks the same batch up
+# again instead of paying for it twice; the record is removed by finish()
+# once the caller has merged the results. Creating the batch is never
+# retried blindly: a run that stopped after the upload first looks for a
+# batch already made from that file and only creates one if there is none.
+#
+# OPENAI_BASE_URL (see http_client.base_url) points the whole cycle at
+# another server, e.g. the local stand-in in fake_batch_server.py.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+JOBS_DIR = SCRIPT_DIR / '.cache' / 'batches'
+COMPLETION_WINDOW = '24h'
+POLL_INTERVAL = 30
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def _headers(api_key):
+    return {'Authorization': f'Bearer {api_key}'}
+
+
+def _job_file(name):
+    return JOBS_DIR / f'{name}.json'
+
+
+def _save_job(job):
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = JOBS_DIR / f".{job['name']}.json.{os.getpid()}.tmp"
+    tmp_file.write_text(json.dumps(job, indent=2))
+    tmp_file.replace(_job_file(job['name']))
+
+
+def load_job(name):
+    """The unfinished job recorded under name, or None."""
+    try:
+        return json.loads(_job_file(name).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_batch_file(requests, path, endpoint='/v1/chat/completions'):
+    """Write {custom_id: body} as Batch API input lines."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for custom_id, body in requests.items():
+            f.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': endpoint, 'body': body},
+                               ensure_ascii=False) + '\n')
+
+
+def submit(name, requests, api_key, meta=None):
+    """
+    Upload {custom_id: body} as a batch input file; returns the job record.
+
+    meta is stored with the job and handed back on resume, so callers can
+    keep whatever they need to merge results (e.g. the slugs per custom_id).
+    The job is saved with the file id before create() is called on it.
+    """
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    input_file = JOBS_DIR / f'{name}.input.jsonl'
+    write_batch_file(requests, input_file)
+    job = {'name': name, 'input_file': str(input_file), 'meta': meta or {}, 'submitted': time.time()}
+
+    upload = post(f"{base_url()}/files", headers=_headers(api_key), data={'purpose': 'batch'},
+                  files={'file': (input_file.name, input_file.read_bytes(), 'application/jsonl')}).json()
+    job['input_file_id'] = upload['id']
+    _save_job(job)
+    logging.info(f"Uploaded {len(requests)} requests as {upload['id']}")
+    return job
+
+
+def find_batch(input_file_id, api_key):
+    """The most recent batch created from input_file_id, or None."""
+    listing = get(f"{base_url()}/batches", headers=_headers(api_key)).json()
+    for batch in listing.get('data') or []:
+        if batch.get('input_file_id') == input_file_id:
+            return batch
+    return None
+
+
+def create(job, api_key):
+    """
+    Start the batch for an uploaded job; returns the updated job.
+
+    A batch already created from the job's file (by a run that stopped
+    before it could save the id) is adopted instead of starting a second
+    one, and the create request itself is not retried once sent.
+    """
+    batch = find_batch(job['input_file_id'], api_key)
+    if batch:
+        logging.info(f"Found batch {batch['id']} already created from {job['input_file_id']}")
+    else:
+        batch = post(f"{base_url()}/batches", headers=_headers(api_key), retry_responses=False, json={
+            'input_file_id': job['input_file_id'],
+            'endpoint': '/v1/chat/completions',
+            'completion_window': COMPLETION_WINDOW,
+        }).json()
+        logging.info(f"Submitted batch {batch['id']}")
+    job['batch_id'] = batch['id']
+    job['status'] = batch.get('status')
+    _save_job(job)
+    return job
+
+
+def wait(job, api_key, poll_interval=POLL_INTERVAL):
+    """Poll until the batch reaches a terminal status; returns the updated job."""
+    while True:
+        batch = get(f"{base_url()}/batches/{job['batch_id']}", headers=_headers(api_key)).json()
+        job['status'] = batch.get('status')
+        job['output_file_id'] = batch.get('output_file_id')
+        job['error_file_id'] = batch.get('error_file_id')
+        _save_job(job)
+        counts = batch.get('request_counts') or {}
+        logging.info(f"Batch {job['batch_id']}: {job['status']} "
+                     f"({counts.get('completed', 0)}/{counts.get('total', '?')} done, {counts.get('failed', 0)} failed)")
+        if job['status'] in TERMINAL_STATUSES:
+            return job
+        time.sleep(poll_interval)
+
+
+def results(job, api_key):
+    """
+    Message contents of a finished batch.
+
+    Returns ({custom_id: content}, {custom_id: error}); custom_ids that are
+    in neither were not answered (e.g. the batch expired).
+    """
+    contents, errors = {}, {}
+    for file_key in ('output_file_id', 'error_file_id'):
+        if not job.get(file_key):
+            continue
+        text = get(f"{base_url()}/files/{job[file_key]}/content", headers=_headers(api_key)).text
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get('response') or {}
+            body = response.get('body') or {}
+            try:
+                if response.get('status_code') != 200:
+                    raise APIError(f"HTTP {response.get('status_code')}")
+                contents[item['custom_id']] = body['choices'][0]['message']['content']
+            except (APIError, KeyError, IndexError, TypeError) as e:
+                errors[item['custom_id']] = str(item.get('error') or body.get('error') or e)
+    return contents, errors
+
+
+def finish(job):
+    """Forget a job once its results have been merged."""
+    for path in (_job_file(job['name']), Path(job['input_file'])):
+        path.unlink(missing_ok=True)
+
+
+def run(name, requests, api_key, meta=None, poll_interval=POLL_INTERVAL):
+    """
+    Submit a job, or resume the unfinished one recorded under name, and wait for it.
+
+    Returns (job, contents, errors). When resuming, the job's own meta is
+    what describes its results, not the meta passed in.
+    """
+    job = load_job(name)
+    if job and job.get('batch_id'):
+        logging.info(f"Resuming batch {job['batch_id']} submitted {time.ctime(job['submitted'])}")
+    else:
+        if job and job.get('input_file_id'):
+            logging.info(f"Resuming upload {job['input_file_id']} made {time.ctime(job['submitted'])}")
+        else:
+            job = submit(name, requests, api_key, meta)
+        job = create(job, api_key)
+    job = wait(job, api_key, poll_interval)
+    contents, errors = results(job, api_key)
+    if job['status'] != 'completed':
+        logging.warning(f"Batch {job['batch_id']} ended as {job['status']}")
+    return job, contents, errors
@@ -0,0 +1,138 @@
+import sys
+import json
+import time
+import argparse
+import logging
+import subprocess
+import tracemalloc
+import importlib.util
+from pathlib import Path
+
+# Compare the CSR/csgraph graph build in local-polyhierarchy.py against the
+# networkx implementation it replaced. Each backend runs in its own
+# subprocess so that peak RSS is measured in isolation.
+#
+#   python benchmarks/graph_backends.py [--articles DIR] [--repeat N]
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+BACKENDS = ['networkx', 'csgraph']
+
+
+def load_polyhierarchy():
+    """Import local-polyhierarchy.py, whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location('polyhierarchy', SCRIPTS_DIR / 'local-polyhierarchy.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def networkx_graph(terms, similarity_matrix, threshold):
+    """The networkx build path: bulk edges, isolate fallback, chained components."""
+    import networkx as nx
+    import numpy as np
+    import scipy.sparse as sp
+
+    term_list = list(terms.keys())
+    names = np.array(term_list, dtype=object)
+    similarity_matrix = sp.csr_matrix(similarity_matrix)
+
+    upper = sp.triu(similarity_matrix, k=1).tocoo()
+    above = upper.data > threshold
+    G = nx.Graph()
+    G.add_nodes_from(term_list)
+    G.add_weighted_edges_from(zip(names[upper.row[above]], names[upper.col[above]],
+                                  upper.data[above].astype(float).tolist()))
+
+    for node in list(nx.isolates(G)):
+        i = term_list.index(node)
+        row = similarity_matrix.getrow(i)
+        if row.nnz:
+            G.add_edge(node, term_list[row.indices[row.data.argmax()]], weight=float(row.data.max()))
+
+    if not nx.is_connected(G):
+        components = list(nx.connected_components(G))
+        for i in range(len(components) - 1):
+            G.add_edge(next(iter(components[i])), next(iter(components[i + 1])), weight=threshold)
+
+    hierarchy = {}
+    for node in G.nodes():
+        neighbors = list(G.neighbors(node))
+        if neighbors:
+            hierarchy[node] = {neighbor: G.get_edge_data(node, neighbor)['weight'] for neighbor in neighbors}
+    return hierarchy
+
+
+def run_backend(backend, articles, repeat):
+    """Time one backend in this process and print a JSON result line."""
+    logging.disable(logging.INFO)
+    polyhierarchy = load_polyhierarchy()
+    from similarity import peak_rss_mb
+
+    terms = polyhierarchy.parse_markdown_files(articles)
+    similarity_matrix = polyhierarchy.calculate_similarity(terms)
+    threshold = polyhierarchy.SIMILARITY_THRESHOLD
+    rss_before = peak_rss_mb()
+
+    def build():
+        if backend == 'networkx':
+            return networkx_graph(terms, similarity_matrix, threshold)
+        adjacency = polyhierarchy.create_graph(terms, similarity_matrix, threshold)
+        return polyhierarchy.create_hierarchy(adjacency, terms)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hierarchy = build()
+        timings.append(time.perf_counter() - start)
+
+    # Allocation peak from a separate run, since tracing skews the timings
+    tracemalloc.start()
+    build()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'backend': backend,
+        'terms': len(terms),
+        'edges': sum(len(children) for children in hierarchy.values()) // 2,
+        'best_seconds': min(timings),
+        'traced_peak_mb': traced_peak / 1e6,
+        'rss_before_mb': rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark networkx vs csgraph graph construction.')
+    parser.add_argument('--articles', default=str(SCRIPTS_DIR / '..' / 'content' / 'articles'),
+                        help='Directory of markdown articles to build the graph from')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per backend')
+    parser.add_argument('--backend', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_backend(args.backend, args.articles, args.repeat)
+        return
+
+    results = []
+    for backend in BACKENDS:
+        output = subprocess.run(
+            [sys.executable, __file__, '--backend', backend,
+             '--articles', args.articles, '--repeat', str(args.repeat)],
+            capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"{'backend':<10} {'terms':>7} {'edges':>8} {'build s':>9} {'traced MB':>10} {'peak RSS MB':>12}")
+    for result in results:
+        print(f"{result['backend']:<10} {result['terms']:>7} {result['edges']:>8} "
+              f"{result['best_seconds']:>9.4f} {result['traced_peak_mb']:>10.1f} {result['peak_rss_mb']:>12.0f}")
+    baseline, candidate = results
+    print(f"\ncsgraph speedup: {baseline['best_seconds'] / candidate['best_seconds']:.1f}x, "
+          f"traced memory: {baseline['traced_peak_mb'] / max(candidate['traced_peak_mb'], 1e-9):.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
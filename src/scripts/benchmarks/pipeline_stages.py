@@ -0,0 +1,189 @@
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import importlib.util
+from pathlib import Path
+
+# Scaling benchmark for the content pipeline's stages on synthetic corpora
+# (see synthetic_corpus.py) of 1k, 10k and 100k articles. Each size runs in
+# its own subprocess so peak RSS is measured in isolation; every stage is
+# timed untraced, then run once more under tracemalloc for its allocation
+# peak. Results are appended to benchmarks/results.jsonl with the commit
+# they were measured at, so scaling curves can be followed across changes.
+#
+#   python benchmarks/pipeline_stages.py [--sizes 1000 10000] [--repeat N] [--no-trace]
+#
+# Corpora are generated once into .cache/benchmarks and reused.
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+CORPUS_ROOT = SCRIPTS_DIR / '.cache' / 'benchmarks'
+RESULTS_FILE = Path(__file__).resolve().parent / 'results.jsonl'
+DEFAULT_SIZES = [1000, 10000, 100000]
+STAGES = ['parse_markdown_files', 'parse_markdown_files:warm', 'calculate_similarity',
+          'create_graph', 'create_polyhierarchy', 'create_flashcards']
+
+
+def load_script(name, filename):
+    """Import a script whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def use_corpus(corpus_dir):
+    """Point the metadata store and corpus index at a synthetic corpus instead of src/."""
+    import metadata_store
+    import corpus_index
+    metadata_store.DB_FILE = corpus_dir / 'metadata.sqlite'
+    metadata_store.DATA_DIR = corpus_dir / 'data'
+    metadata_store.COMPONENTS_DIR = corpus_dir / 'components'
+    corpus_index.CACHE_FILE = corpus_dir / 'corpus-index.json'
+    # Import years.json and generality.json now rather than inside a timed stage
+    metadata_store.connect().close()
+
+
+def stage_steps(corpus_dir, output_dir):
+    """
+    {stage: (setup, run)} in pipeline order.
+
+    setup() is untimed and returns the arguments for run(); each stage's
+    result feeds the next one's setup through `state`.
+    """
+    import corpus_index
+    polyhierarchy = load_script('polyhierarchy', 'local-polyhierarchy.py')
+    flashcards = load_script('flashcards', 'local-flashcards.py')
+    articles_dir = corpus_dir / 'articles'
+    threshold = polyhierarchy.SIMILARITY_THRESHOLD
+    state = {}
+
+    def cold_parse():
+        corpus_index.CACHE_FILE.unlink(missing_ok=True)
+        return (articles_dir,)
+
+    def keep(name, function):
+        def run(*args):
+            state[name] = function(*args)
+            return state[name]
+        return run
+
+    def hierarchy_inputs():
+        hierarchy = polyhierarchy.create_hierarchy(state['adjacency'], state['terms'])
+        return hierarchy, polyhierarchy.assign_ids(hierarchy, state['terms']), state['terms']
+
+    return {
+        'parse_markdown_files': (cold_parse, keep('terms', polyhierarchy.parse_markdown_files)),
+        'parse_markdown_files:warm': (lambda: (articles_dir,), keep('terms', polyhierarchy.parse_markdown_files)),
+        'calculate_similarity': (lambda: (state['terms'], threshold),
+                                 keep('similarity', polyhierarchy.calculate_similarity)),
+        'create_graph': (lambda: (state['terms'], state['similarity'], threshold),
+                         keep('adjacency', polyhierarchy.create_graph)),
+        'create_polyhierarchy': (hierarchy_inputs, polyhierarchy.create_polyhierarchy),
+        'create_flashcards': (lambda: (articles_dir, output_dir / 'flashcards.json'), flashcards.create_flashcards),
+    }
+
+
+def run_size(size, seed, repeat, trace):
+    """Benchmark every stage at one corpus size in this process, printing a JSON line per stage."""
+    from synthetic_corpus import ensure_corpus
+    from similarity import peak_rss_mb
+
+    corpus_dir = ensure_corpus(CORPUS_ROOT, size, seed)
+    logging.disable(logging.WARNING)
+    use_corpus(corpus_dir)
+    output_dir = Path(tempfile.mkdtemp(prefix='bench-'))
+    try:
+        steps = stage_steps(corpus_dir, output_dir)
+        for stage in STAGES:
+            setup, run = steps[stage]
+            timings = []
+            for _ in range(repeat):
+                args = setup()
+                start = time.perf_counter()
+                run(*args)
+                timings.append(time.perf_counter() - start)
+            peak_rss = peak_rss_mb()
+
+            traced_peak = None
+            if trace:
+                args = setup()
+                tracemalloc.start()
+                run(*args)
+                _, traced_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            print(json.dumps({
+                'stage': stage,
+                'best_seconds': min(timings),
+                'mean_seconds': sum(timings) / len(timings),
+                'traced_peak_mb': traced_peak / 1e6 if traced_peak is not None else None,
+                'peak_rss_mb': peak_rss,
+            }), flush=True)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on synthetic corpora.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Corpus sizes in articles')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions per stage')
+    parser.add_argument('--no-trace', action='store_true', help='Skip the tracemalloc run of each stage')
+    parser.add_argument('--no-save', action='store_true', help=f'Do not append to {RESULTS_FILE.name}')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size:
+        run_size(args.size, args.seed, args.repeat, not args.no_trace)
+        return
+
+    run = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+    }
+    results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size} articles...", file=sys.stderr)
+        command = [sys.executable, __file__, '--size', str(size), '--seed', str(args.seed),
+                   '--repeat', str(args.repeat)] + (['--no-trace'] if args.no_trace else [])
+        output = subprocess.run(command, capture_output=True, text=True, check=True)
+        for line in output.stdout.splitlines():
+            if line.startswith('{'):
+                results.append({**run, 'articles': size, **json.loads(line)})
+
+    if not args.no_save:
+        with open(RESULTS_FILE, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+
+    print(f"{'articles':>9} {'stage':<26} {'best s':>9} {'traced MB':>10} {'peak RSS MB':>12}")
+    for result in results:
+        traced = f"{result['traced_peak_mb']:>10.1f}" if result['traced_peak_mb'] is not None else f"{'-':>10}"
+        print(f"{result['articles']:>9} {result['stage']:<26} {result['best_seconds']:>9.4f} "
+              f"{traced} {result['peak_rss_mb']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
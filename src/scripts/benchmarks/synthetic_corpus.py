@@ -0,0 +1,130 @@
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+
+# Deterministic synthetic article trees for benchmarking the content pipeline.
+#
+# Articles have the same frontmatter (slug, summary, title) and roughly the
+# same length as src/content/articles: a one-sentence summary and three
+# paragraphs, about 1.8 KB each. Words come from a Zipf-distributed
+# vocabulary of made-up words, mixed with words specific to one of many
+# topics, so TF-IDF similarity forms clusters the way real terms do rather
+# than a uniform haze. years.json and generality.json are written alongside
+# in the same shape as src/data.
+#
+#   python benchmarks/synthetic_corpus.py OUT_DIR --articles 10000
+#
+# OUT_DIR/articles/*.md, OUT_DIR/data/years.json, OUT_DIR/data/generality.json
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'shi', 'den', 'par', 'gra', 'tor',
+             'lex', 'qui', 'ban', 'sel', 'mor', 'fin', 'zen', 'cro', 'pha', 'tiv', 'nal', 'ex']
+VOCABULARY_SIZE = 12000
+ZIPF_EXPONENT = 1.1
+ARTICLES_PER_TOPIC = 25
+TOPIC_WORDS = 40
+TOPIC_SHARE = 0.3  # fraction of an article's words drawn from its topic
+PARAGRAPHS = 3
+PARAGRAPH_WORDS = (45, 75)
+SUMMARY_WORDS = (12, 24)
+UNKNOWN_YEAR_SHARE = 0.05
+N_SCORES = 7
+
+
+def make_vocabulary(rng, size=VOCABULARY_SIZE):
+    """size distinct made-up words of one to three syllables, in random order."""
+    words = set()
+    while len(words) < size:
+        n = rng.integers(1, 4)
+        words.add(''.join(rng.choice(SYLLABLES, n)))
+    return rng.permutation(sorted(words))
+
+
+def _sentences(words, rng):
+    """Join words into capitalized sentences of 8 to 20 words."""
+    sentences, i = [], 0
+    while i < len(words):
+        length = int(rng.integers(8, 21))
+        sentence = ' '.join(words[i:i + length])
+        sentences.append(sentence[0].upper() + sentence[1:] + '.')
+        i += length
+    return ' '.join(sentences)
+
+
+def generate(out_dir, n_articles, seed=0):
+    """Write n_articles articles plus years.json and generality.json under out_dir."""
+    rng = np.random.default_rng(seed)
+    out_dir = Path(out_dir)
+    articles_dir = out_dir / 'articles'
+    data_dir = out_dir / 'data'
+    articles_dir.mkdir(parents=True, exist_ok=True)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    vocabulary = make_vocabulary(rng)
+    ranks = np.arange(1, len(vocabulary) + 1)
+    background = ranks ** -ZIPF_EXPONENT
+    background_cdf = np.cumsum(background) / background.sum()
+    n_topics = max(1, n_articles // ARTICLES_PER_TOPIC)
+    # Topic words come from the rarer half, so they stand out under idf
+    topic_words = rng.integers(len(vocabulary) // 2, len(vocabulary), size=(n_topics, TOPIC_WORDS))
+
+    years, generality = {}, {}
+    slugs = set()
+    for i in range(n_articles):
+        topic = rng.integers(n_topics)
+        n_words = int(rng.integers(*SUMMARY_WORDS)) + sum(int(rng.integers(*PARAGRAPH_WORDS)) for _ in range(PARAGRAPHS))
+        from_topic = rng.random(n_words) < TOPIC_SHARE
+        word_ids = np.where(from_topic,
+                            rng.choice(topic_words[topic], n_words),
+                            np.searchsorted(background_cdf, rng.random(n_words)))
+        words = vocabulary[word_ids].tolist()
+
+        title_words = vocabulary[rng.choice(topic_words[topic], rng.integers(1, 4), replace=False)]
+        title = ' '.join(word.capitalize() for word in title_words)
+        slug = '-'.join(title_words)
+        if slug in slugs:
+            slug = f'{slug}-{i}'
+            title = f'{title} {i}'
+        slugs.add(slug)
+
+        summary_length = int(rng.integers(*SUMMARY_WORDS))
+        summary, body = words[:summary_length], words[summary_length:]
+        per_paragraph = -(-len(body) // PARAGRAPHS)
+        paragraphs = [_sentences(body[start:start + per_paragraph], rng) for start in range(0, len(body), per_paragraph)]
+
+        (articles_dir / f'{slug}.md').write_text(
+            f"---\nslug: {slug}\nsummary: {_sentences(summary, rng)}\ntitle: {title}\n---\n\n"
+            + '\n\n'.join(paragraphs) + '\n', encoding='utf-8')
+
+        years[slug] = 0 if rng.random() < UNKNOWN_YEAR_SHARE else int(rng.integers(1950, 2025))
+        generality[slug] = [round(float(score), 3) for score in rng.random(N_SCORES)]
+
+    with open(data_dir / 'years.json', 'w', encoding='utf-8') as f:
+        json.dump(years, f, sort_keys=True, indent=2)
+    with open(data_dir / 'generality.json', 'w', encoding='utf-8') as f:
+        json.dump(generality, f, indent=2)
+    return articles_dir, data_dir
+
+
+def ensure_corpus(root, n_articles, seed=0):
+    """The corpus for (n_articles, seed) under root, generated on first use."""
+    out_dir = Path(root) / f'corpus-{n_articles}-seed{seed}'
+    done_marker = out_dir / '.complete'
+    if not done_marker.exists():
+        generate(out_dir, n_articles, seed)
+        done_marker.touch()
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic article corpus for benchmarks.')
+    parser.add_argument('out_dir', help='Directory to write articles/ and data/ into')
+    parser.add_argument('--articles', type=int, default=1000, help='Number of articles')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    articles_dir, data_dir = generate(args.out_dir, args.articles, args.seed)
+    print(f"Wrote {args.articles} articles to {articles_dir} and metadata to {data_dir}")
+
+
+if __name__ == "__main__":
+    main()
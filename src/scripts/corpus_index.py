@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import frontmatter
+
+# Shared, persisted index of src/content/articles.
+#
+# Every pipeline stage used to re-read and re-parse every article with its own
+# parser. load_corpus() parses the directory once, caches the result on disk
+# keyed by file mtime and size, and only re-parses files that changed since
+# the last run.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+ARTICLES_DIR = SCRIPT_DIR / '..' / 'content' / 'articles'
+CACHE_FILE = SCRIPT_DIR / '.cache' / 'corpus-index.json'
+CACHE_VERSION = 1
+
+# Below this many changed files a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+
+def parse_article(file_path):
+    """Parse a single markdown article into its index entry."""
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    entry = {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+    }
+    try:
+        post = frontmatter.load(file_path)
+    except Exception as e:
+        entry['error'] = str(e)
+        return file_path.name, entry
+
+    title = post.metadata.get('title')
+    summary = post.metadata.get('summary')
+    slug = post.metadata.get('slug')
+
+    entry.update({
+        'stem': file_path.stem,
+        'title': str(title).strip() if title is not None else '',
+        'summary': re.sub(r'\s+', ' ', str(summary)).strip() if summary is not None else '',
+        'slug': str(slug).strip() if slug else file_path.stem,
+        'content': post.content.strip(),
+    })
+    return file_path.name, entry
+
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') != CACHE_VERSION:
+            return {}
+        return cache.get('files', {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_cache(cache_file, files):
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Stages run side by side in _all.py each refresh the cache, so every
+    # process writes its own temp file; the cache is only an accelerator, so
+    # losing the race (or the disk) just means re-parsing next time
+    tmp_file = cache_file.with_name(f'.{cache_file.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'files': files}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logging.warning(f"Could not save corpus index cache {cache_file}: {e}")
+        tmp_file.unlink(missing_ok=True)
+
+
+def load_corpus(directory=ARTICLES_DIR, cache_file=None, workers=None):
+    """
+    Return every parsed article in directory, keyed by filename stem.
+
+    Each value holds 'stem', 'title', 'summary', 'slug' and 'content'. Only
+    files whose mtime or size changed since the cached run are re-parsed;
+    files that fail to parse are logged and left out of the result.
+    """
+    directory = Path(directory)
+    cache_file = cache_file or CACHE_FILE
+    cached = _load_cache(cache_file)
+
+    files = {}
+    stale = []
+    with os.scandir(directory) as it:
+        for dir_entry in it:
+            if not dir_entry.name.lower().endswith('.md') or not dir_entry.is_file():
+                continue
+            stat = dir_entry.stat()
+            entry = cached.get(dir_entry.name)
+            if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                files[dir_entry.name] = entry
+            else:
+                stale.append(dir_entry.path)
+
+    if stale:
+        logging.info(f"Corpus index: parsing {len(stale)} new or changed files "
+                     f"({len(files)} unchanged)")
+        if len(stale) >= PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = executor.map(parse_article, stale, chunksize=32)
+                files.update(parsed)
+        else:
+            files.update(parse_article(path) for path in stale)
+
+    if stale or len(files) != len(cached):
+        _save_cache(cache_file, files)
+
+    articles = {}
+    for filename, entry in sorted(files.items()):
+        if 'error' in entry:
+            logging.error(f"Error parsing {filename}: {entry['error']}")
+            continue
+        articles[entry['stem']] = entry
+    return articles
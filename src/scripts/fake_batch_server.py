@@ -0,0 +1,377 @@
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter, deque
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the OpenAI and Flux endpoints the scripts call, for
+# running them offline and load-testing their concurrency, retries and
+# throughput:
+#
+#   python fake_batch_server.py --port 8011 --delay 5
+#   OPENAI_BASE_URL=http://127.0.0.1:8011/v1 python llm-years.py --batch-api
+#   python llm-definitions.py --concurrency 8 --no-cache --base-url http://127.0.0.1:8011/v1
+#   python flux-image-generation.py --no-cache --base-url http://127.0.0.1:8011/v1 \
+#       --flux-base-url http://127.0.0.1:8011/v1
+#
+# The scripts write their usual outputs, so run them in a scratch checkout.
+#
+# Files and Batch: batches move from validating to in_progress to completed
+# over --delay seconds, and --error-rate fails that fraction of their lines.
+# GET /v1/batches lists them newest first.
+#
+# POST /v1/chat/completions and /v1/flux-1.1-pro answer after --latency (or
+# --image-latency) seconds, give or take --jitter. Each request is first put
+# through the faults a real API shows: a 429 for the last --burst-length of
+# every --burst-every requests, a 429 once the simulated --rpm/--tpm quota
+# for the past minute is spent, and a 500 for --error-rate of the rest.
+# Responses carry x-ratelimit-* headers, and Retry-After on a 429, so
+# rate_limiter.py reacts as it would to the real API. Which request gets
+# which fault and delay depends only on --seed and its arrival number, so a
+# run is repeatable. GET /stats, also printed on exit, counts requests by
+# endpoint and status, bytes sent and the most requests seen in flight.
+#
+# Answers are made up but well-formed for the definition, year and
+# generality prompts (a JSON object keyed by the slugs in a batched
+# request). Definitions are padded to --definition-bytes; images are
+# --image-bytes of placeholder data in a RIFF/WEBP wrapper, not decodable.
+
+DEFAULT_PORT = 8011
+WINDOW_SECONDS = 60
+FILLER = ("Fake definition text standing in for an expert-level explanation of the term, "
+          "its significance, applications and history. ")
+
+
+def _request_items(body):
+    """The [{slug, ...}] list embedded in a batched prompt, or None."""
+    user = next((m['content'] for m in reversed(body.get('messages', [])) if m.get('role') == 'user'), '')
+    match = re.search(r'\[\s*\{.*\}\s*\]', user, re.DOTALL)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(0))
+    except ValueError:
+        return None
+
+
+def fake_definition(body, size):
+    """A definition in the frontmatter format llm-definitions.py asks for, about size bytes long."""
+    user = ' '.join(m['content'] for m in body.get('messages', []) if m.get('role') == 'user')
+    match = re.search(r'Here is an AI related term: (.+?)\. Now', user)
+    term = match.group(1) if match else 'Fake term'
+    head = f"---\ntitle: {term}\nsummary: Fake one-sentence summary of {term}.\n---\n"
+    paragraph = (FILLER * (max(0, size - len(head)) // (3 * len(FILLER)) + 1)).strip()
+    return head + '\n\n'.join([paragraph] * 3)
+
+
+def fake_image(size):
+    """size bytes shaped like a WebP file; the payload itself is filler."""
+    body = b'WEBPVP8 ' + b'\0' * max(0, size - 16)
+    return b'RIFF' + len(body).to_bytes(4, 'little') + body
+
+
+def fake_content(body, rng, definition_bytes=2000):
+    """Plausible message content for a chat request body."""
+    system = ' '.join(m['content'] for m in body.get('messages', []) if m.get('role') == 'system').lower()
+    items = _request_items(body)
+    if 'define' in system:
+        return fake_definition(body, definition_bytes)
+    if 'score' in system:
+        scores = lambda: [round(rng.uniform(0, 1), 3) for _ in range(7)]
+        return json.dumps({item['slug']: scores() for item in items} if items else scores())
+    if 'year' in system:
+        if items:
+            return json.dumps({item['slug']: rng.randint(1950, 2024) for item in items})
+        return str(rng.randint(1950, 2024))
+    return "Fake response."
+
+
+def completion(body, content):
+    return {
+        'id': f'chatcmpl-fake-{random.getrandbits(32):08x}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': len(json.dumps(body)) // 4, 'completion_tokens': len(content) // 4,
+                  'total_tokens': (len(json.dumps(body)) + len(content)) // 4},
+    }
+
+
+class Quota:
+    """Requests and tokens spent over the past minute against per-minute limits."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.limits = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.spent = deque()  # (time, tokens)
+
+    def remaining(self, now):
+        while self.spent and self.spent[0][0] <= now - WINDOW_SECONDS:
+            self.spent.popleft()
+        used = {'requests': len(self.spent), 'tokens': sum(tokens for _, tokens in self.spent)}
+        return {kind: limit - used[kind] for kind, limit in self.limits.items() if limit}
+
+    def retry_after(self, now):
+        """Seconds until the oldest spend leaves the window."""
+        return max(1, int(self.spent[0][0] + WINDOW_SECONDS - now) + 1) if self.spent else 1
+
+    def headers(self, remaining):
+        headers = {}
+        for kind, left in remaining.items():
+            headers[f'x-ratelimit-limit-{kind}'] = str(self.limits[kind])
+            headers[f'x-ratelimit-remaining-{kind}'] = str(max(0, left))
+        return headers
+
+
+class FakeBatchServer(ThreadingHTTPServer):
+    def __init__(self, address, delay=5.0, error_rate=0.0, seed=0, latency=0.0, image_latency=0.0,
+                 jitter=0.0, burst_every=0, burst_length=0, retry_after=1, rpm=None, tpm=None,
+                 image_rpm=None, definition_bytes=2000, image_bytes=150_000):
+        super().__init__(address, FakeBatchHandler)
+        self.delay = delay
+        self.error_rate = error_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.latency = {'openai': latency, 'flux': image_latency}
+        self.jitter = jitter
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.quotas = {'openai': Quota(rpm, tpm), 'flux': Quota(image_rpm)}
+        self.definition_bytes = definition_bytes
+        self.image_bytes = image_bytes
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.arrivals = 0
+        self.in_flight = 0
+        self.stats = Counter()
+
+    def admit(self, api, tokens=0):
+        """
+        (status, headers, delay, rng) for the next request to api.
+
+        Fault injection and the quota are decided under the lock in arrival
+        order; rng is seeded from the arrival number for the fake answer.
+        """
+        with self.lock:
+            self.arrivals += 1
+            rng = random.Random(f'{self.seed}:{self.arrivals}')
+            now = time.time()
+            quota = self.quotas[api]
+            remaining = quota.remaining(now)
+            in_burst = self.burst_every and (self.arrivals - 1) % self.burst_every >= self.burst_every - self.burst_length
+            if in_burst:
+                status, retry_after = 429, self.retry_after
+            elif remaining.get('requests', 1) < 1 or remaining.get('tokens', tokens) < tokens:
+                status, retry_after = 429, quota.retry_after(now)
+            elif rng.random() < self.error_rate:
+                status, retry_after = 500, None
+            else:
+                status, retry_after = 200, None
+                quota.spent.append((now, tokens))
+                remaining = quota.remaining(now)
+            headers = quota.headers(remaining)
+            if retry_after:
+                headers['Retry-After'] = str(retry_after)
+        latency = self.latency[api] * rng.uniform(1 - self.jitter, 1 + self.jitter)
+        return status, headers, latency if status == 200 else 0.0, rng
+
+    def record(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def summary(self):
+        with self.lock:
+            return {'arrivals': self.arrivals, **dict(sorted(self.stats.items()))}
+
+    def new_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f'{prefix}-fake-{self.counter}'
+
+    def add_file(self, content, purpose):
+        file_id = self.new_id('file')
+        self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'purpose': purpose,
+                'created_at': int(time.time())}
+
+    def batch_status(self, batch):
+        """Advance a batch with time; runs its requests once it completes."""
+        elapsed = time.time() - batch['created_at']
+        if batch['status'] == 'completed':
+            return batch
+        if elapsed < self.delay / 3:
+            batch['status'] = 'validating'
+        elif elapsed < self.delay:
+            batch['status'] = 'in_progress'
+        else:
+            self.complete(batch)
+        return batch
+
+    def complete(self, batch):
+        outputs, errors = [], []
+        lines = [json.loads(line) for line in self.files[batch['input_file_id']].decode().splitlines() if line.strip()]
+        for line in lines:
+            item = {'id': self.new_id('batch_req'), 'custom_id': line['custom_id']}
+            if self.rng.random() < self.error_rate:
+                item['response'] = {'status_code': 500, 'body': {'error': {'message': 'Fake server error'}}}
+                item['error'] = None
+                errors.append(item)
+            else:
+                content = fake_content(line['body'], self.rng)
+                item['response'] = {'status_code': 200, 'body': completion(line['body'], content)}
+                item['error'] = None
+                outputs.append(item)
+        as_jsonl = lambda items: ''.join(json.dumps(item) + '\n' for item in items).encode()
+        batch['output_file_id'] = self.add_file(as_jsonl(outputs), 'batch_output')['id'] if outputs else None
+        batch['error_file_id'] = self.add_file(as_jsonl(errors), 'batch_output')['id'] if errors else None
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+        batch['request_counts'] = {'total': len(lines), 'completed': len(outputs), 'failed': len(errors)}
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record('bytes_sent', len(body))
+
+    def send_json(self, payload, status=200, headers=None):
+        self.send_body(json.dumps(payload).encode(), 'application/json', status, headers)
+
+    def simulate(self, api, tokens, respond):
+        """Answer with respond(rng) after the simulated latency, unless a fault is injected first."""
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.stats['max_in_flight'] = max(server.stats['max_in_flight'], server.in_flight)
+        try:
+            status, headers, latency, rng = server.admit(api, tokens)
+            server.record(f'{api} {status}')
+            time.sleep(latency)
+            if status == 429:
+                return self.send_json({'error': {'message': 'Rate limit reached (fake)', 'type': 'requests'}},
+                                      429, headers)
+            if status != 200:
+                return self.send_json({'error': {'message': 'Fake server error'}}, status, headers)
+            respond(rng, headers)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == '/v1/files':
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                      for part in message.iter_parts()}
+            purpose = (fields.get('purpose') or b'').decode()
+            return self.send_json(self.server.add_file(fields.get('file') or b'', purpose))
+        if self.path == '/v1/batches':
+            request = json.loads(body)
+            if request.get('input_file_id') not in self.server.files:
+                return self.send_json({'error': {'message': 'No such file'}}, 404)
+            batch_id = self.server.new_id('batch')
+            self.server.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': request.get('endpoint'),
+                'input_file_id': request['input_file_id'], 'status': 'validating',
+                'created_at': time.time(), 'output_file_id': None, 'error_file_id': None,
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            }
+            return self.send_json(self.server.batches[batch_id])
+        if self.path == '/v1/chat/completions':
+            request = json.loads(body)
+            answer = lambda rng, headers: self.send_json(
+                completion(request, fake_content(request, rng, self.server.definition_bytes)), headers=headers)
+            return self.simulate('openai', len(body) // 4, answer)
+        if self.path == '/v1/flux-1.1-pro':
+            answer = lambda rng, headers: self.send_body(fake_image(self.server.image_bytes), 'image/webp',
+                                                         headers=headers)
+            return self.simulate('flux', 0, answer)
+        self.send_json({'error': {'message': f'Unknown path {self.path}'}}, 404)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self.send_json(self.server.summary())
+        if self.path.split('?')[0] == '/v1/batches':
+            batches = [self.server.batch_status(batch) for batch in reversed(self.server.batches.values())]
+            return self.send_json({'object': 'list', 'data': batches, 'has_more': False})
+        match = re.fullmatch(r'/v1/batches/([\w-]+)', self.path)
+        if match and match.group(1) in self.server.batches:
+            return self.send_json(self.server.batch_status(self.server.batches[match.group(1)]))
+        match = re.fullmatch(r'/v1/files/([\w-]+)/content', self.path)
+        if match and match.group(1) in self.server.files:
+            content = self.server.files[match.group(1)]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            return self.wfile.write(content)
+        self.send_json({'error': {'message': f'Unknown path {self.path}'}}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve fake OpenAI and Flux APIs for offline and load testing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--delay', type=float, default=5.0, help='Seconds until a batch completes')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests and batch lines that fail with a 500')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before a chat completion is answered')
+    parser.add_argument('--image-latency', type=float, default=0.0, help='Seconds before an image is answered')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Vary latencies uniformly by this fraction either way')
+    parser.add_argument('--burst-every', type=int, default=0, help='Length of the 429 burst cycle in requests')
+    parser.add_argument('--burst-length', type=int, default=0,
+                        help='Requests at the end of each cycle answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with burst 429s')
+    parser.add_argument('--rpm', type=int, help='Chat completion requests allowed per minute')
+    parser.add_argument('--tpm', type=int, help='Chat completion tokens allowed per minute')
+    parser.add_argument('--image-rpm', type=int, help='Image requests allowed per minute')
+    parser.add_argument('--definition-bytes', type=int, default=2000, help='Size of a fake definition')
+    parser.add_argument('--image-bytes', type=int, default=150_000, help='Size of a fake image')
+    args = parser.parse_args()
+
+    server = FakeBatchServer(
+        (args.host, args.port), args.delay, args.error_rate, args.seed, args.latency, args.image_latency,
+        args.jitter, args.burst_every, args.burst_length, args.retry_after, args.rpm, args.tpm,
+        args.image_rpm, args.definition_bytes, args.image_bytes)
+    print(f"Fake API server on http://{args.host}:{server.server_port}/v1 "
+          f"(set OPENAI_BASE_URL and FLUX_BASE_URL, or pass --base-url, to this)")
+    start = time.time()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.time() - start
+    summary = server.summary()
+    print(f"\n{summary['arrivals']} requests in {elapsed:.1f}s ({summary['arrivals'] / elapsed:.1f}/s)")
+    for key, value in summary.items():
+        if key != 'arrivals':
+            print(f"  {key:20} {value}")
+
+
+if __name__ == "__main__":
+    main()
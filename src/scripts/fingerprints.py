@@ -0,0 +1,144 @@
+import os
+import ast
+import json
+import hashlib
+from pathlib import Path
+
+# Content fingerprints for the pipeline stages in _all.py.
+#
+# A stage's fingerprint is a SHA-256 over the contents of everything it
+# declares as input, plus its own script and every helper module in this
+# directory that it imports, directly or not, and a second one over its
+# outputs. After a stage succeeds both are recorded; the next run skips the
+# stage if its inputs still hash the same and its outputs are still what it
+# wrote. Per-file hashes are cached by mtime and size like corpus_index.py,
+# so an unchanged tree is checked with stat() calls alone.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+CACHE_FILE = SCRIPT_DIR / '.cache' / 'fingerprints.json'
+CACHE_VERSION = 1
+CHUNK_SIZE = 1 << 20
+
+
+def script_modules(script):
+    """script and every module of SCRIPT_DIR it imports, following imports transitively."""
+    found = set()
+    queue = [Path(script)]
+    while queue:
+        path = queue.pop()
+        if path in found:
+            continue
+        found.add(path)
+        try:
+            tree = ast.parse(path.read_bytes(), filename=str(path))
+        except (OSError, SyntaxError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = SCRIPT_DIR / f"{name.split('.')[0]}.py"
+                if module.exists():
+                    queue.append(module)
+    return sorted(found)
+
+
+class Fingerprints:
+    def __init__(self, cache_file=CACHE_FILE):
+        self.cache_file = Path(cache_file)
+        self.stages = {}
+        self.files = {}
+        self._seen = set()
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('version') == CACHE_VERSION:
+                self.stages = cache.get('stages', {})
+                self.files = cache.get('files', {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def save(self, prune=False):
+        """Write the cache; prune drops file hashes this process has not looked at."""
+        if prune:
+            self.files = {key: entry for key, entry in self.files.items() if key in self._seen}
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(f'.{self.cache_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'stages': self.stages, 'files': self.files}, f,
+                      separators=(',', ':'))
+        os.replace(tmp_file, self.cache_file)
+
+    def _file_digest(self, path, stat):
+        key = str(path)
+        self._seen.add(key)
+        entry = self.files.get(key)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['sha256']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        self.files[key] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def _walk(self, path, exclude):
+        """(path, stat) for every file at or below path, sorted, skipping excluded subtrees."""
+        if path in exclude:
+            return
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return
+        if not path.is_dir():
+            yield path, stat
+            return
+        for child in sorted(path.iterdir()):
+            yield from self._walk(child, exclude)
+
+    def digest(self, paths, exclude=()):
+        """
+        One hash over the names and contents of every file under paths.
+
+        A missing path contributes only its name, so creating it changes the
+        result.
+        """
+        exclude = {Path(path).resolve() for path in exclude}
+        combined = hashlib.sha256()
+        for root in sorted(Path(path).resolve() for path in paths):
+            combined.update(f'{root}\0'.encode())
+            for path, stat in self._walk(root, exclude):
+                combined.update(f'{path.relative_to(root)}\0{self._file_digest(path, stat)}\0'.encode())
+        return combined.hexdigest()
+
+    def input_digest(self, name, inputs, outputs):
+        """
+        Digest of a stage's inputs, its script and the local modules it imports.
+
+        The stage's own outputs are left out: a stage may write inside a
+        directory it reads (compressed images live under the originals).
+        """
+        return self.digest([*inputs, *script_modules(SCRIPT_DIR / name)], exclude=outputs)
+
+    def is_fresh(self, name, inputs_digest, outputs, exclude=()):
+        """
+        Whether the stage last succeeded on these inputs and its outputs are untouched since.
+
+        exclude leaves out paths under the outputs that other stages write.
+        """
+        recorded = self.stages.get(name)
+        return bool(recorded and recorded['inputs'] == inputs_digest
+                    and recorded['outputs'] == self.digest(outputs, exclude))
+
+    def record(self, name, inputs_digest, outputs, exclude=()):
+        """Remember a successful run on inputs_digest, with its outputs as they are now."""
+        self.stages[name] = {'inputs': inputs_digest, 'outputs': self.digest(outputs, exclude)}
+        self.save()
+
+    def forget(self, name):
+        if self.stages.pop(name, None) is not None:
+            self.save()
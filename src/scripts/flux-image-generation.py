@@ -1,16 +1,24 @@
-import requests
 import os
-import frontmatter as fm
+import argparse
 from pathlib import Path
 from config import FLUX_API_KEY, API_KEY
+from http_client import APIError, CONNECT_TIMEOUT, RetryableError, base_url, chat_completion, post, set_base_url
+from corpus_index import load_corpus
+import response_cache
+import stage_metrics
+import profiling
 import random  # Add this import
 
+# Image generation routinely takes longer than a chat completion
+FLUX_READ_TIMEOUT = 300
+
 def generate_image(prompt, output_path):
+    """Generate an image for prompt into output_path; returns whether it was saved."""
     print(f"\n🎨 Generating image with Flux API...")
     print(f"📝 Prompt: {prompt}")
     
     api_key = FLUX_API_KEY
-    url = "https://api.segmind.com/v1/flux-1.1-pro"
+    url = f"{base_url('flux')}/flux-1.1-pro"
 
     data = {
         'seed': random.randint(0, 1000),
@@ -30,29 +38,28 @@ def generate_image(prompt, output_path):
     }
     
     print("📡 Sending request to Flux API...")
-    response = requests.post(url, json=data, headers=headers)  # Changed 'data=' to 'json='
-    
-    if response.status_code == 200:
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        print(f"✅ Success! Image saved to: {output_path}")
-    else:
-        print(f"❌ Error generating image. Status code: {response.status_code}")
-        print("Full API Response:")
-        print(f"Headers: {dict(response.headers)}")
-        print(f"Content: {response.text}")
+    try:
+        response = post(url, json=data, headers=headers, timeout=(CONNECT_TIMEOUT, FLUX_READ_TIMEOUT))
+    except RetryableError as e:
+        print(f"⏳ Flux API unavailable, will retry on the next run: {e}")
+        stage_metrics.count('items_failed')
+        return False
+    except APIError as e:
+        print(f"❌ Error generating image. Status code: {e.status}")
+        stage_metrics.count('items_failed')
+        print(f"Content: {e.body}")
         print(f"Request Data: {data}")
+        return False
+
+    with profiling.span('persist'), open(output_path, 'wb') as f:
+        f.write(response.content)
+    print(f"✅ Success! Image saved to: {output_path}")
+    return True
 
 def generate_image_prompt(title: str, summary: str) -> str:
     """Generate an optimized image prompt using OpenAI."""
     print("🤖 Generating optimized prompt with OpenAI...")
     
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
     prompt = (
         "You are an expert at writing FLUX image prompts. "
         "Create a detailed, creative prompt for an abstract illustration based this concept:\n\n"
@@ -71,46 +78,68 @@ def generate_image_prompt(title: str, summary: str) -> str:
         "temperature": 0.7
     }
     
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code == 200:
-        image_prompt = response.json()['choices'][0]['message']['content'].strip()
+    try:
+        image_prompt = (chat_completion(data, API_KEY) or '').strip()
+        if not image_prompt:
+            raise APIError("No prompt in the response")
         print(f"✨ Generated prompt: {image_prompt}")
         return image_prompt
-    else:
-        print(f"❌ Error generating prompt. Using fallback.")
+    except (RetryableError, APIError) as e:
+        print(f"❌ Error generating prompt ({e}). Using fallback.")
         return f"Abstract minimalist creative illustration of {title}"
 
-def main():
+def generate_missing_images():
+    """Generate an image for every article that does not have one yet."""
     # Define paths
     content_dir = Path("../content/articles")
     images_dir = Path("../../public/images/articles")
     images_dir.mkdir(parents=True, exist_ok=True)
 
-    # Find all markdown files
-    md_files = content_dir.glob("*.md")
+    # Parsed articles keyed by markdown filename (without .md)
+    articles = load_corpus(content_dir)
 
-    for md_file in md_files:
+    for stem, article in articles.items():
         # Use the markdown filename (without .md) for the image
-        image_filename = md_file.stem + ".webp"
+        image_filename = stem + ".webp"
         image_path = images_dir / image_filename
         
-        print(f"📄 Processing file: {md_file}")
+        print(f"📄 Processing file: {content_dir / (stem + '.md')}")
         print(f"🖼️ Image path will be: {image_path}")
 
-        # Read frontmatter
-        post = fm.load(md_file)
-        title = post.get('title')
-        summary = post.get('summary')
+        title = article['title']
+        summary = article['summary']
 
         if image_path.exists():
             print(f"Image already exists for {image_filename}")
+            stage_metrics.count('items_skipped')
             continue
 
         # Generate prompt using title and summary
         image_prompt = generate_image_prompt(title, summary)
         
         # Generate and save image
-        generate_image(image_prompt, image_path)
+        if generate_image(image_prompt, image_path):
+            stage_metrics.count('items_processed')
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate article images with Flux.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore cached image prompts and request fresh ones')
+    parser.add_argument('--base-url',
+                        help='Send OpenAI requests to this base URL instead (or set OPENAI_BASE_URL)')
+    parser.add_argument('--flux-base-url',
+                        help='Send Flux requests to this base URL instead (or set FLUX_BASE_URL)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    if args.no_cache:
+        response_cache.disable()
+    if args.base_url:
+        set_base_url('openai', args.base_url)
+    if args.flux_base_url:
+        set_base_url('flux', args.flux_base_url)
+
+    with profiling.profiled(args.profile):
+        generate_missing_images()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,250 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextlib
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from rate_limiter import get_limiter
+import response_cache
+import stage_metrics
+from profiling import span
+
+# Shared HTTP layer for the LLM and image scripts.
+#
+# Every request goes through one pooled keep-alive session with connect and
+# read timeouts. Transient failures (timeouts, dropped connections, 429, 5xx)
+# are retried with jittered exponential backoff that honors Retry-After.
+# Callers get back either a response, a RetryableError (nothing usable yet,
+# try again on a later run) or an APIError (the request itself was rejected),
+# so a failure is never mistaken for an answer. OpenAI calls are paced by
+# the shared rate limiter in rate_limiter.py, and answered from
+# response_cache.py when the identical request was made before.
+#
+# OPENAI_BASE_URL and FLUX_BASE_URL (or the scripts' --base-url options,
+# through set_base_url()) point the calls at another server, such as the
+# local stand-in in fake_batch_server.py. Calls to an overridden URL are
+# paced by a limiter of their own, so a load test neither drains nor
+# rewrites the real API's shared buckets.
+
+BASE_URLS = {
+    'openai': "https://api.openai.com/v1",
+    'flux': "https://api.segmind.com/v1",
+}
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+POOL_SIZE = 16
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Completion tokens assumed for rate limiting when a request sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+_session = None
+_session_lock = threading.Lock()
+_base_url_overrides = {}
+
+
+class RetryableError(Exception):
+    """The request kept failing transiently; nothing was answered, try again later."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class APIError(Exception):
+    """The API rejected the request (4xx other than 408/429); retrying will not help."""
+
+    def __init__(self, message, status=None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+def create_session(pool_size=POOL_SIZE):
+    """Session whose keep-alive connection pool can serve pool_size requests at once."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """The process-wide shared session, created on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def set_base_url(api, url):
+    """Send this process's requests for api ('openai' or 'flux') to url instead."""
+    _base_url_overrides[api] = url
+
+
+def base_url(api='openai'):
+    """Base URL for an API: set_base_url(), else <API>_BASE_URL from the environment, else the real one."""
+    url = _base_url_overrides.get(api) or os.environ.get(f'{api.upper()}_BASE_URL') or BASE_URLS[api]
+    return url.rstrip('/')
+
+
+def openai_limiter():
+    """The shared 'openai' limiter, or one keyed by host when the base URL is overridden."""
+    url = base_url('openai')
+    if url == BASE_URLS['openai']:
+        return get_limiter('openai')
+    return get_limiter(f"openai@{urlparse(url).netloc.replace(':', '_')}")
+
+
+def chat_url():
+    return f"{base_url('openai')}/chat/completions"
+
+
+def retry_after_seconds(response):
+    """Seconds requested by a Retry-After header (delta or HTTP date), or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, BACKOFF_BASE))
+    return delay
+
+
+def estimate_tokens(data):
+    """Rough token count of a chat request: ~4 characters per prompt token plus the completion budget."""
+    prompt = sum(len(message.get('content') or '') for message in data.get('messages', []))
+    return prompt // 4 + (data.get('max_tokens') or data.get('max_completion_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+def _never_sent(error):
+    """Whether a failed request is known not to have reached the server."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', cause), urllib3.exceptions.NewConnectionError)
+
+
+def request(method, url, json=None, headers=None, files=None, data=None,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_retries=MAX_RETRIES,
+            session=None, limiter=None, tokens=0, retry_responses=True):
+    """
+    HTTP request with retries; returns the successful response.
+
+    With a limiter, every attempt first takes one request and `tokens`
+    tokens from its buckets and reports the response headers back to it.
+    Raises RetryableError once max_retries transient failures in a row have
+    been exhausted, and APIError straight away for non-retryable statuses.
+
+    retry_responses=False is for requests that must not be sent twice: only
+    failures to connect, before any of the request was sent, are retried.
+    Anything after which the server may have acted on it (a transient
+    status, a read timeout, a connection dropped mid-request) raises
+    RetryableError at once.
+    """
+    session = session or get_session()
+    for attempt in range(max_retries + 1):
+        retry_after = status = None
+        with span('queue'):
+            if limiter:
+                limiter.acquire(tokens)
+        try:
+            stage_metrics.count('api_calls')
+            with limiter.slot() if limiter else contextlib.nullcontext(), span('request'):
+                response = session.request(method, url, json=json, headers=headers,
+                                           files=files, data=data, timeout=timeout)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            reason = f"{type(e).__name__}: {e}"
+            if not retry_responses and not _never_sent(e):
+                raise RetryableError(f"{reason} from {url}; not retried") from e
+        else:
+            if limiter:
+                limiter.update(response.headers, response.status_code)
+            if response.status_code < 400:
+                return response
+            status = response.status_code
+            if status not in RETRYABLE_STATUS:
+                raise APIError(f"HTTP {status} from {url}: {response.text[:500]}", status, response.text)
+            retry_after = retry_after_seconds(response)
+            reason = f"HTTP {status}"
+            if not retry_responses:
+                raise RetryableError(f"{reason} from {url}; not retried", status, retry_after)
+
+        if attempt == max_retries:
+            raise RetryableError(f"{reason} from {url} after {max_retries + 1} attempts", status, retry_after)
+        delay = backoff_delay(attempt, retry_after)
+        logging.warning(f"{reason} from {url}; retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+        time.sleep(delay)
+
+
+def post(url, **kwargs):
+    """POST with retries; see request()."""
+    return request('POST', url, **kwargs)
+
+
+def get(url, **kwargs):
+    """GET with retries; see request()."""
+    return request('GET', url, **kwargs)
+
+
+def chat_completion(data, api_key, url=None, limiter=None, cache=True, validate=None, **kwargs):
+    """
+    Send a chat completion request and return the message content.
+
+    Identical earlier requests are answered from the response cache. With
+    validate, a callable judging whether an answer is usable, only usable
+    answers are stored and a cached one that is not is asked for again, so
+    a malformed answer is never replayed. Live requests are paced by
+    openai_limiter() unless another is given; the token estimate
+    taken up front is settled against the reported usage. Raises
+    RetryableError or APIError like post(), and APIError if the response
+    has no message content.
+    """
+    url = url or chat_url()
+    cache_key = {'url': url, 'request': data}
+    if cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None and (validate is None or validate(cached)):
+            return cached
+
+    limiter = limiter or openai_limiter()
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    estimated = estimate_tokens(data)
+    response = post(url, json=data, headers=headers, limiter=limiter, tokens=estimated, **kwargs)
+    try:
+        body = response.json()
+        content = body['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise APIError(f"Malformed completion response from {url}: {e}", response.status_code, response.text)
+    used = (body.get('usage') or {}).get('total_tokens')
+    if used is not None:
+        limiter.refund(estimated - used)
+        stage_metrics.count('tokens', used)
+    if cache and content and (validate is None or validate(content)):
+        response_cache.put(cache_key, content)
+    return content
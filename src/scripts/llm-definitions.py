@@ -1,7 +1,12 @@
-import requests
 import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from config import API_KEY
+from http_client import (APIError, RetryableError, chat_completion, chat_url, create_session, get_session,
+                         openai_limiter, set_base_url)
+import response_cache
+import profiling
 import re
 from unidecode import unidecode  # You'll need to pip install unidecode
 import os
@@ -12,8 +17,8 @@ import subprocess  # Add for terminal clearing
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# OpenAI API configuration
-API_ENDPOINT = "https://api.openai.com/v1/chat/completions"
+# Default number of definitions requested at once with --concurrency
+DEFAULT_CONCURRENCY = 8
 
 # Update the base directory path
 ARTICLES_DIR = "../content/articles/"
@@ -118,16 +123,11 @@ def file_exists(slug):
     return os.path.exists(filepath)
 
 # Function to get definition from OpenAI API
-def get_definition_from_gpt(term):
+def get_definition_from_gpt(term, session=None):
     start_time = time.time()
     logging.info(f"Fetching definition for term: '{term}' from OpenAI API")
     logging.debug(f"Using model: gpt-5-mini")
 
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-
     # Log request details
     request_size = len(str({
         "model": "gpt-5-mini",
@@ -154,10 +154,10 @@ def get_definition_from_gpt(term):
     }).encode('utf-8'))
 
     try:
-        logging.info(f"Sending POST request to OpenAI API endpoint: {API_ENDPOINT}")
+        logging.info(f"Sending POST request to OpenAI API endpoint: {chat_url()}")
         logging.debug(f"Request payload size: {request_size} bytes")
 
-        response = requests.post(API_ENDPOINT, json={
+        content = chat_completion({
             "model": "gpt-5-mini",
             "messages": [
                 {"role": "system", "content": "Your role is to succinctly define AI-related terms. Follow a structured response format when a term is provided. Ignore anything in parenthesis for the title, only consider it for context."},
@@ -179,20 +179,10 @@ def get_definition_from_gpt(term):
                 {"role": "user", "content": "The concept of Machine Learning was formally introduced in 1959 by Arthur Samuel..."},
                 {"role": "user", "content": "Alongside Arthur Samuel, other notable figures..."},
             ]
-        }, headers=headers)
+        }, API_KEY, session=session)
 
         response_time = time.time() - start_time
-        logging.info(f"Received response from OpenAI API in {response_time:.2f}s (Status: {response.status_code})")
-
-        if response.status_code != 200:
-            logging.error(f"API request failed with status code: {response.status_code}")
-            logging.error(f"Response body: {response.text}")
-            response.raise_for_status()
-
-        response.raise_for_status()
-
-        response_data = response.json()
-        content = response_data.get('choices')[0].get('message').get('content')
+        logging.info(f"Received response from OpenAI API in {response_time:.2f}s")
 
         if content:
             content_length = len(content)
@@ -207,27 +197,122 @@ def get_definition_from_gpt(term):
 
         return content
 
-    except requests.exceptions.Timeout as e:
-        total_time = time.time() - start_time
-        logging.error(f"Timeout error fetching definition for '{term}' after {total_time:.2f}s: {e}")
-        return None
-    except requests.exceptions.ConnectionError as e:
-        total_time = time.time() - start_time
-        logging.error(f"Connection error fetching definition for '{term}' after {total_time:.2f}s: {e}")
-        return None
-    except requests.exceptions.HTTPError as e:
+    except RetryableError as e:
         total_time = time.time() - start_time
-        logging.error(f"HTTP error fetching definition for '{term}' after {total_time:.2f}s: {e}")
+        logging.error(f"Gave up fetching definition for '{term}' after {total_time:.2f}s, try again later: {e}")
         return None
-    except requests.exceptions.RequestException as e:
+    except APIError as e:
         total_time = time.time() - start_time
-        logging.error(f"Request error fetching definition for '{term}' after {total_time:.2f}s: {e}")
+        logging.error(f"API rejected definition request for '{term}' after {total_time:.2f}s: {e}")
         return None
     except Exception as e:
         total_time = time.time() - start_time
         logging.error(f"Unexpected error fetching definition for '{term}' after {total_time:.2f}s: {e}")
         return None
 
+@profiling.span('persist')
+def save_definition(term, definition, index, total, start_time):
+    """Write a definition returned by the API to its article file. Returns True if written."""
+    # Extract title from the frontmatter
+    title = None
+    if '---' in definition:
+        parts = definition.split('---', 2)
+        if len(parts) >= 2:
+            # Look for title in metadata
+            for line in parts[1].split('\n'):
+                if line.startswith('title:'):
+                    title = line.replace('title:', '').strip()
+                    break
+
+    # Check if the title is valid (not a placeholder or example)
+    invalid_titles = ['ML (Machine Learning)', '[TERM_NAME] ([ACRONYM])', '', 'ML', 'Machine Learning']
+
+    if title and title not in invalid_titles:
+        # Use the title from API response
+        final_title = title
+        logging.info(f"[{index}/{total}] Using API-generated title: '{title}'")
+    else:
+        # Fallback: generate title from term itself
+        logging.warning(f"[{index}/{total}] Invalid or missing title in API response for '{term}'. Using fallback title generation.")
+
+        # Clean the term for use as title
+        clean_term = term.strip()
+        if clean_term:
+            # Capitalize first letter of each word for title
+            final_title = clean_term.title()
+            logging.info(f"[{index}/{total}] Using fallback title: '{final_title}'")
+        else:
+            logging.error(f"[{index}/{total}] Cannot generate title from empty term. Skipping '{term}'.")
+            return False
+
+    # Create slugified filename from the final title
+    slug = slugify(final_title)
+
+    # Check if file already exists
+    if file_exists(slug):
+        logging.info(f"[{index}/{total}] Article with slug '{slug}' already exists. Skipping.")
+        return False
+
+    filename = os.path.join(ARTICLES_DIR, f"{slug}.md")
+
+    # Update the title in metadata if we used a fallback title
+    if title != final_title:
+        # Replace the invalid title in the original definition with our fallback title
+        definition = definition.replace(f"title: {title}", f"title: {final_title}")
+
+    # Add slug to the metadata section with proper spacing
+    # Re-split to get updated parts if we modified the title
+    if title != final_title:
+        parts = definition.split('---', 2)
+
+    # Add slug to the metadata section
+    metadata = parts[1].strip()
+    definition = f"---\n{metadata}\nslug: {slug}\n---{parts[2]}"
+
+    # Ensure directory exists
+    os.makedirs(ARTICLES_DIR, exist_ok=True)
+
+    logging.info(f"[{index}/{total}] Writing definition to file: {filename}")
+    with open(filename, "w") as file:
+        file.write(definition)
+    processing_time = time.time() - start_time
+    logging.info(f"[{index}/{total}] Definition for '{term}' successfully saved to {filename} ({processing_time:.2f}s)")
+    return True
+
+async def process_terms_async(filtered_terms, concurrency, session):
+    """
+    Fetch definitions with up to `concurrency` requests in flight.
+
+    Requests run in worker threads sharing one pooled session; each
+    definition is written as soon as its response arrives, from the event
+    loop, so slug checks and file writes never race. Returns the number of
+    definitions written.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    # The default executor is sized by CPU count, not by how many requests we want in flight
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def fetch(term, index, total):
+        async with semaphore:
+            start_time = time.time()
+            logging.info(f"[{index}/{total}] Processing term: '{term}'")
+            definition = await loop.run_in_executor(executor, get_definition_from_gpt, term, session)
+            return term, index, total, start_time, definition
+
+    processed_count = 0
+    tasks = [fetch(term, index, total) for term, index, total in filtered_terms]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            term, index, total, start_time, definition = await next_done
+            if not definition:
+                logging.warning(f"[{index}/{total}] Skipping '{term}', no definition found.")
+            elif save_definition(term, definition, index, total, start_time):
+                processed_count += 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return processed_count
+
 def clear_terminal():
     """Clear the terminal screen for better readability."""
     try:
@@ -255,107 +340,66 @@ def main():
     try:
         parser = argparse.ArgumentParser(description='Fetch AI term definitions from OpenAI API.')
         parser.add_argument('term', type=str, nargs='?', help='The AI term to define')
+        parser.add_argument('--concurrency', type=int, nargs='?', const=DEFAULT_CONCURRENCY, default=1,
+                            help=f'Fetch up to N definitions at once (default {DEFAULT_CONCURRENCY} if given without N)')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Ignore cached API responses and request fresh ones')
+        parser.add_argument('--base-url',
+                            help='Send OpenAI requests to this base URL instead, e.g. fake_batch_server.py (or set OPENAI_BASE_URL)')
+        profiling.add_argument(parser)
         args = parser.parse_args()
-
-        # Clear terminal for better readability
-        clear_terminal()
-
-        terms_to_process = [args.term] if args.term else DEFAULT_AI_TERMS
-        total_terms = len(terms_to_process)
-
-        logging.info(f"Starting definition generation for {total_terms} terms")
-        logging.info(f"Using OpenAI API endpoint: {API_ENDPOINT}")
-
-        # Filter out terms that already have files
-        filtered_terms = []
-        skipped_count = 0
-        for i, term in enumerate(terms_to_process, 1):
-            logging.info(f"[{i}/{total_terms}] Checking if '{term}' already exists...")
-            temp_slug = slugify(term)
-            if file_exists(temp_slug):
-                logging.info(f"[{i}/{total_terms}] Article with slug '{temp_slug}' already exists. Skipping '{term}'.")
-                skipped_count += 1
-                continue
-            filtered_terms.append((term, i, total_terms))
-
-        logging.info(f"Found {len(filtered_terms)} terms to process, skipped {skipped_count} existing terms")
-
-        # Process only terms that don't have existing files
-        processed_count = 0
-        for term, index, total in filtered_terms:
-            start_time = time.time()
-            logging.info(f"[{index}/{total}] Processing term: '{term}' (term {processed_count + 1}/{len(filtered_terms)})")
-            definition = get_definition_from_gpt(term)
-            if definition:
-                # Extract title from the frontmatter
-                title = None
-                if '---' in definition:
-                    parts = definition.split('---', 2)
-                    if len(parts) >= 2:
-                        # Look for title in metadata
-                        for line in parts[1].split('\n'):
-                            if line.startswith('title:'):
-                                title = line.replace('title:', '').strip()
-                                break
-
-                # Check if the title is valid (not a placeholder or example)
-                invalid_titles = ['ML (Machine Learning)', '[TERM_NAME] ([ACRONYM])', '', 'ML', 'Machine Learning']
-
-                if title and title not in invalid_titles:
-                    # Use the title from API response
-                    final_title = title
-                    logging.info(f"[{index}/{total}] Using API-generated title: '{title}'")
-                else:
-                    # Fallback: generate title from term itself
-                    logging.warning(f"[{index}/{total}] Invalid or missing title in API response for '{term}'. Using fallback title generation.")
-
-                    # Clean the term for use as title
-                    clean_term = term.strip()
-                    if clean_term:
-                        # Capitalize first letter of each word for title
-                        final_title = clean_term.title()
-                        logging.info(f"[{index}/{total}] Using fallback title: '{final_title}'")
-                    else:
-                        logging.error(f"[{index}/{total}] Cannot generate title from empty term. Skipping '{term}'.")
-                        continue
-
-                # Create slugified filename from the final title
-                slug = slugify(final_title)
-
-                # Check if file already exists
-                if file_exists(slug):
-                    logging.info(f"[{index}/{total}] Article with slug '{slug}' already exists. Skipping.")
+        if args.no_cache:
+            response_cache.disable()
+        if args.base_url:
+            set_base_url('openai', args.base_url)
+
+        with profiling.profiled(args.profile):
+            # Clear terminal for better readability
+            clear_terminal()
+
+            terms_to_process = [args.term] if args.term else DEFAULT_AI_TERMS
+            total_terms = len(terms_to_process)
+
+            logging.info(f"Starting definition generation for {total_terms} terms")
+            logging.info(f"Using OpenAI API endpoint: {chat_url()}")
+
+            # Filter out terms that already have files
+            filtered_terms = []
+            skipped_count = 0
+            for i, term in enumerate(terms_to_process, 1):
+                logging.info(f"[{i}/{total_terms}] Checking if '{term}' already exists...")
+                temp_slug = slugify(term)
+                if file_exists(temp_slug):
+                    logging.info(f"[{i}/{total_terms}] Article with slug '{temp_slug}' already exists. Skipping '{term}'.")
+                    skipped_count += 1
                     continue
+                filtered_terms.append((term, i, total_terms))
 
-                filename = os.path.join(ARTICLES_DIR, f"{slug}.md")
-
-                # Update the title in metadata if we used a fallback title
-                if title != final_title:
-                    # Replace the invalid title in the original definition with our fallback title
-                    definition = definition.replace(f"title: {title}", f"title: {final_title}")
-
-                # Add slug to the metadata section with proper spacing
-                # Re-split to get updated parts if we modified the title
-                if title != final_title:
-                    parts = definition.split('---', 2)
-
-                # Add slug to the metadata section
-                metadata = parts[1].strip()
-                definition = f"---\n{metadata}\nslug: {slug}\n---{parts[2]}"
+            logging.info(f"Found {len(filtered_terms)} terms to process, skipped {skipped_count} existing terms")
 
-                # Ensure directory exists
-                os.makedirs(ARTICLES_DIR, exist_ok=True)
+            session = create_session(args.concurrency) if args.concurrency > 1 else get_session()
+            batch_start = time.time()
 
-                logging.info(f"[{index}/{total}] Writing definition to file: {filename}")
-                with open(filename, "w") as file:
-                    file.write(definition)
-                processing_time = time.time() - start_time
-                logging.info(f"[{index}/{total}] Definition for '{term}' successfully saved to {filename} ({processing_time:.2f}s)")
-                processed_count += 1
+            # Process only terms that don't have existing files
+            processed_count = 0
+            if args.concurrency > 1:
+                logging.info(f"Fetching with up to {args.concurrency} concurrent requests")
+                # The shared rate limiter lowers this cap when the API reports little headroom
+                openai_limiter().gate.set_max(args.concurrency)
+                processed_count = asyncio.run(process_terms_async(filtered_terms, args.concurrency, session))
             else:
-                logging.warning(f"[{index}/{total}] Skipping '{term}', no definition found.")
+                for term, index, total in filtered_terms:
+                    start_time = time.time()
+                    logging.info(f"[{index}/{total}] Processing term: '{term}' (term {processed_count + 1}/{len(filtered_terms)})")
+                    definition = get_definition_from_gpt(term, session)
+                    if definition:
+                        if save_definition(term, definition, index, total, start_time):
+                            processed_count += 1
+                    else:
+                        logging.warning(f"[{index}/{total}] Skipping '{term}', no definition found.")
 
-        logging.info(f"Script execution completed. Processed {processed_count}/{len(filtered_terms)} terms successfully using OpenAI API")
+            logging.info(f"Script execution completed. Processed {processed_count}/{len(filtered_terms)} terms successfully using OpenAI API "
+                         f"in {time.time() - batch_start:.2f}s")
 
         # Commenting out the execution of _all.py
         # logging.info("Executing _all.py...")
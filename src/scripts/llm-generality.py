@@ -1,9 +1,17 @@
 import logging
 import sys
+import argparse
 from pathlib import Path
+from typing import Optional
 import frontmatter
-import requests
 from config import API_KEY
+from http_client import APIError, RetryableError, chat_completion, set_base_url
+from corpus_index import load_corpus
+from metadata_store import FieldDict, LEGACY_GENERALITY_FALLBACK
+import response_cache
+import batch_api
+import stage_metrics
+import profiling
 import json
 
 # Configure logging ...
@@ -17,20 +25,43 @@ logging.basicConfig(
 VOCAB_DIR = Path('../content/articles/')
 DATA_FILE = Path('../data/generality.json')
 SCORE_FIELD = 'generality'
-API_ENDPOINT = "https://api.openai.com/v1/chat/completions"
+N_SCORES = 7
+# Terms per request in --batch-size mode, and rounds a failed term is re-queued
+DEFAULT_BATCH_SIZE = 20
+MAX_BATCH_ATTEMPTS = 3
 
-def get_md_files(directory: Path):
-    """Retrieve all .md files in the specified directory."""
-    md_files = list(directory.glob('*.md'))
-    logging.info(f"Found {len(md_files)} Markdown files in {directory.resolve()}.")
-    return md_files
+def get_articles(directory: Path):
+    """Retrieve all parsed articles in the specified directory, keyed by slug."""
+    articles = load_corpus(directory)
+    logging.info(f"Found {len(articles)} Markdown files in {directory.resolve()}.")
+    return articles
 
 def has_score(front_matter: dict) -> bool:
     """Check if importance score field exists in frontmatter."""
     return SCORE_FIELD in front_matter
 
-def calculate_importance_score(title: str, summary: str) -> list[float]:
-    """Calculate importance scores using OpenAI API returning all 7 scores."""
+def validate_scores(value) -> Optional[list[float]]:
+    """Exactly 7 numeric scores, clamped to [0, 1] and rounded to 3 decimals, or None."""
+    if not isinstance(value, list) or len(value) != N_SCORES:
+        return None
+    if not all(isinstance(score, (int, float)) and not isinstance(score, bool) for score in value):
+        return None
+    return [round(max(0.0, min(1.0, score)), 3) for score in value]
+
+def parse_scores(content: str) -> Optional[list[float]]:
+    """A single-term answer as 7 valid scores, or None."""
+    try:
+        return validate_scores(json.loads(content))
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+def calculate_importance_score(title: str, summary: str) -> Optional[list[float]]:
+    """
+    Calculate importance scores using OpenAI API returning all 7 scores.
+
+    Returns None when no valid scores were received, so nothing is stored
+    and the term is scored again on a later run.
+    """
     prompt = (
         "You are an AI expert. Please analyze the following AI/ML term and assign it 7 different importance/generality scores "
         "from 0 to 1, where:\n"
@@ -42,11 +73,6 @@ def calculate_importance_score(title: str, summary: str) -> list[float]:
         "Scores:"
     )
     
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
     data = {
         "model": "gpt-4o-mini",
         "messages": [
@@ -59,28 +85,164 @@ def calculate_importance_score(title: str, summary: str) -> list[float]:
     
     try:
         logging.info("Sending request to OpenAI API for scoring")
-        response = requests.post(API_ENDPOINT, headers=headers, json=data)
-        response.raise_for_status()
-        
-        # Parse the response string as a JSON array
-        import json
-        scores_str = response.json()['choices'][0]['message']['content'].strip()
-        scores = json.loads(scores_str)
+        scores_str = chat_completion(data, API_KEY, validate=parse_scores)
+        if scores_str is None:
+            raise ValueError("API returned no content")
         
-        if not isinstance(scores, list) or len(scores) != 7:
+        scores = parse_scores(scores_str.strip())
+        if scores is None:
             raise ValueError("API did not return 7 scores")
-            
-        # Return all scores rounded to 3 decimal places
-        scores = [round(max(0.0, min(1.0, score)), 3) for score in scores]
         
         logging.info(f"Scores: {scores}")
         return scores
     except KeyboardInterrupt:
         logging.info("\nScript interrupted by user. Shutting down gracefully...")
         sys.exit(0)
-    except Exception as e:
+    except RetryableError as e:
+        logging.error(f"API unavailable, leaving for a later run: {e}")
+        return None
+    except (APIError, ValueError, TypeError) as e:
         logging.error(f"Error during scoring: {e}")
-        return [0.5] * 7  # Default middle score array in case of error
+        return None
+
+def score_batch_request(terms: dict) -> dict:
+    """Chat request asking for the scores of terms ({slug: (title, summary)}) as a JSON object keyed by slug."""
+    items = [{"slug": slug, "title": title, "summary": summary} for slug, (title, summary) in terms.items()]
+    prompt = (
+        "You are an AI expert. Please analyze each of the following AI/ML terms and assign it 7 different importance/generality scores "
+        "from 0 to 1, where:\n"
+        "- Scores near 1.0 are for fundamental, broad concepts (e.g., 'Machine Learning', 'Neural Networks')\n"
+        "- Scores near 0.0 are for very specific or newer concepts (e.g., 'LoRA Fine-tuning', 'Specific Architecture Variants')\n"
+        "Return a JSON object mapping every slug to an array of exactly 7 scores with 3 decimal places each, like this: "
+        "{\"machine-learning\": [0.950, 0.925, 0.900, 0.875, 0.850, 0.825, 0.800]}\n\n"
+        f"Terms: {json.dumps(items, ensure_ascii=False)}"
+    )
+    data = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": "You are an AI expert that scores terms based on their fundamental importance and generality. Always return a JSON object of slug to exactly 7 scores."},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": {"type": "json_object"},
+        "max_tokens": 50 + 60 * len(items),
+        "temperature": 0.7
+    }
+    return data
+
+def parse_score_batch(content: str, slugs) -> tuple[dict, dict]:
+    """
+    Validate a JSON object of slug to 7 scores.
+
+    Returns (scores, errors): valid 7-score lists keyed by slug, and a
+    reason for every slug without one.
+    """
+    try:
+        answers = json.loads(content)
+    except json.JSONDecodeError as e:
+        return {}, {slug: f"response is not valid JSON: {e}" for slug in slugs}
+    if not isinstance(answers, dict):
+        return {}, {slug: "response is not a JSON object" for slug in slugs}
+
+    scores, errors = {}, {}
+    for slug in slugs:
+        if slug not in answers:
+            errors[slug] = "missing from response"
+            continue
+        valid = validate_scores(answers[slug])
+        if valid is None:
+            errors[slug] = f"invalid scores: {json.dumps(answers[slug])[:100]}"
+        else:
+            scores[slug] = valid
+    return scores, errors
+
+def score_batch(terms: dict, cache: bool = True) -> tuple[dict, dict]:
+    """
+    Score many terms in one request.
+
+    terms maps slug to (title, summary). Returns (scores, errors): valid
+    7-score lists keyed by slug, and a reason for every slug without one.
+    Only answers scoring every term are cached; cache=False skips the cache
+    for re-queued terms.
+    """
+    complete = lambda content: not parse_score_batch(content, terms)[1]
+    try:
+        logging.info(f"Sending request to OpenAI API for scoring {len(terms)} terms")
+        content = chat_completion(score_batch_request(terms), API_KEY, cache=cache, validate=complete)
+    except (RetryableError, APIError) as e:
+        return {}, {slug: f"request failed: {e}" for slug in terms}
+    return parse_score_batch(content, terms)
+
+def process_batch_api(pending: dict, existing_scores: dict, failures: dict, batch_size: int):
+    """
+    Score pending terms through the Batch API, batch_size terms per request line.
+
+    Resumes an interrupted job instead of submitting a new one. Terms that
+    come back without valid scores are recorded as failures.
+    """
+    if not pending and not batch_api.load_job('generality'):
+        logging.info("No terms need scoring")
+        return
+    slugs = list(pending)
+    chunks = {f"generality-{i}": slugs[start:start + batch_size]
+              for i, start in enumerate(range(0, len(slugs), batch_size))}
+    requests_by_id = {custom_id: score_batch_request({slug: pending[slug] for slug in chunk})
+                      for custom_id, chunk in chunks.items()}
+
+    job, contents, errors = batch_api.run('generality', requests_by_id, API_KEY, meta=chunks)
+    scored = 0
+    for custom_id, chunk in job['meta'].items():
+        if custom_id in contents:
+            scores, chunk_errors = parse_score_batch(contents[custom_id], chunk)
+        else:
+            scores = {}
+            reason = errors.get(custom_id, f"not answered (batch {job['status']})")
+            chunk_errors = {slug: reason for slug in chunk}
+        for slug, slug_scores in scores.items():
+            existing_scores[slug] = slug_scores
+            failures.pop(slug, None)
+        for slug, reason in chunk_errors.items():
+            failures[slug] = reason
+        stage_metrics.count('items_failed', len(chunk_errors))
+        scored += len(scores)
+    save_scores(existing_scores)
+    save_failures(failures)
+    batch_api.finish(job)
+    logging.info(f"Batch API: scored {scored} terms, {len(failures)} marked as failed")
+
+def process_batches(pending: dict, existing_scores: dict, failures: dict, batch_size: int):
+    """Score pending {slug: (title, summary)} in batches, retrying only the terms that failed."""
+    attempts = {slug: 0 for slug in pending}
+    queue = list(pending)
+    requests_made = 0
+    while queue:
+        batch, queue = queue[:batch_size], queue[batch_size:]
+        scores, errors = score_batch({slug: pending[slug] for slug in batch},
+                                     cache=not any(attempts[slug] for slug in batch))
+        requests_made += 1
+
+        for slug, slug_scores in scores.items():
+            existing_scores[slug] = slug_scores
+            failures.pop(slug, None)
+        if scores:
+            logging.info(f"Scored {len(scores)}/{len(batch)} terms in this batch")
+            save_scores(existing_scores)
+
+        retry = []
+        for slug, reason in errors.items():
+            attempts[slug] += 1
+            if attempts[slug] < MAX_BATCH_ATTEMPTS:
+                retry.append(slug)
+            else:
+                logging.warning(f"Giving up on '{slug}' after {MAX_BATCH_ATTEMPTS} attempts: {reason}")
+                failures[slug] = reason
+                stage_metrics.count('items_failed')
+        if retry:
+            logging.info(f"Re-queuing {len(retry)} terms that failed")
+            queue.extend(retry)
+        save_failures(failures)
+
+    logging.info(f"Batched {len(pending)} terms in {requests_made} requests; "
+                 f"{sum(1 for slug in pending if slug in failures)} marked as failed")
 
 def update_frontmatter_with_score(md_file: Path, post, scores: list[float]):
     """Add importance scores to frontmatter and save file."""
@@ -99,71 +261,128 @@ def update_frontmatter_with_score(md_file: Path, post, scores: list[float]):
     except Exception as e:
         logging.error(f"Failed to write file '{md_file.name}': {e}")
 
-def load_existing_scores():
-    """Load existing scores from generality.json."""
+def load_existing_scores() -> FieldDict:
+    """Load existing scores from the metadata store."""
+    return FieldDict('generality')
+
+@profiling.span('persist')
+def save_scores(scores_dict: FieldDict):
+    """Store the scores changed since the last save."""
     try:
-        if DATA_FILE.exists():
-            with DATA_FILE.open('r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        scores_dict.commit()
     except Exception as e:
-        logging.error(f"Error loading generality.json: {e}")
-        return {}
+        logging.error(f"Error saving scores: {e}")
+
+def load_failures(connection=None) -> FieldDict:
+    """
+    Load the terms that could not be scored, with the reason, so they are
+    never mistaken for real scores (exported as generality-failures.json).
+    """
+    return FieldDict('generality_failures', connection)
 
-def save_scores(scores_dict):
-    """Save scores to generality.json."""
+@profiling.span('persist')
+def save_failures(failures: FieldDict):
+    """Store the failures changed since the last save."""
     try:
-        with DATA_FILE.open('w', encoding='utf-8') as f:
-            json.dump(scores_dict, f, indent=2)
-        logging.info("Saved scores to generality.json")
+        failures.commit()
     except Exception as e:
-        logging.error(f"Error saving generality.json: {e}")
+        logging.error(f"Error saving failures: {e}")
+
+def needs_score(slug, existing_scores, rescore_fallbacks=False):
+    if slug not in existing_scores:
+        return True
+    return rescore_fallbacks and existing_scores[slug] == LEGACY_GENERALITY_FALLBACK
 
-def process_files(md_files):
-    """Process each Markdown file."""
+def process_files(articles, batch_size=None, rescore_fallbacks=False, use_batch_api=False):
+    """Process each parsed article, batch_size terms per request if given."""
     existing_scores = load_existing_scores()
-    
-    for md_file in md_files:
-        slug = md_file.stem  # Get filename without extension
-        logging.info(f"Processing file: {md_file.name}")
-        
-        # Skip if scores already exist for this slug
-        if slug in existing_scores:
-            logging.info(f"Skipping '{slug}' - already has generality scores")
-            continue
+    failures = load_failures(existing_scores.connection)
+    try:
+        if batch_size or use_batch_api:
+            pending = {}
+            for slug, article in articles.items():
+                if not needs_score(slug, existing_scores, rescore_fallbacks):
+                    continue
+                if not article['title'] and not article['summary']:
+                    logging.warning(f"Both title and summary are missing in '{slug}.md'. Skipping scoring.")
+                    continue
+                pending[slug] = (article['title'], article['summary'])
+            logging.info(f"Found {len(pending)} terms to score")
+            stage_metrics.count('items_processed', len(pending))
+            stage_metrics.count('items_skipped', len(articles) - len(pending))
+            if use_batch_api:
+                process_batch_api(pending, existing_scores, failures, batch_size or DEFAULT_BATCH_SIZE)
+            else:
+                process_batches(pending, existing_scores, failures, batch_size)
+            return
 
-        try:
-            post = frontmatter.load(md_file)
-        except Exception as e:
-            logging.error(f"Failed to load frontmatter from '{md_file.name}': {e}")
-            continue
+        for slug, article in articles.items():
+            logging.info(f"Processing file: {slug}.md")
 
-        title = post.metadata.get('title', '').strip()
-        summary = post.metadata.get('summary', '').strip()
-        
-        if not title and not summary:
-            logging.warning(f"Both title and summary are missing in '{md_file.name}'. Skipping scoring.")
-            continue
+            # Skip if scores already exist for this slug
+            if not needs_score(slug, existing_scores, rescore_fallbacks):
+                logging.info(f"Skipping '{slug}' - already has generality scores")
+                stage_metrics.count('items_skipped')
+                continue
 
-        logging.info(f"Scoring '{slug}'...")
-        scores = calculate_importance_score(title, summary)
-        
-        # Add new scores to the dictionary and save
-        existing_scores[slug] = scores
-        save_scores(existing_scores)
+            title = article['title']
+            summary = article['summary']
+
+            if not title and not summary:
+                logging.warning(f"Both title and summary are missing in '{slug}.md'. Skipping scoring.")
+                continue
+
+            logging.info(f"Scoring '{slug}'...")
+            stage_metrics.count('items_processed')
+            scores = calculate_importance_score(title, summary)
+            if scores is None:
+                failures[slug] = "no valid scores returned"
+                stage_metrics.count('items_failed')
+                save_failures(failures)
+                continue
+
+            # Add new scores to the dictionary and save
+            existing_scores[slug] = scores
+            save_scores(existing_scores)
+            if failures.pop(slug, None):
+                save_failures(failures)
+    finally:
+        # Write generality.json and generality-failures.json for the site
+        with profiling.span('persist'):
+            existing_scores.export()
+            failures.export()
 
 def main():
     """Main function to execute the script."""
+    parser = argparse.ArgumentParser(description='Score the generality of each AI term.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore cached API responses and request fresh ones')
+    parser.add_argument('--batch-size', type=int, nargs='?', const=DEFAULT_BATCH_SIZE,
+                        help=f'Score N terms per request (default {DEFAULT_BATCH_SIZE} if given without N)')
+    parser.add_argument('--rescore-fallbacks', action='store_true',
+                        help='Score again terms holding the old [0.5]*7 error fallback')
+    parser.add_argument('--batch-api', action='store_true',
+                        help='Submit through the asynchronous Batch API and wait for it (resumes if interrupted)')
+    parser.add_argument('--base-url',
+                        help='Send OpenAI requests to this base URL instead, e.g. fake_batch_server.py (or set OPENAI_BASE_URL)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    if args.no_cache:
+        response_cache.disable()
+    if args.base_url:
+        set_base_url('openai', args.base_url)
+
     if not VOCAB_DIR.exists() or not VOCAB_DIR.is_dir():
         logging.error(f"Directory '{VOCAB_DIR.resolve()}' does not exist or is not a directory.")
         sys.exit(1)
 
-    md_files = get_md_files(VOCAB_DIR)
-    if not md_files:
+    articles = get_articles(VOCAB_DIR)
+    if not articles:
         logging.info("No Markdown files to process.")
         return
 
-    process_files(md_files)
+    with profiling.profiled(args.profile):
+        process_files(articles, args.batch_size, args.rescore_fallbacks, args.batch_api)
     logging.info("Processing completed.")
 
 if __name__ == "__main__":
@@ -1,11 +1,17 @@
 import logging
 import sys
+import argparse
 from pathlib import Path
-import frontmatter
-import requests
 from typing import Union
 import signal
 from config import API_KEY
+from http_client import APIError, RetryableError, chat_completion, set_base_url
+from corpus_index import load_corpus
+from metadata_store import FieldDict
+import response_cache
+import batch_api
+import stage_metrics
+import profiling
 import json
 import time
 
@@ -18,7 +24,10 @@ logging.basicConfig(
 # Constants
 VOCAB_DIR = Path('../content/articles/')
 SCORE_FIELD = 'generality'
-API_ENDPOINT = "https://api.openai.com/v1/chat/completions"
+MIN_YEAR, MAX_YEAR = 1700, 2025
+# Terms per request in --batch-size mode, and rounds a malformed answer is re-queued
+DEFAULT_BATCH_SIZE = 50
+MAX_BATCH_ATTEMPTS = 3
 
 def signal_handler(signum, frame):
     print("\nGracefully shutting down...")
@@ -27,7 +36,12 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 def estimate_year_origin(title: str, summary: str, retry: bool = False) -> Union[int, None]:
-    """Estimate the year when an AI concept was first introduced."""
+    """
+    Estimate the year when an AI concept was first introduced.
+
+    Returns 0 when the model answers 'unknown' or an unusable year, and None
+    when no answer was received, so the term is retried on a later run.
+    """
     logging.info(f"\nProcessing: {title}")
     logging.info("Sending API request..." + (" (retry attempt)" if retry else ""))
     logging.info("-" * 50)
@@ -40,11 +54,6 @@ def estimate_year_origin(title: str, summary: str, retry: bool = False) -> Union
     
     logging.info(f"Prompt: {prompt}")
     
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
     data = {
         "model": "gpt-4o-mini",  # Change to standard OpenAI model
         "messages": [
@@ -58,16 +67,13 @@ def estimate_year_origin(title: str, summary: str, retry: bool = False) -> Union
     logging.info(f"Request data: {json.dumps(data, indent=2)}")
     
     try:
-        response = requests.post(API_ENDPOINT, headers=headers, json=data)
-        response.raise_for_status()
+        # Only a real year is cached; 'unknown' and unparseable answers are asked again next run
+        content = chat_completion(data, API_KEY, validate=lambda answer: bool(parse_year(answer)))
         
         elapsed_time = time.time() - start_time
         logging.info(f"API response received in {elapsed_time:.2f} seconds")
         
-        response_json = response.json()
-        logging.info(f"Full API response: {json.dumps(response_json, indent=2)}")
-        
-        year_str = response_json['choices'][0]['message']['content'].strip().lower()
+        year_str = content.strip().lower()
         logging.info(f"Raw response: {year_str}")
         
         try:
@@ -75,7 +81,7 @@ def estimate_year_origin(title: str, summary: str, retry: bool = False) -> Union
                 logging.info("Result: unknown year (storing as 0)")
                 return 0
             year = int(year_str)
-            if 1700 <= year <= 2025:
+            if MIN_YEAR <= year <= MAX_YEAR:
                 logging.info(f"Result: {year}")
                 return year
             logging.info(f"Result: year {year} out of valid range (storing as 0)")
@@ -84,90 +90,272 @@ def estimate_year_origin(title: str, summary: str, retry: bool = False) -> Union
             logging.info(f"Result: could not parse year from response (storing as 0)")
             return 0
             
-    except Exception as e:
-        logging.error(f"API Error: {str(e)} (storing as 0)")
-        logging.error(f"Response content: {response.text if 'response' in locals() else 'No response'}")
-        return 0
+    except RetryableError as e:
+        logging.error(f"API unavailable: {e} (leaving for a later run)")
+        return None
+    except APIError as e:
+        logging.error(f"API Error: {e} (leaving for a later run)")
+        return None
     finally:
         logging.info("-" * 50)
 
-def load_existing_years() -> dict:
-    """Load existing year mappings from years.json."""
+def parse_year(value) -> Union[int, None]:
+    """A batch answer as a year, 0 for 'unknown', or None if it is malformed."""
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value == 'unknown':
+            return 0
+        if not value.isdigit():
+            return None
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        return None
+    return value if MIN_YEAR <= value <= MAX_YEAR else None
+
+def year_batch_request(terms: dict) -> dict:
+    """Chat request asking for the origin years of terms ({slug: (title, summary)}) as a JSON map."""
+    items = [{"slug": slug, "title": title, "summary": summary} for slug, (title, summary) in terms.items()]
+    prompt = (
+        "For each AI term below, give the year it was first introduced or defined in AI. "
+        "Respond with a JSON object mapping every slug to a year (YYYY integer) with your best estimate, "
+        "or the string \"unknown\". Include every slug exactly once and nothing else.\n\n"
+        f"{json.dumps(items, ensure_ascii=False)}"
+    )
+    data = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": "You are a helpful AI historian. Respond only with a JSON object of slug to year."},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": {"type": "json_object"},
+        # The answer repeats every slug as a key, so budget for their length
+        # (about three characters a token) on top of the quotes and the year
+        "max_tokens": 50 + sum(len(slug) // 3 + 10 for slug in terms),
+        "temperature": 0.3
+    }
+    return data
+
+def parse_year_batch(content: str, slugs) -> dict:
+    """
+    Validate a JSON map of slug to year.
+
+    Returns {slug: year or 0 for 'unknown'} for the slugs that came back
+    well-formed; missing or malformed slugs are left out.
+    """
     try:
-        with open('../data/years.json', 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            if not content:  # If file is empty
-                return {}
-            return json.loads(content)
-    except (FileNotFoundError, json.JSONDecodeError):
+        answers = json.loads(content)
+    except json.JSONDecodeError:
+        logging.warning(f"Batch response is not valid JSON: {content[:200]}")
         return {}
+    if not isinstance(answers, dict):
+        logging.warning("Batch response is not a JSON object")
+        return {}
+
+    years = {}
+    for slug in slugs:
+        year = parse_year(answers.get(slug))
+        if year is not None:
+            years[slug] = year
+    return years
+
+def estimate_years_batch(terms: dict, cache: bool = True) -> dict:
+    """
+    Estimate origin years for many terms in one request.
+
+    terms maps slug to (title, summary). Returns {slug: year or 0 for
+    'unknown'} for the slugs that came back well-formed; missing or
+    malformed slugs are left out for the caller to re-queue. An empty dict
+    means the request itself failed. Only complete answers are cached;
+    cache=False skips the cache for re-queued terms.
+    """
+    start_time = time.time()
+    complete = lambda content: len(parse_year_batch(content, terms)) == len(terms)
+    try:
+        content = chat_completion(year_batch_request(terms), API_KEY, cache=cache, validate=complete)
+    except (RetryableError, APIError) as e:
+        logging.error(f"Batch of {len(terms)} failed: {e} (leaving for a later run)")
+        return {}
+    logging.info(f"Batch of {len(terms)} answered in {time.time() - start_time:.2f} seconds")
+    return parse_year_batch(content, terms)
+
+def process_batch_api(pending: dict, years_dict: dict, batch_size: int):
+    """
+    Fill years_dict through the Batch API, batch_size terms per request line.
+
+    Resumes an interrupted job instead of submitting a new one. Slugs that
+    come back missing, malformed or 'unknown' keep year 0, count as failed
+    and are picked up next run.
+    """
+    if not pending and not batch_api.load_job('years'):
+        logging.info("No terms need a year")
+        return
+    slugs = list(pending)
+    chunks = {f"years-{i}": slugs[start:start + batch_size]
+              for i, start in enumerate(range(0, len(slugs), batch_size))}
+    requests_by_id = {custom_id: year_batch_request({slug: pending[slug] for slug in chunk})
+                      for custom_id, chunk in chunks.items()}
+
+    job, contents, errors = batch_api.run('years', requests_by_id, API_KEY, meta=chunks)
+    found = 0
+    for custom_id, chunk in job['meta'].items():
+        if custom_id in errors:
+            logging.warning(f"{custom_id} failed: {errors[custom_id]}")
+        years = parse_year_batch(contents[custom_id], chunk) if custom_id in contents else {}
+        resolved = {slug: year for slug, year in years.items() if year}
+        stage_metrics.count('items_failed', len(chunk) - len(resolved))
+        for slug, year in resolved.items():
+            years_dict[slug] = year
+            found += 1
+    save_years(years_dict)
+    batch_api.finish(job)
+    logging.info(f"Batch API: {found} of {sum(len(chunk) for chunk in job['meta'].values())} terms got a year")
+
+def process_batches(pending: dict, years_dict: dict, batch_size: int):
+    """Fill years_dict for pending {slug: (title, summary)}, re-queuing malformed answers."""
+    attempts = {slug: 0 for slug in pending}
+    queue = list(pending)
+    requests_made = 0
+    while queue:
+        batch, queue = queue[:batch_size], queue[batch_size:]
+        years = estimate_years_batch({slug: pending[slug] for slug in batch},
+                                     cache=not any(attempts[slug] for slug in batch))
+        requests_made += 1
+
+        for slug, year in years.items():
+            if year:
+                years_dict[slug] = year
+            else:
+                # 'unknown' is a valid answer but leaves the term without a year
+                stage_metrics.count('items_failed')
+        if years:
+            save_years(years_dict)
 
-def save_years(years_dict: dict):
-    """Save year mappings to years.json."""
-    with open('../data/years.json', 'w', encoding='utf-8') as f:
-        json.dump(years_dict, f, sort_keys=True, indent=2)
+        retry = []
+        for slug in batch:
+            if slug in years:
+                continue
+            attempts[slug] += 1
+            if attempts[slug] < MAX_BATCH_ATTEMPTS:
+                retry.append(slug)
+            else:
+                logging.warning(f"No valid year for {slug} after {MAX_BATCH_ATTEMPTS} attempts")
+                stage_metrics.count('items_failed')
+        if retry:
+            logging.info(f"Re-queuing {len(retry)} slugs with missing or malformed years")
+            queue.extend(retry)
+
+    found = sum(1 for slug in pending if years_dict.get(slug))
+    logging.info(f"Batched {len(pending)} terms in {requests_made} requests; {found} now have a year")
+
+def load_existing_years() -> FieldDict:
+    """Load existing year mappings from the metadata store."""
+    return FieldDict('years')
+
+@profiling.span('persist')
+def save_years(years_dict: FieldDict):
+    """Store the year mappings changed since the last save."""
+    years_dict.commit()
 
-def process_markdown_files(directory: Path):
-    """Process all markdown files in the directory."""
+def process_markdown_files(directory: Path, batch_size: int = None, use_batch_api: bool = False):
+    """Process all markdown files in the directory, batch_size terms per request if given."""
     years_dict = load_existing_years()
-    logging.info(f"Found {len(years_dict)} existing terms in years.json\n")
-    
-    # Get all markdown files
-    md_files = list(directory.glob('**/*.md'))
-    filtered_files = [f for f in md_files if 'src/content/articles/' not in str(f)]
-    
-    # Create a set of slugs from the filenames
-    file_slugs = {f.stem for f in filtered_files}
-    # Create a set of existing slugs from years.json
-    existing_slugs = set(years_dict.keys())
-    
-    # Find files that don't have year data
-    missing_slugs = file_slugs - existing_slugs
-    if missing_slugs:
-        logging.info(f"Found {len(missing_slugs)} files without year data")
-        # Add them to years_dict with 0 value
-        for slug in missing_slugs:
-            years_dict[slug] = 0
-        save_years(years_dict)
-    
-    # Only process terms that have a year of 0
-    zero_terms = {slug: year for slug, year in years_dict.items() if year == 0}
-    logging.info(f"Found {len(zero_terms)} terms with year 0 to process\n")
-    
-    processed = 0
-    total_files = len(zero_terms)
-    
-    for slug in zero_terms:
-        processed += 1
-        logging.info(f"\nProgress: {processed}/{total_files} files")
-        
-        try:
-            # Find the corresponding markdown file
-            md_file = next(f for f in filtered_files if slug in str(f))
-            post = frontmatter.load(md_file)
-            title = post.metadata.get('title', '')
-            summary = post.metadata.get('summary', '')
-            
-            if not title:
+    try:
+        logging.info(f"Found {len(years_dict)} existing terms in years.json\n")
+
+        # Parsed articles keyed by filename stem
+        articles = load_corpus(directory)
+
+        # Create a set of slugs from the filenames
+        file_slugs = set(articles)
+        # Create a set of existing slugs from years.json
+        existing_slugs = set(years_dict.keys())
+
+        # Find files that don't have year data
+        missing_slugs = file_slugs - existing_slugs
+        if missing_slugs:
+            logging.info(f"Found {len(missing_slugs)} files without year data")
+            # Add them to years_dict with 0 value
+            for slug in missing_slugs:
+                years_dict[slug] = 0
+            save_years(years_dict)
+
+        # Only process terms that have a year of 0
+        zero_terms = {slug: year for slug, year in years_dict.items() if year == 0}
+        logging.info(f"Found {len(zero_terms)} terms with year 0 to process\n")
+        stage_metrics.count('items_processed', len(zero_terms))
+        stage_metrics.count('items_skipped', len(file_slugs - set(zero_terms)))
+
+        if batch_size or use_batch_api:
+            pending = {}
+            for slug in zero_terms:
+                article = articles.get(slug)
+                if article and article['title']:
+                    pending[slug] = (article['title'], article['summary'])
+            if use_batch_api:
+                process_batch_api(pending, years_dict, batch_size or DEFAULT_BATCH_SIZE)
+            else:
+                process_batches(pending, years_dict, batch_size)
+            return
+
+        processed = 0
+        total_files = len(zero_terms)
+
+        for slug in zero_terms:
+            processed += 1
+            logging.info(f"\nProgress: {processed}/{total_files} files")
+
+            try:
+                article = articles.get(slug)
+                if not article:
+                    continue
+                title = article['title']
+                summary = article['summary']
+
+                if not title:
+                    continue
+
+                # Try to get the year with retry logic
+                year = estimate_year_origin(title, summary, retry=True)
+                if year:  # Only update if we got a non-zero result
+                    years_dict[slug] = year
+                    save_years(years_dict)
+                else:
+                    # No answer, or one that left the year at 0
+                    stage_metrics.count('items_failed')
+
+            except Exception as e:
+                print(f"Error processing {slug}: {str(e)}")
+                stage_metrics.count('items_failed')
                 continue
-                
-            # Try to get the year with retry logic
-            year = estimate_year_origin(title, summary, retry=True)
-            if year != 0:  # Only update if we got a non-zero result
-                years_dict[slug] = year
-                save_years(years_dict)
-                    
-        except Exception as e:
-            print(f"Error processing {slug}: {str(e)}")
-            continue
+    finally:
+        # Write years.json for the site
+        with profiling.span('persist'):
+            years_dict.export()
 
 def main():
+    parser = argparse.ArgumentParser(description='Estimate the year each AI term originated.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore cached API responses and request fresh ones')
+    parser.add_argument('--batch-size', type=int, nargs='?', const=DEFAULT_BATCH_SIZE,
+                        help=f'Ask for N years per request (default {DEFAULT_BATCH_SIZE} if given without N)')
+    parser.add_argument('--batch-api', action='store_true',
+                        help='Submit through the asynchronous Batch API and wait for it (resumes if interrupted)')
+    parser.add_argument('--base-url',
+                        help='Send OpenAI requests to this base URL instead, e.g. fake_batch_server.py (or set OPENAI_BASE_URL)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    if args.no_cache:
+        response_cache.disable()
+    if args.base_url:
+        set_base_url('openai', args.base_url)
+
     vocab_dir = Path('../content/articles/')
     if not vocab_dir.exists():
         print(f"Directory not found: {vocab_dir}")
         return
         
-    process_markdown_files(vocab_dir)
+    with profiling.profiled(args.profile):
+        process_markdown_files(vocab_dir, args.batch_size, args.batch_api)
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,11 @@
 import logging
 import sys
+import argparse
 from pathlib import Path
 from PIL import Image
 import shutil
+import stage_metrics
+import profiling
 
 # Configure logging (similar to your classifier.py)
 logging.basicConfig(
@@ -34,6 +37,7 @@ def get_unprocessed_images():
     # Filter out already processed files
     unprocessed = [f for f in source_files if f.name not in existing_names]
     logging.info(f"Found {len(unprocessed)} unprocessed WEBP files")
+    stage_metrics.count('items_skipped', len(source_files) - len(unprocessed))
     return unprocessed
 
 def compress_image(source_path: Path):
@@ -77,8 +81,8 @@ def compress_image(source_path: Path):
     except Exception as e:
         logging.error(f"Failed to compress {source_path.name}: {e}")
 
-def main():
-    """Main function to execute the script."""
+def compress_images():
+    """Compress every source image that has no compressed copy yet."""
     if not SOURCE_DIR.exists() or not SOURCE_DIR.is_dir():
         logging.error(f"Source directory '{SOURCE_DIR.resolve()}' does not exist or is not a directory.")
         sys.exit(1)
@@ -92,8 +96,17 @@ def main():
 
     for image_path in unprocessed_images:
         compress_image(image_path)
+        stage_metrics.count('items_processed')
 
     logging.info("Image compression completed.")
 
+def main():
+    """Main function to execute the script."""
+    parser = argparse.ArgumentParser(description='Compress and scale article images.')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    with profiling.profiled(args.profile):
+        compress_images()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,74 +1,45 @@
 import os
 import json
-import re
+import argparse
 from pathlib import Path
+from corpus_index import load_corpus
+import metadata_store
+import stage_metrics
+import profiling
 
-def extract_frontmatter(content):
-    """Extract frontmatter from markdown content."""
-    match = re.match(r'^---\s*(.*?)\s*---\s*', content, re.DOTALL)
-    if not match:
-        return None
-    
-    frontmatter = {}
-    yaml_text = match.group(1)
-    
-    # Simple line-by-line parsing
-    for line in yaml_text.split('\n'):
-        line = line.strip()
-        if line and ':' in line:
-            key, value = line.split(':', 1)
-            frontmatter[key.strip()] = value.strip()
-    
-    return frontmatter
-
-def load_years(years_file):
-    """Load years data from JSON file."""
+def load_years():
+    """Load years data from the metadata store."""
     try:
-        with open(years_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return metadata_store.read_field(metadata_store.connect(), 'years')
     except Exception as e:
-        print(f"Error loading years file: {e}")
+        print(f"Error loading years: {e}")
         return {}
 
-def create_flashcards(articles_dir, years_file, output_file):
+def create_flashcards(articles_dir, output_file):
     """Create flashcards JSON file from articles directory and years data."""
     flashcards = []
     skipped_files = []
-    error_files = []
-    total_files = 0
     
     # Load years data
-    years_data = load_years(years_file)
+    years_data = load_years()
     
-    for root, _, files in os.walk(articles_dir):
-        for file in files:
-            if file.endswith('.md'):
-                total_files += 1
-                file_path = os.path.join(root, file)
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    frontmatter = extract_frontmatter(content)
-                    
-                    if frontmatter and 'title' in frontmatter:
-                        # Get the slug from frontmatter or filename
-                        slug = frontmatter.get('slug', file[:-3])
-                        year = years_data.get(slug, 0)
-                        
-                        flashcard = {
-                            "title": frontmatter['title'],
-                            "definition": frontmatter.get('summary', ''),
-                            "year": year,
-                            "slug": slug
-                        }
-                        flashcards.append(flashcard)
-                    else:
-                        skipped_files.append(file)
-                
-                except Exception as e:
-                    error_files.append((file, str(e)))
+    articles = load_corpus(articles_dir)
+    total_files = len(articles)
+
+    for stem, article in articles.items():
+        if article['title']:
+            slug = article['slug']
+            year = years_data.get(slug, 0)
+
+            flashcard = {
+                "title": article['title'],
+                "definition": article['summary'],
+                "year": year,
+                "slug": slug
+            }
+            flashcards.append(flashcard)
+        else:
+            skipped_files.append(f"{stem}.md")
     
     # Create the output JSON structure
     output_data = {
@@ -83,27 +54,28 @@ def create_flashcards(articles_dir, years_file, output_file):
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(output_data, f, indent=2, ensure_ascii=False)
     
+    stage_metrics.count('items_processed', len(flashcards))
+    stage_metrics.count('items_skipped', len(skipped_files))
+
     # Print summary
     print(f"\nProcessing Summary:")
     print(f"Total files found: {total_files}")
     print(f"Successfully processed: {len(flashcards)}")
     print(f"Skipped files (no frontmatter/title): {len(skipped_files)}")
-    print(f"Files with errors: {len(error_files)}")
     
     if skipped_files:
         print("\nSkipped files:")
         for file in skipped_files:
             print(f"- {file}")
-    
-    if error_files:
-        print("\nFiles with errors:")
-        for file, error in error_files:
-            print(f"- {file}: {error}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build flashcards.json from the articles and their years.')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+
     script_dir = os.path.dirname(os.path.abspath(__file__))
     articles_dir = os.path.join(script_dir, "..", "content", "articles")
-    years_file = os.path.join(script_dir, "..", "data", "years.json")
     output_file = os.path.join(script_dir, "..", "data", "flashcards.json")
     
-    create_flashcards(articles_dir, years_file, output_file)
\ No newline at end of file
+    with profiling.profiled(args.profile):
+        create_flashcards(articles_dir, output_file)
\ No newline at end of file
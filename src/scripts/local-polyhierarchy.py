@@ -1,78 +1,57 @@
-import os
-import re
 import json
 import logging
 from collections import defaultdict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import networkx as nx
-import pathlib
+import argparse
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+from corpus_index import load_corpus
+from tfidf_index import BACKENDS, build_index, update_index, load_state, save_state
+from ann_index import DEFAULT_PROBE
+from term_vectors import STORE_DIR, write_store
+import metadata_store
+import stage_metrics
+import profiling
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+SIMILARITY_THRESHOLD = 0.35
+# Generality shown for related articles that have no score yet
+DEFAULT_GENERALITY = 0.5
+# LSA cosines run higher than raw TF-IDF ones; 0.55 keeps a similar edge count
+BACKEND_THRESHOLDS = {'tfidf': SIMILARITY_THRESHOLD, 'lsa': 0.55}
+
+@profiling.span('parse')
 def parse_markdown_files(directory):
     terms = {}
-    total_files = 0
-    successful_files = 0
-    failed_files = 0
     failed_filenames = []
     duplicate_terms = []
 
-    for filename in os.listdir(directory):
-        if filename.lower().endswith(".md"):
-            total_files += 1
-            file_path = os.path.join(directory, filename)
-            logging.info(f"Processing file: {file_path}")
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    frontmatter_match = re.search(r'---\s*(.*?)\s*---', content, re.MULTILINE | re.DOTALL)
-                    if frontmatter_match:
-                        frontmatter = frontmatter_match.group(1)
-                        title_match = re.search(r'title:\s*"?([^"\n]+)"?', frontmatter)
-                        summary_match = re.search(r'summary:\s*"?(.*?)(?:"|$|\n)', frontmatter)
-                        slug_match = re.search(r'slug:\s*"?([^"\n]+)"?', frontmatter)
-                        
-                        # Get the main content after frontmatter
-                        main_content = content.split('---', 2)[-1].strip()
-                        
-                        if title_match and summary_match:
-                            title = title_match.group(1).strip()
-                            summary = summary_match.group(1).strip()
-                            summary = re.sub(r'\s+', ' ', summary)
-                            
-                            slug = slug_match.group(1).strip() if slug_match else None
-                            
-                            if title in terms:
-                                duplicate_terms.append((title, filename))
-                                logging.warning(f"Duplicate term found: {title} in {filename}")
-                            
-                            # Store all metadata and content
-                            terms[title] = {
-                                'summary': summary,
-                                'slug': slug,
-                                'content': main_content
-                            }
-                            
-                            logging.info(f"Successfully parsed {filename}")
-                            successful_files += 1
-                        else:
-                            logging.warning(f"Failed to extract required fields from {filename}")
-                            failed_files += 1
-                            failed_filenames.append(filename)
-                    else:
-                        logging.warning(f"No frontmatter found in {filename}")
-                        failed_files += 1
-                        failed_filenames.append(filename)
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {str(e)}")
-                failed_files += 1
-                failed_filenames.append(filename)
+    articles = load_corpus(directory)
+    for stem, article in articles.items():
+        filename = f"{stem}.md"
+        title = article['title']
+        summary = article['summary']
 
-    logging.info(f"Total files processed: {total_files}")
-    logging.info(f"Successfully parsed files: {successful_files}")
-    logging.info(f"Failed files: {failed_files}")
+        if title and summary:
+            if title in terms:
+                duplicate_terms.append((title, filename))
+                logging.warning(f"Duplicate term found: {title} in {filename}")
+
+            # Store all metadata and content
+            terms[title] = {
+                'summary': summary,
+                'slug': article['slug'],
+                'content': article['content']
+            }
+        else:
+            logging.warning(f"Failed to extract required fields from {filename}")
+            failed_filenames.append(filename)
+
+    logging.info(f"Total files processed: {len(articles)}")
+    logging.info(f"Successfully parsed files: {len(articles) - len(failed_filenames)}")
+    logging.info(f"Failed files: {len(failed_filenames)}")
     if failed_filenames:
         logging.info(f"Failed files list: {', '.join(failed_filenames)}")
     logging.info(f"Total terms parsed: {len(terms)}")
@@ -80,62 +59,220 @@ def parse_markdown_files(directory):
         logging.info(f"Duplicate terms found: {duplicate_terms}")
     return terms
 
-def calculate_similarity(terms):
+def combined_texts(terms):
     # Combine title, summary, and main content for each term
-    combined_texts = [
+    return [
         f"{term} {term_data['summary']} {term_data['content']}" 
         for term, term_data in terms.items()
     ]
-    
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(combined_texts)
-    return cosine_similarity(tfidf_matrix)
 
-def create_graph(terms, similarity_matrix, threshold=0.35):
-    G = nx.Graph()
-    term_list = list(terms.keys())
-    for term in term_list:
-        G.add_node(term)
-    
-    # Add edges based on similarity threshold with weights
-    for i in range(len(terms)):
-        for j in range(i+1, len(terms)):
-            similarity = similarity_matrix[i][j]
-            if similarity > threshold:
-                G.add_edge(term_list[i], term_list[j], weight=float(similarity))
-    
+def calculate_similarity(terms, threshold=SIMILARITY_THRESHOLD):
+    """Fit TF-IDF over the whole corpus and return the sparse neighbor graph."""
+    state = build_index(list(terms), combined_texts(terms), threshold)
+    return state['similarity']
+
+def update_similarity(terms, full=False, threshold=SIMILARITY_THRESHOLD, ann_probe=None, backend='tfidf',
+                      with_vectors=False):
+    """
+    Return the sparse neighbor graph, reusing the persisted TF-IDF index.
+
+    Only rows for new, changed or drifted articles are recomputed unless
+    full is set, the settings changed or no usable index exists yet.
+    ann_probe switches full builds, including the fallback when too many
+    rows changed, to the approximate nearest-neighbor index. with_vectors
+    (implied by the lsa backend) also keeps LSA vectors and writes them to
+    the term-vector store.
+    """
+    keys = list(terms)
+    texts = combined_texts(terms)
+    state = None if full else load_state()
+    settings = (backend, threshold, ann_probe)
+    if state is not None and (state['backend'], state['threshold'], state['ann_probe']) != settings:
+        logging.info(f"Similarity settings changed from {state['backend']} at {state['threshold']} "
+                     f"(ANN probe {state['ann_probe']}) to {backend} at {threshold} (ANN probe {ann_probe})")
+        state = None
+    with_vectors = with_vectors or backend == 'lsa'
+    if state is not None and with_vectors and state['components'] is None:
+        logging.info("Term vectors requested but the index has none")
+        state = None
+
+    if state is None:
+        logging.info(f"Building {backend} index from scratch")
+        state = build_index(keys, texts, threshold, ann_probe=ann_probe, backend=backend,
+                            with_vectors=with_vectors)
+        changed = True
+    else:
+        state, recomputed, changed = update_index(state, keys, texts, threshold)
+        logging.info(f"Recomputed {recomputed} similarity rows "
+                     f"({state['incremental_runs']} incremental runs since last full rebuild)")
+
+    if changed:
+        save_state(state)
+    if with_vectors and (changed or not (STORE_DIR / 'index.json').exists()):
+        logging.info(f"Writing term vectors to {STORE_DIR}")
+        write_store([terms[key]['slug'] for key in keys], keys, state['vectors'],
+                    state['components'], state['vocabulary'], state['idf'])
+    return state['similarity']
+
+@profiling.span('graph')
+def create_graph(terms, similarity_matrix, threshold=SIMILARITY_THRESHOLD, max_degree=None, mutual=False):
+    """
+    Build the term graph as a CSR adjacency matrix of similarities.
+
+    Edges are all pairs above threshold, plus a nearest-neighbor edge for each
+    isolated term, plus the spanning edges that connect the components. Row i
+    lists the children of term i; with max_degree set each term keeps only
+    its max_degree most similar children (only pairs that both keep, if
+    mutual), so the matrix is no longer symmetric.
+
+    max_degree is a soft bound. A spanning edge is added in one direction
+    only, as a child of whichever end has fewer children, and forced links
+    go through the term with the fewest children in each component; a term
+    can still go over the cap when both ends of a spanning edge are full,
+    which is logged.
+    """
+    n_terms = len(terms)
+    similarity_matrix = sp.csr_matrix(similarity_matrix)
+
+    # Edges above the similarity threshold, taken from the upper triangle
+    upper = sp.triu(similarity_matrix, k=1).tocoo()
+    above = upper.data > threshold
+    rows, cols, weights = upper.row[above], upper.col[above], upper.data[above]
+
     # Connect isolated nodes to their nearest neighbor
-    isolated_nodes = list(nx.isolates(G))
-    for node in isolated_nodes:
-        i = term_list.index(node)
-        nearest_neighbor_idx = max(range(len(terms)), 
-                                 key=lambda j: similarity_matrix[i][j] if i != j else 0)
-        similarity = float(similarity_matrix[i][nearest_neighbor_idx])
-        G.add_edge(node, term_list[nearest_neighbor_idx], weight=similarity)
-    
+    degree = np.bincount(rows, minlength=n_terms) + np.bincount(cols, minlength=n_terms)
+    has_neighbors = np.diff(similarity_matrix.indptr) > 0
+    isolated = np.flatnonzero((degree == 0) & has_neighbors)
+    if len(isolated):
+        nearest = np.asarray(similarity_matrix[isolated].argmax(axis=1)).ravel()
+        nearest_similarity = np.asarray(similarity_matrix[isolated, nearest]).ravel()
+        rows = np.concatenate([rows, isolated])
+        cols = np.concatenate([cols, nearest])
+        weights = np.concatenate([weights, nearest_similarity])
+
+    adjacency = symmetric_adjacency(rows, cols, weights, n_terms)
+    if max_degree:
+        adjacency = cap_degree(adjacency, max_degree, mutual)
+
     # Ensure the graph is fully connected
-    if not nx.is_connected(G):
-        components = list(nx.connected_components(G))
-        for i in range(len(components) - 1):
-            node1 = next(iter(components[i]))
-            node2 = next(iter(components[i+1]))
-            # Add a minimal weight for forced connections
-            G.add_edge(node1, node2, weight=threshold)
-    
-    return G
+    n_components, labels = connected_components(adjacency, directed=False)
+    if n_components > 1:
+        logging.info(f"Connecting {n_components} components")
+        if not max_degree:
+            rows, cols, weights = connect_components(similarity_matrix, labels, n_components, threshold)
+            adjacency = adjacency.maximum(symmetric_adjacency(rows, cols, weights, n_terms)).tocsr()
+        else:
+            adjacency = add_capped_links(adjacency, similarity_matrix, labels, n_components,
+                                         threshold, max_degree)
+
+    return adjacency
+
+def add_capped_links(adjacency, similarity_matrix, labels, n_components, threshold, max_degree):
+    """Add the spanning edges to a degree-capped graph, each as a child of the end with room."""
+    children = np.diff(adjacency.indptr)
+    rows, cols, weights = connect_components(similarity_matrix, labels, n_components, threshold, children)
+    # One direction is enough to connect the graph; give it to the end with fewer children
+    swap = children[cols] < children[rows]
+    rows, cols = np.where(swap, cols, rows), np.where(swap, rows, cols)
+    for row in rows:
+        children[row] += 1
+    links = sp.csr_matrix((weights, (rows, cols)), shape=adjacency.shape)
+    adjacency = adjacency.maximum(links).tocsr()
+
+    over = np.diff(adjacency.indptr) > max_degree
+    if over.any():
+        logging.info(f"{over.sum()} terms exceed --max-degree {max_degree} to keep the graph connected "
+                     f"(max {np.diff(adjacency.indptr).max()})")
+    return adjacency
+
+def cap_degree(adjacency, max_degree, mutual=False):
+    """Keep each row's max_degree strongest entries; with mutual, only pairs kept by both ends."""
+    coo = adjacency.tocoo()
+    order = np.lexsort((-coo.data, coo.row))
+    rows, cols, weights = coo.row[order], coo.col[order], coo.data[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < max_degree
+    capped = sp.csr_matrix((weights[keep], (rows[keep], cols[keep])), shape=adjacency.shape)
+    if mutual:
+        capped = capped.multiply(capped.T > 0).tocsr()
+    return capped
+
+def symmetric_adjacency(rows, cols, weights, n_terms):
+    """Symmetric CSR matrix holding each (row, col, weight) edge in both directions."""
+    edges = sp.csr_matrix((weights, (rows, cols)), shape=(n_terms, n_terms))
+    # Duplicate edges are summed by the constructor, so merge with maximum
+    return edges.maximum(edges.T).tocsr()
+
+def connect_components(similarity_matrix, labels, n_components, threshold, degree=None):
+    """
+    Edges linking the components along a maximum spanning tree.
+
+    Each pair of components is weighted by the strongest similarity between
+    any two of their terms; components with no similarity to anything are
+    chained to the first component with a minimal weight. Given each term's
+    degree, the forced links go through the term with the lowest degree in
+    each component and form a chain rather than a star.
+    """
+    coo = similarity_matrix.tocoo()
+    between = labels[coo.row] != labels[coo.col]
+    rows, cols, weights = coo.row[between], coo.col[between], coo.data[between]
+
+    # Strongest link per component pair
+    order = np.lexsort((-weights, labels[cols], labels[rows]))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    pair = labels[rows] * n_components + labels[cols]
+    if len(pair):
+        first = np.r_[True, pair[1:] != pair[:-1]]
+        rows, cols, weights = rows[first], cols[first], weights[first]
+    # Otherwise nothing links any two components: the tree below comes out
+    # empty and every component gets a forced link instead
+
+    # Maximum spanning tree over components; costs stay positive so that
+    # csgraph does not mistake a perfect similarity for a missing edge
+    component_graph = sp.csr_matrix((2.0 - weights, (labels[rows], labels[cols])),
+                                    shape=(n_components, n_components))
+    tree = minimum_spanning_tree(component_graph.minimum(component_graph.T)).tocoo()
+    best = {}
+    for r, c, w, a, b in zip(rows, cols, weights, labels[rows], labels[cols]):
+        best[(a, b)] = best[(b, a)] = (r, c, w)
+    edges = [best[(a, b)] for a, b in zip(tree.row, tree.col)]
+
+    # Components the tree could not reach get a minimal-weight forced link
+    n_linked, tree_labels = connected_components(tree, directed=False)
+    if n_linked > 1:
+        if degree is None:
+            representatives = np.array([np.flatnonzero(labels == c)[0] for c in range(n_components)])
+            root = tree_labels[0]
+            for group in range(n_linked):
+                if group != root:
+                    component = np.flatnonzero(tree_labels == group)[0]
+                    edges.append((representatives[component], representatives[0], threshold))
+        else:
+            # The least connected term of each group, linked to the previous group's
+            order = np.lexsort((degree, tree_labels[labels]))
+            group_of = tree_labels[labels[order]]
+            representatives = order[np.r_[True, group_of[1:] != group_of[:-1]]]
+            for previous, term in zip(representatives[:-1], representatives[1:]):
+                edges.append((term, previous, threshold))
 
-def create_hierarchy(G):
+    rows, cols, weights = (np.array(values) for values in zip(*edges))
+    return rows, cols, weights.astype(np.float64)
+
+@profiling.span('hierarchy')
+def create_hierarchy(adjacency, terms):
+    term_list = list(terms.keys())
     hierarchy = defaultdict(dict)
     # Store both neighbors and their similarity scores
-    for node in G.nodes():
-        neighbors = list(G.neighbors(node))
-        # Get edge data (similarity scores) for each neighbor
-        neighbor_scores = {neighbor: G.get_edge_data(node, neighbor)['weight'] 
-                         for neighbor in neighbors}
-        if len(neighbors) > 0:
-            hierarchy[node] = neighbor_scores
+    for i, term in enumerate(term_list):
+        start, end = adjacency.indptr[i], adjacency.indptr[i + 1]
+        if end > start:
+            hierarchy[term] = {
+                term_list[j]: float(weight)
+                for j, weight in zip(adjacency.indices[start:end], adjacency.data[start:end])
+            }
     return hierarchy
 
+@profiling.span('hierarchy')
 def assign_ids(hierarchy, terms):
     # Use slugs as IDs
     id_mapping = {}
@@ -165,36 +302,40 @@ def assign_ids(hierarchy, terms):
     return id_mapping
 
 def load_additional_data():
-    """Load data from generality.json and years.json"""
+    """Load generality, years and component flags from the metadata store"""
     data = {
         'generality': {},
-        'years': {}
+        'years': {},
+        'components': set()
     }
     
     try:
-        with open('../data/generality.json', 'r') as f:
-            data['generality'] = json.load(f)
-        logging.info("Successfully loaded generality.json")
-    except Exception as e:
-        logging.error(f"Error loading generality.json: {str(e)}")
-        
-    try:
-        with open('../data/years.json', 'r') as f:
-            data['years'] = json.load(f)
-        logging.info("Successfully loaded years.json")
+        connection = metadata_store.connect()
+        data['generality'] = metadata_store.read_field(connection, 'generality')
+        data['years'] = metadata_store.read_field(connection, 'years')
+        data['components'] = metadata_store.refresh_components(connection)
+        logging.info("Successfully loaded metadata store")
     except Exception as e:
-        logging.error(f"Error loading years.json: {str(e)}")
-        
-
-
+        logging.error(f"Error loading metadata store: {str(e)}")
     
     return data
 
-def check_component_exists(slug):
+def check_component_exists(slug, additional_data):
     """Check if a component file exists for the given slug"""
-    component_path = pathlib.Path(f"../components/articles/0/{slug}.tsx")
-    return component_path.is_file()
+    return slug in additional_data['components']
+
+def average_generality(term, slug, additional_data):
+    """Mean of the term's generality scores, or None if it has none or only the old placeholder"""
+    json_scores = additional_data['generality'].get(slug)
+    if json_scores == metadata_store.LEGACY_GENERALITY_FALLBACK:
+        logging.warning(f"Ignoring placeholder generality for term: {term}")
+        return None
+    if not json_scores:
+        logging.warning(f"No generality found for term: {term}")
+        return None
+    return round(sum(json_scores) / len(json_scores), 3)
 
+@profiling.span('hierarchy')
 def create_polyhierarchy(hierarchy, id_mapping, terms):
     additional_data = load_additional_data()
     polyhierarchy = []
@@ -202,12 +343,7 @@ def create_polyhierarchy(hierarchy, id_mapping, terms):
     for term, connections in hierarchy.items():
         try:
             # Get generality from generality.json
-            generality_avg = None
-            if id_mapping[term] in additional_data['generality']:
-                json_scores = additional_data['generality'][id_mapping[term]]
-                generality_avg = round(sum(json_scores) / len(json_scores), 3)
-            else:
-                logging.warning(f"No generality found for term: {term}")
+            generality_avg = average_generality(term, id_mapping[term], additional_data)
 
 
 
@@ -215,7 +351,7 @@ def create_polyhierarchy(hierarchy, id_mapping, terms):
             year = additional_data['years'].get(id_mapping[term])
 
             # Check if component exists
-            has_component = check_component_exists(id_mapping[term])
+            has_component = check_component_exists(id_mapping[term], additional_data)
 
             node = {
                 "slug": id_mapping[term],
@@ -241,12 +377,7 @@ def create_polyhierarchy(hierarchy, id_mapping, terms):
         if term not in hierarchy:
             try:
                 # Get generality from generality.json
-                generality_avg = None
-                if id_mapping[term] in additional_data['generality']:
-                    json_scores = additional_data['generality'][id_mapping[term]]
-                    generality_avg = round(sum(json_scores) / len(json_scores), 3)
-                else:
-                    logging.warning(f"No generality found for leaf term: {term}")
+                generality_avg = average_generality(term, id_mapping[term], additional_data)
 
 
 
@@ -254,7 +385,7 @@ def create_polyhierarchy(hierarchy, id_mapping, terms):
                 year = additional_data['years'].get(id_mapping[term])
 
                 # Check if component exists for leaf nodes
-                has_component = check_component_exists(id_mapping[term])
+                has_component = check_component_exists(id_mapping[term], additional_data)
 
                 node = {
                     "slug": id_mapping[term],
@@ -271,35 +402,185 @@ def create_polyhierarchy(hierarchy, id_mapping, terms):
     
     return polyhierarchy
 
-def main(directory):
+def related_entry(item, relationship, similarity):
+    generality = item['generality']
+    return {
+        'slug': item['slug'],
+        'relationship': relationship,
+        'similarity': similarity or 0,
+        'title': item['name'],
+        'summary': item['summary'],
+        'year': item['year'] or 0,
+        'generality': generality if isinstance(generality, list) else [generality or DEFAULT_GENERALITY],
+    }
+
+def create_related_index(polyhierarchy):
+    """
+    Precompute each article's related-articles list, keyed by slug.
+
+    Children and parents are joined with their article data, a pair linked
+    both ways is marked bidirectional, and each list is sorted bidirectional
+    first and then by similarity, so the site needs one lookup per page.
+    """
+    items = {item['slug']: item for item in polyhierarchy}
+    parents = defaultdict(list)
+    for item in polyhierarchy:
+        for child in item['children']:
+            parents[child['slug']].append((item, child.get('similarity')))
+
+    related_index = {}
+    for item in polyhierarchy:
+        related = {}
+        for child in item['children']:
+            if child['slug'] in items:
+                related[child['slug']] = related_entry(items[child['slug']], 'child', child.get('similarity'))
+        for parent, similarity in parents[item['slug']]:
+            entry = related_entry(parent, 'parent', similarity)
+            existing = related.get(parent['slug'])
+            if existing:
+                entry['similarity'] = max(entry['similarity'], existing['similarity'])
+                if existing['relationship'] == 'child':
+                    entry['relationship'] = 'bidirectional'
+            related[parent['slug']] = entry
+        related_index[item['slug']] = sorted(
+            related.values(), key=lambda entry: (entry['relationship'] != 'bidirectional', -entry['similarity']))
+    return related_index
+
+def degree_report(polyhierarchy, output_bytes):
+    """Log the distribution of children per term and the size of the output."""
+    degrees = np.array([len(node['children']) for node in polyhierarchy])
+    if not len(degrees):
+        return
+    p50, p90, p99 = np.percentile(degrees, [50, 90, 99])
+    logging.info(f"Degree distribution over {len(degrees)} terms: min {degrees.min()}, "
+                 f"median {p50:.0f}, p90 {p90:.0f}, p99 {p99:.0f}, max {degrees.max()}, "
+                 f"mean {degrees.mean():.2f}; output {output_bytes / 1024:.0f} KB")
+
+@profiling.span('write')
+def serialize(polyhierarchy):
+    return json.dumps(polyhierarchy, indent=2)
+
+@profiling.span('write')
+def serialize_related(polyhierarchy):
+    return json.dumps(create_related_index(polyhierarchy), indent=2)
+
+def build_polyhierarchy(terms, similarity_matrix, threshold, max_degree=None, mutual=False):
+    adjacency = create_graph(terms, similarity_matrix, threshold, max_degree, mutual)
+    hierarchy = create_hierarchy(adjacency, terms)
+    id_mapping = assign_ids(hierarchy, terms)
+    return create_polyhierarchy(hierarchy, id_mapping, terms)
+
+def fit_byte_budget(terms, similarity_matrix, threshold, byte_budget, max_degree=None, mutual=False):
+    """
+    Largest degree cap (at most max_degree) whose outputs fit byte_budget.
+
+    The budget covers polyhierarchy.json and related.json together. Returns
+    the polyhierarchy, both serializations and the cap that was used.
+    """
+    def build(cap):
+        polyhierarchy = build_polyhierarchy(terms, similarity_matrix, threshold, cap, mutual)
+        return polyhierarchy, serialize(polyhierarchy), serialize_related(polyhierarchy), cap
+
+    def fits(candidate):
+        return len(candidate[1]) + len(candidate[2]) <= byte_budget
+
+    candidate = build(max_degree)
+    if fits(candidate):
+        return candidate
+
+    # Binary search over the cap; fewer children per term means fewer bytes
+    low, high = 1, max(len(node['children']) for node in candidate[0]) - 1
+    best = None
+    while low <= high:
+        cap = (low + high) // 2
+        candidate = build(cap)
+        if fits(candidate):
+            best = candidate
+            low = cap + 1
+        else:
+            high = cap - 1
+
+    if best is None:
+        logging.warning(f"Output does not fit {byte_budget} bytes even at one child per term")
+        return build(1)
+    logging.info(f"Capped degree at {best[3]} to fit the {byte_budget} byte budget")
+    return best
+
+def main(directory, full=False, ann_probe=None, backend='tfidf', threshold=None,
+         max_degree=None, mutual=False, byte_budget=None, with_vectors=False):
+    threshold = threshold or BACKEND_THRESHOLDS[backend]
     logging.info(f"Starting processing for directory: {directory}")
     terms = parse_markdown_files(directory)
+    stage_metrics.count('items_processed', len(terms))
     
     if not terms:
         logging.error("No terms were parsed. Exiting.")
         return
 
-    logging.info("Calculating similarity matrix")
-    similarity_matrix = calculate_similarity(terms)
-    
-    logging.info("Creating graph")
-    G = create_graph(terms, similarity_matrix)
-    
-    logging.info("Creating hierarchy")
-    hierarchy = create_hierarchy(G)
+    logging.info("Calculating similarity graph")
+    similarity_matrix = update_similarity(terms, full=full, threshold=threshold,
+                                          ann_probe=ann_probe, backend=backend, with_vectors=with_vectors)
     
-    logging.info("Assigning IDs")
-    id_mapping = assign_ids(hierarchy, terms)  # Updated to pass terms
+    if byte_budget:
+        logging.info(f"Creating polyhierarchy within {byte_budget} bytes")
+        polyhierarchy, output, related_output, max_degree = fit_byte_budget(
+            terms, similarity_matrix, threshold, byte_budget, max_degree, mutual)
+    else:
+        logging.info("Creating graph")
+        adjacency = create_graph(terms, similarity_matrix, threshold, max_degree, mutual)
+        
+        logging.info("Creating hierarchy")
+        hierarchy = create_hierarchy(adjacency, terms)
+        
+        logging.info("Assigning IDs")
+        id_mapping = assign_ids(hierarchy, terms)  # Updated to pass terms
+        
+        logging.info("Creating polyhierarchy")
+        polyhierarchy = create_polyhierarchy(hierarchy, id_mapping, terms)
+        output = serialize(polyhierarchy)
+        related_output = serialize_related(polyhierarchy)
     
-    logging.info("Creating polyhierarchy")
-    polyhierarchy = create_polyhierarchy(hierarchy, id_mapping, terms)
+    with profiling.span('write'):
+        output_file = '../data/polyhierarchy.json'
+        logging.info(f"Writing results to {output_file}")
+        with open(output_file, 'w') as f:
+            f.write(output)
+
+        related_file = '../data/related.json'
+        logging.info(f"Writing related-articles index to {related_file}")
+        with open(related_file, 'w') as f:
+            f.write(related_output)
     
-    output_file = '../data/polyhierarchy.json'
-    logging.info(f"Writing results to {output_file}")
-    with open(output_file, 'w') as f:
-        json.dump(polyhierarchy, f, indent=2)
+    degree_report(polyhierarchy, len(output) + len(related_output))
     
     logging.info("Processing completed successfully")
 
 if __name__ == "__main__":
-    main("../content/articles")
+    parser = argparse.ArgumentParser(description='Build polyhierarchy.json from article similarity.')
+    parser.add_argument('--full', action='store_true',
+                        help='Refit TF-IDF over the whole corpus instead of updating the persisted index')
+    parser.add_argument('--backend', choices=BACKENDS, default='tfidf',
+                        help='Compare terms by raw TF-IDF or by LSA (TruncatedSVD) vectors')
+    parser.add_argument('--threshold', type=float,
+                        help='Similarity above which terms are linked (default depends on --backend)')
+    parser.add_argument('--max-degree', type=int,
+                        help='Keep at most this many most-similar children per term (soft: links that keep the graph connected may exceed it)')
+    parser.add_argument('--mutual', action='store_true',
+                        help='With --max-degree, keep only pairs that are in each other\'s top list')
+    parser.add_argument('--byte-budget', type=int,
+                        help='Lower the degree cap until polyhierarchy.json and related.json together fit in this many bytes')
+    parser.add_argument('--ann', action='store_true',
+                        help='Use the approximate nearest-neighbor index for full builds')
+    parser.add_argument('--ann-probe', type=int, default=DEFAULT_PROBE,
+                        help='Inverted lists probed per term in --ann mode; higher is slower but more exact')
+    parser.add_argument('--vectors', action='store_true',
+                        help='Also fit LSA and write the term-vector store for term_vectors.py (always on with --backend lsa)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    if args.mutual and not args.max_degree:
+        parser.error('--mutual requires --max-degree')
+    with profiling.profiled(args.profile):
+        main("../content/articles", full=args.full,
+             ann_probe=args.ann_probe if args.ann else None, backend=args.backend,
+             threshold=args.threshold, max_degree=args.max_degree, mutual=args.mutual,
+             byte_budget=args.byte_budget, with_vectors=args.vectors)
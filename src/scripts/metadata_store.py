@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+
+# Per-term metadata in one SQLite database (WAL mode).
+#
+# Each field -- years, generality scores, generality failures, names and
+# component flags -- is a table keyed by slug, so stages updating different
+# fields never contend and a single term is one indexed lookup. The JSON
+# files in src/data stay the committed artifacts the site reads: the store
+# imports a file whenever it changed outside the store (fresh checkout, git
+# pull, hand edit) and export() writes it back atomically, in the same order
+# and format, at the end of every stage that changes it.
+#
+# Every update is also appended to a journal table until the field is next
+# exported. When a JSON file changes under unexported updates (a pull in the
+# middle of an interrupted run), the file is imported and the journal
+# replayed over it, so no committed result is lost. Journals left in src/data
+# by the earlier JournaledDict (years.json.journal) are replayed the same way
+# and removed.
+#
+#   python metadata_store.py export          # write every JSON file
+#   python metadata_store.py get attention   # all fields for one slug
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DB_FILE = SCRIPT_DIR / '.cache' / 'metadata.sqlite'
+DATA_DIR = SCRIPT_DIR.parent / 'data'
+COMPONENTS_DIR = SCRIPT_DIR.parent / 'components' / 'articles' / '0'
+
+# Field -> (JSON file, json.dump options); fields without a file live only in the store
+FIELDS = {
+    'years': ('years.json', {'sort_keys': True, 'indent': 2}),
+    'generality': ('generality.json', {'indent': 2}),
+    'generality_failures': ('generality-failures.json', {'sort_keys': True, 'indent': 2}),
+    'names': ('names.json', {'indent': 2, 'ensure_ascii': False}),
+    'components': (None, None),
+}
+
+# Written by older llm-generality.py runs when scoring failed; not a real score
+LEGACY_GENERALITY_FALLBACK = [0.5] * 7
+
+
+def atomic_write_json(path, data, **dump_kwargs):
+    """Write JSON to path via a fsynced temp file and rename, so readers never see a partial file."""
+    path = Path(path)
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_file.replace(path)
+
+
+def connect(db_file=None, data_dir=None):
+    """Open the store, creating it and importing changed JSON files as needed."""
+    db_file = Path(db_file or DB_FILE)
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(db_file, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+        for field in FIELDS:
+            connection.execute(f'''
+                CREATE TABLE IF NOT EXISTS {field} (
+                    slug TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated REAL NOT NULL
+                )
+            ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS sources (
+                field TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                dirty INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                field TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                value TEXT
+            )
+        ''')
+    for field in FIELDS:
+        _sync_from_json(connection, field, data_dir)
+        _replay_legacy_journal(connection, field, data_dir)
+    return connection
+
+
+def _json_path(field, data_dir=None):
+    filename = FIELDS[field][0]
+    return Path(data_dir or DATA_DIR) / filename if filename else None
+
+
+def _sync_from_json(connection, field, data_dir):
+    """Re-import a field's JSON file if it changed since the store last read or wrote it."""
+    path = _json_path(field, data_dir)
+    if not path or not path.exists():
+        return
+    mtime_ns = path.stat().st_mtime_ns
+    row = connection.execute('SELECT mtime_ns, dirty FROM sources WHERE field = ?', (field,)).fetchone()
+    if row and row[0] == mtime_ns:
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    data = json.loads(content) if content else {}
+    now = time.time()
+    with connection:
+        connection.execute(f'DELETE FROM {field}')
+        connection.executemany(f'INSERT INTO {field} (slug, value, updated) VALUES (?, ?, ?)',
+                               [(slug, json.dumps(value, ensure_ascii=False), now) for slug, value in data.items()])
+        # Unexported updates still apply on top of the new file
+        journaled = connection.execute('SELECT slug, value FROM journal WHERE field = ? ORDER BY seq',
+                                       (field,)).fetchall()
+        for slug, value in journaled:
+            _apply(connection, field, slug, value, now)
+        connection.execute('INSERT OR REPLACE INTO sources (field, mtime_ns, dirty) VALUES (?, ?, ?)',
+                           (field, mtime_ns, int(bool(journaled))))
+    logging.info(f"Imported {len(data)} {field} entries from {path.name}")
+    if journaled:
+        logging.info(f"Replayed {len(journaled)} unexported {field} updates over {path.name}")
+
+
+def _replay_legacy_journal(connection, field, data_dir):
+    """Fold a <file>.journal left by the old JournaledDict into the store and remove it."""
+    path = _json_path(field, data_dir)
+    journal_path = path and path.with_name(path.name + '.journal')
+    if not journal_path or not journal_path.exists():
+        return
+    updates = {}
+    lines = journal_path.read_text(encoding='utf-8').splitlines()
+    for number, line in enumerate(lines, 1):
+        try:
+            slug, value = json.loads(line)
+        except ValueError:
+            # Only the last line can be torn by a crash mid-append
+            level = logging.INFO if number == len(lines) else logging.WARNING
+            logging.log(level, f"Skipping unreadable line {number} of {journal_path.name}")
+            continue
+        updates[slug] = None if value == {'__deleted__': True} else value
+    upsert(connection, field, updates)
+    journal_path.unlink()
+    logging.info(f"Replayed {len(updates)} journaled {field} updates from {journal_path.name}")
+
+
+def _apply(connection, field, slug, value, now):
+    """Set one slug to a JSON-encoded value, or delete it when value is None."""
+    if value is None:
+        connection.execute(f'DELETE FROM {field} WHERE slug = ?', (slug,))
+    else:
+        connection.execute(f'''
+            INSERT INTO {field} (slug, value, updated) VALUES (?, ?, ?)
+            ON CONFLICT(slug) DO UPDATE SET value = excluded.value, updated = excluded.updated
+        ''', (slug, value, now))
+
+
+def read_field(connection, field):
+    """{slug: value} for a field, in insertion order."""
+    rows = connection.execute(f'SELECT slug, value FROM {field} ORDER BY rowid')
+    return {slug: json.loads(value) for slug, value in rows}
+
+
+def lookup(connection, slug):
+    """{field: value} for one slug, only the fields it has."""
+    values = {}
+    for field in FIELDS:
+        row = connection.execute(f'SELECT value FROM {field} WHERE slug = ?', (slug,)).fetchone()
+        if row:
+            values[field] = json.loads(row[0])
+    return values
+
+
+def upsert(connection, field, values):
+    """Set {slug: value} for a field and journal it until export; a value of None deletes the slug."""
+    now = time.time()
+    with connection:
+        for slug, value in values.items():
+            encoded = None if value is None else json.dumps(value, ensure_ascii=False)
+            _apply(connection, field, slug, encoded, now)
+            if _json_path(field):
+                connection.execute('INSERT INTO journal (field, slug, value) VALUES (?, ?, ?)',
+                                   (field, slug, encoded))
+        connection.execute('''
+            INSERT INTO sources (field, mtime_ns, dirty) VALUES (?, 0, 1)
+            ON CONFLICT(field) DO UPDATE SET dirty = 1
+        ''', (field,))
+
+
+def export(connection, field, data_dir=None):
+    """Write a field's JSON file (removed when the field is empty and the file optional)."""
+    path = _json_path(field, data_dir)
+    if not path:
+        return
+    data = read_field(connection, field)
+    if not data and field == 'generality_failures':
+        path.unlink(missing_ok=True)
+        with connection:
+            connection.execute('DELETE FROM sources WHERE field = ?', (field,))
+            connection.execute('DELETE FROM journal WHERE field = ?', (field,))
+        return
+    atomic_write_json(path, data, **FIELDS[field][1])
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO sources (field, mtime_ns, dirty) VALUES (?, ?, 0)',
+                           (field, path.stat().st_mtime_ns))
+        connection.execute('DELETE FROM journal WHERE field = ?', (field,))
+
+
+def refresh_components(connection, components_dir=None):
+    """Record which slugs have an article component, from one directory listing."""
+    components_dir = Path(components_dir or COMPONENTS_DIR)
+    present = {path.stem for path in components_dir.glob('*.tsx')} if components_dir.is_dir() else set()
+    with connection:
+        connection.execute('DELETE FROM components')
+    upsert(connection, 'components', {slug: True for slug in sorted(present)})
+    return present
+
+
+class FieldDict(dict):
+    """
+    One field loaded as a dict; changes go to the store on commit().
+
+    Use item assignment, del or pop to change it, then commit(); export()
+    also writes the field's JSON file. Other mutating dict methods are not
+    tracked.
+    """
+
+    def __init__(self, field, connection=None):
+        self.connection = connection or connect()
+        self.field = field
+        super().__init__(read_field(self.connection, field))
+        self._pending = {}
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._pending[key] = value
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._pending[key] = None
+
+    def pop(self, key, *default):
+        if key in self:
+            self._pending[key] = None
+        return super().pop(key, *default)
+
+    def commit(self):
+        if self._pending:
+            upsert(self.connection, self.field, self._pending)
+            self._pending = {}
+
+    def export(self):
+        self.commit()
+        export(self.connection, self.field)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the metadata store or export it to JSON.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Write the JSON files in src/data')
+    export_parser.add_argument('fields', nargs='*', help='Fields to export (default: all)')
+    get_parser = subparsers.add_parser('get', help='Print every field stored for a slug')
+    get_parser.add_argument('slug')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    connection = connect()
+    if args.command == 'export':
+        for field in args.fields or FIELDS:
+            export(connection, field)
+    else:
+        print(json.dumps(lookup(connection, args.slug), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
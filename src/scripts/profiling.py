@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import cProfile
+import logging
+import threading
+import tracemalloc
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Opt-in profiling shared by the scripts.
+#
+# --profile (or VOCAB_PROFILE=1, which _all.py --profile passes to every
+# stage) runs the script's work under cProfile and tracemalloc. At the end it
+# writes .cache/profiles/<script>-<time>.prof, for snakeviz or pstats, and
+# .alloc.txt with the top allocation sites, and logs both summaries together
+# with the time spent in each named span.
+#
+# Spans mark the phases worth watching (parse, vectorize, similarity, graph,
+# hierarchy and write in local-polyhierarchy.py; queue, request and persist
+# in the API scripts). span() works as a decorator or a with block, is
+# counted across threads, and costs one flag check when profiling is off.
+#
+#   python local-polyhierarchy.py --profile
+#   python -m pstats .cache/profiles/local-polyhierarchy-20250101-120000.prof
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROFILE_DIR = SCRIPT_DIR / '.cache' / 'profiles'
+ENV_VAR = 'VOCAB_PROFILE'
+TOP_N = 20
+TRACEMALLOC_FRAMES = 5
+# Re-take the allocation snapshot at a span boundary once traced memory has
+# grown this much past the last one, so the summary shows the sites live
+# near the peak rather than what is left at exit
+SNAPSHOT_GROWTH = 1.1
+
+_active = False
+_spans = defaultdict(lambda: [0, 0.0])  # name -> [calls, seconds]
+_lock = threading.Lock()
+_local = threading.local()
+_peak_snapshot = None  # (traced bytes, snapshot)
+
+
+def enabled(flag=False):
+    """Whether to profile: the --profile flag or the VOCAB_PROFILE environment variable."""
+    return flag or os.environ.get(ENV_VAR, '') not in ('', '0')
+
+
+def add_argument(parser):
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Profile the run (cProfile, tracemalloc and span timings) into {PROFILE_DIR}')
+
+
+@contextmanager
+def span(name):
+    """Time a named phase; nested spans of the same name on one thread count once."""
+    active_names = getattr(_local, 'names', None)
+    if active_names is None:
+        active_names = _local.names = set()
+    if not _active or name in active_names:
+        yield
+        return
+    active_names.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        active_names.discard(name)
+        with _lock:
+            _spans[name][0] += 1
+            _spans[name][1] += elapsed
+        _snapshot_if_grown()
+
+
+def _snapshot_if_grown():
+    global _peak_snapshot
+    current = tracemalloc.get_traced_memory()[0]
+    with _lock:
+        if _peak_snapshot and current < _peak_snapshot[0] * SNAPSHOT_GROWTH:
+            return
+        _peak_snapshot = (current, None)
+    snapshot = tracemalloc.take_snapshot()
+    with _lock:
+        if _peak_snapshot[0] == current:
+            _peak_snapshot = (current, snapshot)
+
+
+def span_summary():
+    """Lines describing every span recorded so far, longest total first."""
+    with _lock:
+        spans = sorted(_spans.items(), key=lambda item: -item[1][1])
+    return [f"{name:12} {calls:8} calls {seconds:10.3f}s total {seconds / calls * 1000:10.2f}ms mean"
+            for name, (calls, seconds) in spans]
+
+
+@contextmanager
+def profiled(flag=False, name=None):
+    """
+    Profile the enclosed work if flag is set or VOCAB_PROFILE is.
+
+    cProfile only sees the thread that enters the block; spans and
+    tracemalloc cover every thread.
+    """
+    global _active, _peak_snapshot
+    if not enabled(flag):
+        yield
+        return
+
+    name = name or Path(sys.argv[0]).stem
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    prefix = PROFILE_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+    _active = True
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        _active = False
+        _snapshot_if_grown()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot_bytes, snapshot = _peak_snapshot
+        tracemalloc.stop()
+        _peak_snapshot = None
+
+        profiler.dump_stats(f'{prefix}.prof')
+        allocations = [f"Traced memory: {current / 1e6:.1f}MB at exit, {peak / 1e6:.1f}MB peak; "
+                       f"sites live at {snapshot_bytes / 1e6:.1f}MB:"]
+        for stat in snapshot.statistics('lineno')[:TOP_N]:
+            frame = stat.traceback[0]
+            allocations.append(f"{stat.size / 1e6:10.2f}MB {stat.count:10} blocks  {frame.filename}:{frame.lineno}")
+        Path(f'{prefix}.alloc.txt').write_text('\n'.join(allocations) + '\n')
+
+        logging.info(f"Profile of {name}: {elapsed:.2f}s, written to {prefix}.prof")
+        for line in span_summary():
+            logging.info(f"  span {line}")
+        logging.info(f"Top {TOP_N} allocation sites (also in {prefix}.alloc.txt):")
+        for line in allocations:
+            logging.info(f"  {line}")
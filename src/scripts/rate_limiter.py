@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are still shared by threads, not processes
+    fcntl = None
+
+# Token-bucket rate limiting shared by every process calling the same API.
+#
+# Each API has two buckets, requests/min and tokens/min, stored in a small
+# JSON file under .cache/rate-limits and only touched while holding an
+# exclusive lock on its .lock file, so llm-years.py and llm-generality.py
+# running side by side draw from one quota. The buckets start from
+# conservative defaults and are corrected from the x-ratelimit-* headers of
+# every response; a 429 empties them for all processes at once. Within a
+# process, the number of requests in flight grows while the headers show
+# headroom and halves on a 429.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+STATE_DIR = SCRIPT_DIR / '.cache' / 'rate-limits'
+
+# Used until the first response reports the real limits
+DEFAULT_LIMITS = {
+    'openai': {'requests': 500, 'tokens': 200_000},
+}
+MAX_CONCURRENCY = 16
+# Remaining fraction of a limit above which concurrency may grow, and below which it shrinks
+HEADROOM_HIGH = 0.5
+HEADROOM_LOW = 0.1
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class ConcurrencyGate:
+    """Caps requests in flight in this process; the cap adapts between 1 and max_limit."""
+
+    def __init__(self, max_limit=MAX_CONCURRENCY):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def set_max(self, max_limit):
+        with self._condition:
+            self.max_limit = max(1, max_limit)
+            self.limit = min(self.limit, self.max_limit)
+
+    def adjust(self, headroom=None, throttled=False):
+        """Halve on a 429, step down when nearly out of quota, step up when there is room."""
+        with self._condition:
+            previous = self.limit
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+            elif headroom is not None and headroom < HEADROOM_LOW:
+                self.limit = max(1, self.limit - 1)
+            elif headroom is not None and headroom > HEADROOM_HIGH:
+                self.limit = min(self.max_limit, self.limit + 1)
+            if self.limit != previous:
+                logging.info(f"Concurrency {previous} -> {self.limit}")
+                self._condition.notify_all()
+
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets for one API, shared through a locked state file."""
+
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None, state_dir=STATE_DIR):
+        defaults = DEFAULT_LIMITS.get(name, {})
+        self.name = name
+        self.default_limits = {
+            'requests': requests_per_minute or defaults.get('requests'),
+            'tokens': tokens_per_minute or defaults.get('tokens'),
+        }
+        self.state_dir = Path(state_dir)
+        self.state_file = self.state_dir / f'{name}.json'
+        self.lock_file = self.state_dir / f'{name}.lock'
+        self.gate = ConcurrencyGate()
+        self._thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        """Read-modify-write the shared bucket state under the cross-process lock."""
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        with self._thread_lock, open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._read_state()
+                self._refill(state)
+                yield state
+                tmp_file = self.state_file.with_suffix(f'.{os.getpid()}.tmp')
+                tmp_file.write_text(json.dumps(state))
+                tmp_file.replace(self.state_file)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            state = json.loads(self.state_file.read_text())
+            if set(state.get('limits', {})) == set(self.default_limits):
+                return state
+        except (FileNotFoundError, ValueError):
+            pass
+        return {
+            'limits': dict(self.default_limits),
+            'available': {kind: limit for kind, limit in self.default_limits.items() if limit},
+            'updated': time.time(),
+        }
+
+    @staticmethod
+    def _refill(state):
+        now = time.time()
+        elapsed = max(0.0, now - state['updated'])
+        for kind, limit in state['limits'].items():
+            if limit:
+                available = state['available'].get(kind, limit)
+                state['available'][kind] = min(limit, available + elapsed * limit / 60)
+        state['updated'] = now
+
+    def acquire(self, tokens=0):
+        """Block until one request and `tokens` tokens are available, then take them."""
+        while True:
+            with self._locked_state() as state:
+                wait = 0.0
+                needed = {'requests': 1, 'tokens': tokens}
+                for kind, amount in needed.items():
+                    limit = state['limits'].get(kind)
+                    if not limit:
+                        continue
+                    # A request bigger than the whole bucket waits for a full bucket
+                    amount = min(amount, limit)
+                    shortfall = amount - state['available'].setdefault(kind, limit)
+                    if shortfall > 0:
+                        wait = max(wait, shortfall * 60 / limit)
+                if not wait:
+                    for kind, amount in needed.items():
+                        if state['limits'].get(kind):
+                            state['available'][kind] -= amount
+                    return
+            logging.debug(f"{self.name} rate limit: waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    def refund(self, tokens):
+        """Return (or, if negative, charge) the difference between estimated and actual tokens."""
+        if not tokens:
+            return
+        with self._locked_state() as state:
+            # The limit may have been learned from response headers only
+            limit = state['limits'].get('tokens')
+            if limit:
+                state['available']['tokens'] = min(limit, state['available'].get('tokens', limit) + tokens)
+
+    def update(self, headers, status=None):
+        """Correct the shared buckets from x-ratelimit-* headers and adapt concurrency."""
+        throttled = status == 429
+        headroom = None
+        with self._locked_state() as state:
+            for kind in state['limits']:
+                limit = headers.get(f'x-ratelimit-limit-{kind}')
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                try:
+                    limit = int(limit) if limit else None
+                    remaining = float(remaining) if remaining else None
+                except ValueError:
+                    continue
+                if limit:
+                    state['limits'][kind] = limit
+                if remaining is not None:
+                    # The server's count covers every client; never believe we have more
+                    state['available'][kind] = min(state['available'].get(kind, remaining), remaining)
+                    if state['limits'][kind]:
+                        ratio = remaining / state['limits'][kind]
+                        headroom = ratio if headroom is None else min(headroom, ratio)
+            if throttled:
+                for kind in state['available']:
+                    state['available'][kind] = 0.0
+        self.gate.adjust(headroom, throttled)
+
+    def slot(self):
+        return self.gate.slot()
+
+
+def get_limiter(name):
+    """The process-wide limiter for an API, created on first use."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name)
+        return _limiters[name]
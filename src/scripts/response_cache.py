@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+# Content-addressed cache of API responses.
+#
+# Entries are keyed by a SHA-256 of the canonical JSON of the request
+# (model, messages and every sampling parameter), so an identical request
+# is answered from disk and any change to the prompt or parameters misses.
+# The cache is a single SQLite file in WAL mode, safe to share between the
+# scripts; entries older than MAX_AGE_DAYS are dropped and, past MAX_BYTES,
+# the least recently used ones go first.
+#
+# --no-cache (or VOCAB_NO_CACHE=1) skips lookups; fresh responses are still
+# stored, so the cache is refreshed rather than left stale.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+CACHE_FILE = SCRIPT_DIR / '.cache' / 'responses.sqlite'
+MAX_AGE_DAYS = 180
+MAX_BYTES = 256 * 1024 * 1024
+
+stats = {'hits': 0, 'misses': 0}
+_enabled = os.environ.get('VOCAB_NO_CACHE', '') in ('', '0')
+_evicted = False
+_lock = threading.Lock()
+
+
+def disable():
+    """Bypass cache lookups for the rest of this process (the --no-cache flag)."""
+    global _enabled
+    _enabled = False
+
+
+def request_key(request):
+    """Hash of a request's canonical JSON form."""
+    canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _connect(cache_file=CACHE_FILE):
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(cache_file, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            used REAL NOT NULL
+        )
+    ''')
+    return connection
+
+
+def evict(max_age_days=MAX_AGE_DAYS, max_bytes=MAX_BYTES, cache_file=CACHE_FILE):
+    """Drop expired entries, then least recently used ones until under max_bytes."""
+    connection = _connect(cache_file)
+    try:
+        with connection:
+            expired = connection.execute('DELETE FROM responses WHERE created < ?',
+                                         (time.time() - max_age_days * 86400,)).rowcount
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            evicted = 0
+            if total > max_bytes:
+                for key, size in connection.execute('SELECT key, size FROM responses ORDER BY used').fetchall():
+                    if total <= max_bytes:
+                        break
+                    connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    total -= size
+                    evicted += 1
+        if expired or evicted:
+            logging.info(f"Response cache: dropped {expired} expired and {evicted} least recently used entries")
+    finally:
+        connection.close()
+
+
+def _evict_once():
+    global _evicted
+    with _lock:
+        if not _evicted:
+            _evicted = True
+            evict()
+
+
+def get(request):
+    """Cached response for a request, or None."""
+    if not _enabled:
+        return None
+    _evict_once()
+    key = request_key(request)
+    connection = _connect()
+    try:
+        with connection:
+            row = connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row:
+                connection.execute('UPDATE responses SET used = ? WHERE key = ?', (time.time(), key))
+    finally:
+        connection.close()
+    with _lock:
+        stats['hits' if row else 'misses'] += 1
+    return json.loads(row[0]) if row else None
+
+
+def put(request, response):
+    """Store a response (any JSON-serializable value) for a request."""
+    _evict_once()
+    payload = json.dumps(response, ensure_ascii=False)
+    now = time.time()
+    connection = _connect()
+    try:
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO responses (key, response, size, created, used) VALUES (?, ?, ?, ?, ?)',
+                (request_key(request), payload, len(payload.encode('utf-8')), now, now))
+    finally:
+        connection.close()
@@ -0,0 +1,101 @@
+import sys
+import logging
+import resource
+import numpy as np
+import scipy.sparse as sp
+from profiling import span
+
+# Chunked top-k similarity engine.
+#
+# Computes X @ X.T one block of rows at a time and keeps, for every row, its
+# k nearest neighbors plus every neighbor at or above min_similarity. Only a
+# (chunk x n) block is ever held densely, so memory grows linearly with the
+# corpus instead of quadratically.
+
+TOP_K = 10
+# Upper bound on the dense block held while selecting neighbors
+BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def chunk_rows(n_cols, block_bytes=BLOCK_BYTES):
+    """Number of rows per block so that one float32 block fits block_bytes."""
+    return max(1, block_bytes // (4 * max(n_cols, 1)))
+
+
+@span('similarity')
+def similarity_rows(X, rows, k=TOP_K, min_similarity=None, Y=None, chunk_size=None):
+    """
+    Top-k cosine neighbors for the given rows of X against every row of Y.
+
+    X and Y must be l2-normalized (sparse or dense); Y defaults to X and self
+    matches are excluded. Returns a CSR matrix of shape (len(rows), len(Y))
+    holding each row's k best neighbors plus any neighbor with similarity
+    >= min_similarity.
+    """
+    Y = X if Y is None else Y
+    rows = np.asarray(rows, dtype=np.intp)
+    n_cols = Y.shape[0]
+    chunk_size = chunk_size or chunk_rows(n_cols)
+    k = min(k, n_cols - 1)
+    YT = Y.T.tocsr() if sp.issparse(Y) else Y.T
+
+    out_rows, out_cols, out_vals = [], [], []
+    largest_block = 0
+    for start in range(0, len(rows), chunk_size):
+        block_rows = rows[start:start + chunk_size]
+        block = X[block_rows] @ YT
+        block = block.toarray() if sp.issparse(block) else np.asarray(block)
+        block = block.astype(np.float32, copy=False)
+        largest_block = max(largest_block, block.nbytes)
+
+        local = np.arange(len(block_rows))
+        if Y is X:
+            block[local, block_rows] = -np.inf
+
+        keep = np.zeros(block.shape, dtype=bool)
+        if k > 0:
+            top = np.argpartition(block, -k, axis=1)[:, -k:]
+            keep[local[:, None], top] = True
+        if min_similarity is not None:
+            keep |= block >= min_similarity
+        keep &= block > 0
+
+        r, c = np.nonzero(keep)
+        out_rows.append(r + start)
+        out_cols.append(c)
+        out_vals.append(block[r, c])
+
+    result = sp.csr_matrix(
+        (np.concatenate(out_vals) if out_vals else np.zeros(0, dtype=np.float32),
+         (np.concatenate(out_rows) if out_rows else np.zeros(0, dtype=np.intp),
+          np.concatenate(out_cols) if out_cols else np.zeros(0, dtype=np.intp))),
+        shape=(len(rows), n_cols),
+    )
+    logging.info(f"Similarity: {len(rows)} rows x {n_cols} cols, kept {result.nnz} neighbors, "
+                 f"chunk {chunk_size} rows, largest block {largest_block / 1e6:.1f} MB, "
+                 f"peak RSS {peak_rss_mb():.0f} MB")
+    return result
+
+
+@span('similarity')
+def topk_similarity(X, k=TOP_K, min_similarity=None, chunk_size=None):
+    """
+    Symmetric sparse neighbor graph over all rows of X.
+
+    An entry (i, j) is kept when j is among i's top-k, i is among j's top-k,
+    or their similarity is at least min_similarity.
+    """
+    S = similarity_rows(X, np.arange(X.shape[0]), k, min_similarity, chunk_size=chunk_size)
+    return symmetrize(S)
+
+
+def symmetrize(S):
+    """Union of S and S.T, keeping the larger value where both are present."""
+    return sp.csr_matrix(S.maximum(S.T))
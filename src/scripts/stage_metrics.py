@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import atexit
+import logging
+import argparse
+import threading
+from pathlib import Path
+from collections import Counter
+
+# Per-stage performance records for the pipeline in _all.py.
+#
+# _all.py measures each stage from the outside (wall time, CPU time and peak
+# RSS from wait4) and hands the stage a file to report its own counters in
+# through VOCAB_STAGE_METRICS. A script calls count() for the items it
+# processes, skips or fails on (a stage with failed items is run again on
+# the next pipeline run); http_client.py counts API calls and tokens, and the
+# response cache hits and misses and /proc/self/io byte counts are added at
+# exit. The runner appends one JSON line per stage and run to RUNS_FILE.
+#
+#   python stage_metrics.py compare            # latest run against the one before
+#   python stage_metrics.py compare RUN1 RUN2  # two given run ids
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+RUNS_FILE = SCRIPT_DIR / '.cache' / 'stage-runs.jsonl'
+ENV_VAR = 'VOCAB_STAGE_METRICS'
+
+# Flag a metric whose new value exceeds the old by this factor, provided the
+# absolute change is also above the floor (so 0.1s -> 0.3s is not news)
+REGRESSION_FACTOR = 1.5
+REGRESSION_FLOORS = {
+    'wall_s': 1.0,
+    'user_s': 1.0,
+    'sys_s': 1.0,
+    'peak_rss_mb': 50,
+    'api_calls': 10,
+    'tokens': 10000,
+    'bytes_read': 10 * 1024 * 1024,
+    'bytes_written': 10 * 1024 * 1024,
+}
+
+counters = Counter()
+_lock = threading.Lock()
+
+
+def count(name, n=1):
+    """Add n to one of this process's counters (e.g. 'items_processed')."""
+    with _lock:
+        counters[name] += n
+
+
+def _proc_io():
+    """Bytes this process read and wrote through system calls, from /proc/self/io."""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return {'bytes_read': int(fields['rchar']), 'bytes_written': int(fields['wchar'])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def snapshot():
+    """Everything this process has counted so far."""
+    with _lock:
+        metrics = dict(counters)
+    response_cache = sys.modules.get('response_cache')
+    if response_cache:
+        metrics['cache_hits'] = response_cache.stats['hits']
+        metrics['cache_misses'] = response_cache.stats['misses']
+    metrics.update(_proc_io())
+    return metrics
+
+
+def _write_at_exit():
+    path = os.environ.get(ENV_VAR)
+    if not path:
+        return
+    try:
+        with open(path, 'w') as f:
+            json.dump(snapshot(), f)
+    except OSError as e:
+        logging.warning(f"Could not write stage metrics to {path}: {e}")
+
+
+atexit.register(_write_at_exit)
+
+
+def append_record(record, runs_file=RUNS_FILE):
+    runs_file = Path(runs_file)
+    runs_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(runs_file, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def load_runs(runs_file=RUNS_FILE):
+    """{run_id: {stage: record}} in the order the runs were recorded."""
+    runs = {}
+    try:
+        with open(runs_file) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    runs.setdefault(record['run_id'], {})[record['stage']] = record
+    except FileNotFoundError:
+        pass
+    return runs
+
+
+def compare(base, new, factor=REGRESSION_FACTOR):
+    """
+    Rows comparing two runs, stage by stage.
+
+    Returns [(stage, metric, old, new, regressed)] for every metric both
+    runs measured for stages that ran to completion in both.
+    """
+    rows = []
+    for stage in new:
+        old_record, new_record = base.get(stage), new[stage]
+        if not old_record or old_record['status'] != 'ok' or new_record['status'] != 'ok':
+            continue
+        for metric, new_value in new_record.items():
+            old_value = old_record.get(metric)
+            if not isinstance(new_value, (int, float)) or not isinstance(old_value, (int, float)):
+                continue
+            floor = REGRESSION_FLOORS.get(metric)
+            regressed = (floor is not None and new_value > old_value * factor
+                         and new_value - old_value > floor)
+            rows.append((stage, metric, old_value, new_value, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-stage pipeline run records.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subparsers.add_parser('compare', help='Compare two runs and flag regressions')
+    compare_parser.add_argument('runs', nargs='*', help='Base and new run ids (default: the last two runs)')
+    compare_parser.add_argument('--factor', type=float, default=REGRESSION_FACTOR,
+                                help='Flag metrics that grew by more than this factor')
+    compare_parser.add_argument('--all', action='store_true', help='Show unchanged metrics too')
+    subparsers.add_parser('list', help='List recorded run ids')
+    args = parser.parse_args()
+
+    runs = load_runs()
+    if args.command == 'list':
+        for run_id, stages in runs.items():
+            statuses = ', '.join(f"{stage}:{record['status']}" for stage, record in stages.items())
+            print(f"{run_id}  {statuses}")
+        return
+
+    if args.runs and len(args.runs) != 2:
+        parser.error('give two run ids, or none to compare the last two runs')
+    run_ids = args.runs or list(runs)[-2:]
+    if len(run_ids) < 2 or any(run_id not in runs for run_id in run_ids):
+        sys.exit(f"Need two recorded runs to compare (have {len(runs)}: see `stage_metrics.py list`)")
+
+    base_id, new_id = run_ids
+    print(f"Comparing {new_id} against {base_id}")
+    rows = compare(runs[base_id], runs[new_id], args.factor)
+    regressions = 0
+    for stage, metric, old_value, new_value, regressed in rows:
+        if not (args.all or regressed or old_value != new_value):
+            continue
+        ratio = f"{new_value / old_value:.2f}x" if old_value else "new"
+        marker = "  REGRESSION" if regressed else ""
+        print(f"  {stage:28} {metric:16} {old_value:>14,.2f} -> {new_value:>14,.2f}  ({ratio}){marker}")
+        regressions += regressed
+    print(f"{regressions} regression(s)")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import functools
+from pathlib import Path
+import numpy as np
+from tokenizer import analyze
+
+# Memory-mapped store of per-term LSA vectors, written by
+# local-polyhierarchy.py --vectors (or --backend lsa), plus a nearest-terms lookup that works from the
+# store alone (no sklearn, no corpus parse):
+#
+#   python term_vectors.py attention-mechanism
+#   python term_vectors.py "models that retrieve documents before answering" -k 5
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+STORE_DIR = SCRIPT_DIR / '.cache' / 'term-vectors'
+DEFAULT_K = 10
+
+
+def write_store(slugs, titles, vectors, components, vocabulary, idf, store_dir=STORE_DIR):
+    """
+    Write the vector store so that readers never see a partial one.
+
+    The arrays go into a new version directory and index.json, swapped in
+    last, names it; the version it replaced is kept for readers that opened
+    the old index just before, older ones are removed.
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    previous = _read_index(store_dir).get('version')
+    version = f'v{time.time_ns()}-{os.getpid()}'
+    (store_dir / version).mkdir()
+    np.save(store_dir / version / 'vectors.npy', np.ascontiguousarray(vectors, dtype=np.float32))
+    np.save(store_dir / version / 'components.npy', np.ascontiguousarray(components, dtype=np.float32))
+    np.save(store_dir / version / 'idf.npy', np.asarray(idf, dtype=np.float32))
+    tmp_file = store_dir / f'.index.json.{os.getpid()}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': version,
+            'slugs': list(slugs),
+            'titles': list(titles),
+            'vocabulary': sorted(vocabulary, key=vocabulary.get),
+        }, f, ensure_ascii=False)
+    tmp_file.replace(store_dir / 'index.json')
+
+    for path in store_dir.iterdir():
+        if path.is_dir() and path.name not in (version, previous):
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.suffix == '.npy' and previous:
+            # Arrays of the old unversioned layout, no longer named by any index
+            path.unlink(missing_ok=True)
+
+
+def _read_index(store_dir):
+    try:
+        with open(Path(store_dir) / 'index.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+@functools.lru_cache(maxsize=None)
+def load_store(store_dir=STORE_DIR):
+    """Open the store; the arrays are memory-mapped, not read into memory."""
+    store_dir = Path(store_dir)
+    with open(store_dir / 'index.json', 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    arrays_dir = store_dir / index.get('version', '')
+    return {
+        'slugs': index['slugs'],
+        'titles': index['titles'],
+        'rows': {slug: i for i, slug in enumerate(index['slugs'])},
+        'vocabulary': {token: i for i, token in enumerate(index['vocabulary'])},
+        'vectors': np.load(arrays_dir / 'vectors.npy', mmap_mode='r'),
+        'components': np.load(arrays_dir / 'components.npy', mmap_mode='r'),
+        'idf': np.load(arrays_dir / 'idf.npy', mmap_mode='r'),
+    }
+
+
+def text_vector(store, text):
+    """Project free text into the store's LSA space the same way articles were."""
+    counts = {}
+    for token in analyze(text):
+        col = store['vocabulary'].get(token)
+        if col is not None:
+            counts[col] = counts.get(col, 0) + 1
+    if not counts:
+        return None
+    cols = np.fromiter(counts.keys(), dtype=np.intp)
+    weights = np.fromiter(counts.values(), dtype=np.float32) * store['idf'][cols]
+    weights /= np.linalg.norm(weights)
+    vector = store['components'][:, cols] @ weights
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def nearest_terms(query, k=DEFAULT_K, store_dir=STORE_DIR):
+    """
+    Top-k most similar terms for a slug, or for free text if query is not a slug.
+
+    Returns a list of {'slug', 'title', 'similarity'} dicts, best first.
+    """
+    store = load_store(store_dir)
+    row = store['rows'].get(query)
+    vector = store['vectors'][row] if row is not None else text_vector(store, query)
+    if vector is None:
+        return []
+
+    scores = store['vectors'] @ vector
+    if row is not None:
+        scores[row] = -np.inf
+    k = min(k, len(scores) - (row is not None))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [
+        {'slug': store['slugs'][i], 'title': store['titles'][i], 'similarity': round(float(scores[i]), 4)}
+        for i in top
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the terms most similar to a slug or to free text.')
+    parser.add_argument('query', help='An article slug, or any text describing a concept')
+    parser.add_argument('-k', type=int, default=DEFAULT_K, help='Number of terms to return')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    try:
+        results = nearest_terms(args.query, args.k)
+    except FileNotFoundError:
+        parser.error(f"No term vector store in {STORE_DIR}; run local-polyhierarchy.py --vectors first")
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+    if not results:
+        print("No similar terms found.")
+    for result in results:
+        print(f"{result['similarity']:.3f}  {result['slug']:<45} {result['title']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+import numpy as np
+import scipy.sparse as sp
+from similarity import TOP_K, similarity_rows, topk_similarity, symmetrize
+from ann_index import ivf_similarity, recall_check
+from tokenizer import analyze
+from profiling import span
+
+# Persisted TF-IDF index for the polyhierarchy stage.
+#
+# Mirrors sklearn's TfidfVectorizer defaults (lowercase, token pattern
+# \b\w\w+\b, smooth idf, l2 norm) but keeps the vocabulary, raw term counts,
+# document frequencies and the sparse neighbor graph on disk so that a run
+# after a handful of article edits only recomputes the rows that can have
+# changed.
+#
+# With the 'lsa' backend, or when the term-vector store is wanted, every term
+# also gets a fixed-size LSA vector: the TF-IDF row projected onto a few
+# hundred TruncatedSVD components (saved in state.npz). The 'lsa' backend
+# compares terms by these vectors, so neighbors come from dense float32
+# GEMMs; the 'tfidf' backend keeps comparing raw TF-IDF rows and skips the
+# SVD unless vectors are asked for.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+STATE_DIR = SCRIPT_DIR / '.cache' / 'polyhierarchy'
+STATE_VERSION = 5
+
+# Fall back to a full rebuild when more than this share of rows is affected
+FULL_REBUILD_RATIO = 0.5
+# Pairs are stored down to threshold - NEAR_THRESHOLD_BAND so that idf drift
+# smaller than the band can never lift an unstored pair over the threshold
+NEAR_THRESHOLD_BAND = 0.05
+
+BACKENDS = ['tfidf', 'lsa']
+LSA_COMPONENTS = 300
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+@span('vectorize')
+def count_matrix(texts, vocabulary):
+    """
+    Build a CSR term-count matrix for texts.
+
+    vocabulary maps token -> column and is extended in place with tokens that
+    have not been seen before, so existing columns never move.
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for text in texts:
+        row = {}
+        for token in analyze(text):
+            col = vocabulary.get(token)
+            if col is None:
+                col = vocabulary[token] = len(vocabulary)
+            row[col] = row.get(col, 0) + 1
+        indices.extend(row.keys())
+        data.extend(row.values())
+        indptr.append(len(indices))
+    return sp.csr_matrix(
+        (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+        shape=(len(texts), len(vocabulary)),
+    )
+
+
+@span('vectorize')
+def compute_idf(counts):
+    """Smoothed inverse document frequency, as in TfidfTransformer."""
+    n_docs = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    return np.log((1 + n_docs) / (1 + df)) + 1
+
+
+@span('vectorize')
+def tfidf(counts, idf):
+    """Weight counts by idf and l2-normalize each row."""
+    X = sp.csr_matrix(counts.multiply(idf.reshape(1, -1)))
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.csr_matrix(sp.diags(1 / norms) @ X)
+
+
+@span('vectorize')
+def fit_lsa(X, n_components=LSA_COMPONENTS):
+    """TruncatedSVD components (float32, components x terms) for the TF-IDF rows."""
+    from sklearn.decomposition import TruncatedSVD
+
+    n_components = max(1, min(n_components, X.shape[0] - 1, X.shape[1] - 1))
+    svd = TruncatedSVD(n_components=n_components, random_state=0)
+    svd.fit(X)
+    logging.info(f"LSA: {n_components} components explain "
+                 f"{svd.explained_variance_ratio_.sum():.1%} of the variance")
+    return svd.components_.astype(np.float32)
+
+
+@span('vectorize')
+def project(X, components):
+    """Project TF-IDF rows onto the LSA components and l2-normalize them."""
+    vectors = np.asarray(X @ components.T, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _row_norms(M):
+    if sp.issparse(M):
+        return np.sqrt(np.asarray(M.multiply(M).sum(axis=1)).ravel())
+    return np.linalg.norm(M, axis=1)
+
+
+def build_index(keys, texts, threshold, ann_probe=None, backend='tfidf', with_vectors=False):
+    """
+    Fit the index from scratch and compute the full neighbor graph.
+
+    backend 'lsa' compares terms by their LSA vectors instead of raw TF-IDF;
+    other backends only fit LSA when with_vectors is set. With ann_probe set
+    the graph comes from the approximate IVF index, probing that many
+    inverted lists per row, and its recall is checked on a sample.
+    """
+    vocabulary = {}
+    counts = count_matrix(texts, vocabulary)
+    idf = compute_idf(counts)
+    X = tfidf(counts, idf)
+
+    components = vectors = None
+    if backend == 'lsa' or with_vectors:
+        components = fit_lsa(X)
+        vectors = project(X, components)
+    compared = vectors if backend == 'lsa' else X
+
+    if ann_probe:
+        similarity = ivf_similarity(compared, TOP_K, threshold - NEAR_THRESHOLD_BAND, n_probe=ann_probe)
+        recall_check(compared, similarity, TOP_K, threshold)
+    else:
+        similarity = topk_similarity(compared, TOP_K, threshold - NEAR_THRESHOLD_BAND)
+    return {
+        'keys': list(keys),
+        'hashes': [text_hash(text) for text in texts],
+        'backend': backend,
+        'threshold': threshold,
+        'vocabulary': vocabulary,
+        'counts': counts,
+        'idf': idf,
+        'components': components,
+        'vectors': vectors,
+        'similarity': similarity,
+        'ann_probe': ann_probe,
+        'incremental_runs': 0,
+    }
+
+
+def update_index(state, keys, texts, threshold):
+    """
+    Bring a persisted index up to date with the current documents.
+
+    Rows are recomputed for documents that were added or changed, plus any
+    unchanged document whose idf-induced drift could move one of its
+    similarities across threshold. Everything else is carried over as is.
+    In the lsa backend new documents are folded into the existing SVD basis.
+    A fallback full rebuild uses the approximate index if the state was
+    built with one. Returns the new state, the number of recomputed rows
+    and whether the state changed at all (removals and reordering change it
+    without recomputing anything).
+    """
+    old_pos = {key: i for i, key in enumerate(state['keys'])}
+    hashes = [text_hash(text) for text in texts]
+    n_docs = len(keys)
+
+    kept_new, kept_old, dirty = [], [], []
+    for i, (key, digest) in enumerate(zip(keys, hashes)):
+        j = old_pos.get(key)
+        if j is not None and state['hashes'][j] == digest:
+            kept_new.append(i)
+            kept_old.append(j)
+        else:
+            dirty.append(i)
+    removed = len(set(state['keys']) - set(keys))
+    if not dirty and not removed and list(keys) == state['keys']:
+        logging.info("TF-IDF index is up to date")
+        return state, 0, False
+
+    kept_new = np.asarray(kept_new, dtype=np.intp)
+    kept_old = np.asarray(kept_old, dtype=np.intp)
+    dirty = np.asarray(dirty, dtype=np.intp)
+
+    # Count only the new or changed texts; new tokens get new columns
+    vocabulary = state['vocabulary']
+    dirty_counts = count_matrix([texts[i] for i in dirty], vocabulary)
+    n_terms = len(vocabulary)
+
+    old_counts = state['counts'][kept_old]
+    old_counts.resize((len(kept_old), n_terms))
+    order = np.argsort(np.concatenate([kept_new, dirty]))
+    counts = sp.csr_matrix(sp.vstack([old_counts, dirty_counts])[order])
+
+    old_idf = np.concatenate([state['idf'], np.zeros(n_terms - len(state['idf']))])
+    idf = compute_idf(counts)
+    X = tfidf(counts, idf)
+
+    # Tokens first seen in this run have no weight in the old basis
+    components = vectors = None
+    if state['components'] is not None:
+        components = np.pad(state['components'], ((0, 0), (0, n_terms - state['components'].shape[1])))
+        vectors = project(X, components)
+    lsa = state['backend'] == 'lsa'
+    compared = vectors if lsa else X
+
+    # How far each unchanged vector moved because the idf weights shifted;
+    # |a'.b' - a.b| <= |a'-a| + |b'-b| bounds the change of any similarity.
+    drift = np.zeros(n_docs)
+    if len(kept_new):
+        X_old = tfidf(counts[kept_new], old_idf)
+        if lsa:
+            X_old = project(X_old, components)
+        drift[kept_new] = _row_norms(compared[kept_new] - X_old)
+
+    # Carry the stored neighbor pairs between unchanged documents over
+    kept = state['similarity'][kept_old][:, kept_old].tocoo()
+    rows, cols, vals = kept_new[kept.row], kept_new[kept.col], kept.data
+
+    # A stored pair can only cross the threshold when its margin is within
+    # the two rows' drift; unstored pairs sit at least NEAR_THRESHOLD_BAND
+    # below it, so they can only cross for rows drifting by half the band.
+    near = np.abs(vals - threshold) <= drift[rows] + drift[cols]
+    crossing = np.union1d(np.union1d(rows[near], cols[near]),
+                          kept_new[drift[kept_new] >= NEAR_THRESHOLD_BAND / 2])
+    affected = np.union1d(dirty, crossing)
+
+    logging.info(f"TF-IDF index: {len(dirty)} new or changed, {removed} removed, "
+                 f"{len(crossing)} drifted near the threshold")
+
+    if len(affected) > FULL_REBUILD_RATIO * n_docs:
+        logging.info("Too many affected rows, rebuilding the full index")
+        return build_index(keys, texts, threshold, ann_probe=state['ann_probe'], backend=state['backend'],
+                           with_vectors=state['components'] is not None), n_docs, True
+
+    is_affected = np.zeros(n_docs, dtype=bool)
+    is_affected[affected] = True
+    untouched = ~(is_affected[rows] | is_affected[cols])
+    carried = sp.csr_matrix((vals[untouched], (rows[untouched], cols[untouched])),
+                            shape=(n_docs, n_docs))
+
+    recomputed = similarity_rows(compared, affected, TOP_K, threshold - NEAR_THRESHOLD_BAND).tocoo()
+    fresh = sp.csr_matrix((recomputed.data, (affected[recomputed.row], recomputed.col)),
+                          shape=(n_docs, n_docs))
+    similarity = sp.csr_matrix(carried.maximum(symmetrize(fresh)))
+
+    state = {
+        'keys': list(keys),
+        'hashes': hashes,
+        'backend': state['backend'],
+        'threshold': threshold,
+        'vocabulary': vocabulary,
+        'counts': counts,
+        'idf': idf,
+        'components': components,
+        'vectors': vectors,
+        'similarity': similarity,
+        'ann_probe': state['ann_probe'],
+        'incremental_runs': state['incremental_runs'] + 1,
+    }
+    return state, len(affected), True
+
+
+def load_state(state_dir=STATE_DIR):
+    """Load a persisted index, or return None if there is no usable one."""
+    state_dir = Path(state_dir)
+    try:
+        with open(state_dir / 'state.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    try:
+        if meta.get('version') != STATE_VERSION:
+            return None
+        arrays = np.load(state_dir / 'state.npz')
+        vocabulary = {token: i for i, token in enumerate(meta['vocabulary'])}
+        counts = sp.csr_matrix(
+            (arrays['counts_data'], arrays['counts_indices'], arrays['counts_indptr']),
+            shape=(len(meta['keys']), len(vocabulary)),
+        )
+        similarity = sp.csr_matrix(
+            (arrays['similarity_data'], arrays['similarity_indices'], arrays['similarity_indptr']),
+            shape=(len(meta['keys']), len(meta['keys'])),
+        )
+        if arrays['stamp'] != meta['stamp']:
+            raise ValueError("state.npz does not belong to state.json")
+        components = vectors = None
+        if meta['lsa']:
+            components = arrays['components']
+            vectors = arrays['vectors']
+        return {
+            'keys': meta['keys'],
+            'hashes': meta['hashes'],
+            'backend': meta['backend'],
+            'threshold': meta['threshold'],
+            'vocabulary': vocabulary,
+            'counts': counts,
+            'idf': arrays['idf'],
+            'components': components,
+            'vectors': vectors,
+            'similarity': similarity,
+            'ann_probe': meta.get('ann_probe'),
+            'incremental_runs': meta['incremental_runs'],
+        }
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError) as e:
+        logging.warning(f"Ignoring unusable TF-IDF index in {state_dir}: {e}")
+        return None
+
+
+def save_state(state, state_dir=STATE_DIR):
+    """
+    Persist the index so the next run can update it incrementally.
+
+    Each file is written under a temporary name and moved into place, the
+    arrays before state.json. Both carry the same stamp, so an interrupted
+    save leaves a pair that load_state rejects rather than trusts.
+    """
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    stamp = f'{time.time_ns()}-{os.getpid()}'
+    counts = state['counts']
+    similarity = state['similarity']
+    lsa = {}
+    if state['components'] is not None:
+        lsa = {'components': state['components'], 'vectors': state['vectors']}
+    tmp_file = state_dir / f'.state.npz.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(
+            f,
+            stamp=stamp,
+            counts_data=counts.data,
+            counts_indices=counts.indices,
+            counts_indptr=counts.indptr,
+            idf=state['idf'],
+            similarity_data=similarity.data,
+            similarity_indices=similarity.indices,
+            similarity_indptr=similarity.indptr,
+            **lsa,
+        )
+    os.replace(tmp_file, state_dir / 'state.npz')
+    vocabulary = sorted(state['vocabulary'], key=state['vocabulary'].get)
+    tmp_file = state_dir / f'.state.json.{os.getpid()}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': STATE_VERSION,
+            'stamp': stamp,
+            'keys': state['keys'],
+            'hashes': state['hashes'],
+            'backend': state['backend'],
+            'threshold': state['threshold'],
+            'vocabulary': vocabulary,
+            'ann_probe': state['ann_probe'],
+            'lsa': state['components'] is not None,
+            'incremental_runs': state['incremental_runs'],
+        }, f, ensure_ascii=False)
+    os.replace(tmp_file, state_dir / 'state.json')
+    # Vectors lived in a file of their own before STATE_VERSION 5
+    (state_dir / 'vectors.npy').unlink(missing_ok=True)
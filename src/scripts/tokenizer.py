@@ -0,0 +1,11 @@
+import re
+
+# Tokenization shared by the TF-IDF index and the term-vector lookup. Kept in
+# its own module so that querying the vector store does not import scipy.
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def analyze(text):
+    """Split text into tokens exactly like TfidfVectorizer's default analyzer."""
+    return TOKEN_PATTERN.findall(text.lower())